@@ -0,0 +1,111 @@
+"""
+	Peak memory and time of typical chains of processing calls, comparing the
+	in-place and out-of-place policy of _processing against the previous copying implementation
+
+	Run from the repository root with:
+		python -m benchmarks.bench_processing
+"""
+import os, sys, tempfile, time, tracemalloc
+
+import numpy as np
+import xarray as xr
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from output_dataset import DataOutput as qp
+from output_dataset.DataOutput import Parameter, JSONParameterStore, _processing
+
+def make_dataset(shape=(2000,2000), n_vars:int=2)->xr.Dataset:
+	coords = {f'bench_x{idx}': np.linspace(-1, 1, size) for idx,size in enumerate(shape)}
+	data_vars = {f'bench_v{idx}': (tuple(coords), np.random.rand(*shape)) for idx in range(n_vars)}
+	return xr.Dataset(data_vars, coords=coords)
+
+class CopyingProcessing():
+	## The previous implementation: multiply and the offsets return new arrays, normalize works in place
+	@staticmethod
+	def multiply(data_output, multiplier):
+		data_output.datasets = [dataset*multiplier for dataset in data_output.datasets]
+
+	@staticmethod
+	def normalize(data_output):
+		for dataset in data_output.datasets:
+			for key in dataset.data_vars:
+				dataset[key] -= np.min(dataset[key])
+				dataset[key] /= np.max(dataset[key])
+
+	@staticmethod
+	def adjust_data_offset(data_output, offset):
+		for dataset in data_output.datasets:
+			for key in list(dataset.data_vars):
+				dataset[key] = dataset[key] - offset
+
+	@staticmethod
+	def adjust_axis(data_output, mapping):
+		_processing.adjust_axis(data_output, mapping, inplace=False)
+
+def run_chain(data_output, steps)->None:
+	for step in steps:
+		step(data_output)
+
+def offset_all(data_output, offset:float, **kwargs)->None:
+	## adjust_data_offset works on a single variable of a dataset
+	for idx,dataset in enumerate(data_output.datasets):
+		for key in list(dataset.data_vars):
+			dataset = _processing.adjust_data_offset(dataset, key, offset, **kwargs)
+		data_output.datasets[idx] = dataset
+
+def chains(processing, **kwargs)->dict:
+	if processing is _processing:
+		offset = lambda data_output: offset_all(data_output, 0.5, **kwargs)
+	else:
+		offset = lambda data_output: processing.adjust_data_offset(data_output, 0.5)
+	return {
+		'normalize > multiply': [
+			lambda data_output: processing.normalize(data_output, **kwargs),
+			lambda data_output: processing.multiply(data_output, 1e3, **kwargs),
+		],
+		'multiply > offset > centre > normalize > multiply': [
+			lambda data_output: processing.multiply(data_output, 2, **kwargs),
+			offset,
+			lambda data_output: processing.adjust_axis(data_output, 'centre', **kwargs),
+			lambda data_output: processing.normalize(data_output, **kwargs),
+			lambda data_output: processing.multiply(data_output, 1e-3, **kwargs),
+		],
+	}
+
+def measure(dataset:xr.Dataset, steps)->tuple:
+	## Peak memory allocated on top of the input data, the run time and the result of a chain
+	data_output = qp.DataOutput(dataset.copy(deep=True), reformat=False)
+	tracemalloc.start()
+	tracemalloc.reset_peak()
+	start = time.perf_counter()
+	run_chain(data_output, steps)
+	elapsed = time.perf_counter() - start
+	current,peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return peak, elapsed, data_output.datasets
+
+def run(shape=(2000,2000))->None:
+	## Keep the benchmark parameters out of the parameter file of the package
+	Parameter.use_store(JSONParameterStore(os.path.join(tempfile.mkdtemp(), 'verbose_params.json')))
+	dataset = make_dataset(shape)
+	print(f"Input: {dataset.nbytes/1024**2:.0f} MB")
+	implementations = {
+		'copying': (CopyingProcessing, {}),
+		'in place': (_processing, {'inplace': True}),
+		'out of place': (_processing, {'inplace': False}),
+	}
+	print(f"{'chain':<52} {'policy':>12} {'peak (MB)':>10} {'time (ms)':>10}")
+	for name in chains(_processing):
+		peaks, results = {}, {}
+		for policy,(processing,kwargs) in implementations.items():
+			peaks[policy],elapsed,results[policy] = measure(dataset, chains(processing, **kwargs)[name])
+			print(f"{name:<52} {policy:>12} {peaks[policy]/1024**2:>10.1f} {elapsed*1e3:>10.1f}")
+		## Every policy computes the same data as the previous implementation,
+		## in place the chain allocates less memory than the size of the input data
+		for policy,result in results.items():
+			for processed,expected in zip(result, results['copying']):
+				xr.testing.assert_allclose(processed, expected)
+		assert peaks['in place'] < dataset.nbytes, f"'{name}' in place allocated {peaks['in place']/1024**2:.1f} MB"
+
+if __name__ == '__main__':
+	run()
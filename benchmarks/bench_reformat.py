@@ -0,0 +1,75 @@
+"""
+	Compare the reformat engine against the previous per-coordinate implementation
+	on synthetic datasets with an increasing number of data variables
+
+	Run from the repository root with:
+		python -m benchmarks.bench_reformat
+"""
+import os, sys, tempfile, timeit
+
+import numpy as np
+import xarray as xr
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from output_dataset import DataOutput as qp
+from output_dataset.DataOutput import Parameter, JSONParameterStore, _reformat_dataset
+
+def make_dataset(n_vars:int, shape=(500,500))->xr.Dataset:
+	coords = {f'bench_x{idx}': np.linspace(0, 1, size) for idx,size in enumerate(shape)}
+	data_vars = {f'bench_v{idx}': (tuple(coords), np.random.rand(*shape)) for idx in range(n_vars)}
+	return xr.Dataset(data_vars, coords=coords)
+
+def reformat_loop(dataset:xr.Dataset)->xr.Dataset:
+	## The previous implementation: one assign_coords per coordinate and two passes per variable
+	coord_keys = dataset.coords
+	for key in coord_keys:
+		parameter = Parameter[key]
+		old_attrs = dataset[key].attrs
+		dataset = dataset.assign_coords({f'{key}': (dataset[key].values - parameter.offset)*parameter.scale})
+		dataset[key].attrs = old_attrs
+	for key in coord_keys:
+		parameter = Parameter[key]
+		dataset[key].attrs['long_name'] = parameter.verbose_name
+		dataset[key].attrs['unit'] = parameter.unit
+		dataset[key].attrs['units'] = parameter.unit
+	for key in dataset.data_vars:
+		parameter = Parameter[key]
+		dataset[key].attrs['long_name'] = parameter.verbose_name
+		dataset[key].attrs['unit'] = parameter.unit
+		dataset[key].attrs['units'] = parameter.unit
+		dataset[key].values -= parameter.offset
+		dataset[key].values *= parameter.scale
+	return dataset
+
+def setup_parameters(n_vars:int)->None:
+	## Half of the variables are rescaled, the other half use the identity
+	for idx in range(n_vars):
+		key = f'bench_v{idx}'
+		if key not in Parameter._instances:
+			Parameter(key, scale = 1e9 if idx%2 else 1, offset = 1e-3 if idx%2 else 0)
+	for idx in range(2):
+		key = f'bench_x{idx}'
+		if key not in Parameter._instances:
+			Parameter(key, scale = 1e3)
+
+def run(n_vars_list=(1,10,50), repeat:int=5)->None:
+	## Keep the benchmark parameters out of the parameter file of the package
+	Parameter.use_store(JSONParameterStore(os.path.join(tempfile.mkdtemp(), 'verbose_params.json')))
+
+	print(f"{'variables':>10} {'loop (ms)':>12} {'engine (ms)':>12} {'speedup':>8}")
+	for n_vars in n_vars_list:
+		setup_parameters(n_vars)
+		dataset = make_dataset(n_vars)
+		reference = reformat_loop(dataset.copy(deep=True))
+		result = _reformat_dataset(dataset.copy(deep=True))
+		assert all(np.allclose(reference[key].values, result[key].values) for key in reference.variables)
+
+		loop_time = min(timeit.repeat(lambda: reformat_loop(dataset.copy(deep=True)), number=1, repeat=repeat))
+		engine_time = min(timeit.repeat(lambda: _reformat_dataset(dataset.copy(deep=True)), number=1, repeat=repeat))
+		copy_time = min(timeit.repeat(lambda: dataset.copy(deep=True), number=1, repeat=repeat))
+		loop_time -= copy_time
+		engine_time -= copy_time
+		print(f"{n_vars:>10} {loop_time*1e3:>12.2f} {engine_time*1e3:>12.2f} {loop_time/engine_time:>7.1f}x")
+
+if __name__ == '__main__':
+	run()
@@ -0,0 +1,225 @@
+"""
+	Time and peak memory of every stage of working with DataOutput, on synthetic data of increasing size:
+	loading runs from a QCoDeS database (without and with the run cache, the in-memory memo is
+	disabled), reformat, a typical processing chain and autoplot, for 1D traces, 2D maps, 3D stacks and collections of many runs
+
+	Runs fully offline: the runs are written to a temporary SQLite database, and the run cache
+	and parameter file are kept in temporary directories. The peak memory of a stage is the
+	largest resident memory of the process during the stage, above the memory at its start.
+
+	Run from the repository root with:
+		python -m benchmarks.bench_suite                 all sizes, up to 10^7 point traces and 4k x 4k maps
+		python -m benchmarks.bench_suite --quick         small sizes, to check for regressions in a minute
+		python -m benchmarks.bench_suite --json out.json also write the results to a file
+		python -m benchmarks.bench_suite --all           also run bench_reformat and bench_processing
+"""
+import os, sys, gc, json, time, ctypes, argparse, tempfile, tracemalloc, contextlib
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from qcodes.parameters import ManualParameter
+from qcodes.dataset import Measurement, load_or_create_experiment, initialise_or_create_database_at
+from output_dataset import DataOutput as qp
+from output_dataset.DataOutput import Parameter, JSONParameterStore
+
+## Number of points of a trace, side of a square map, shape of a stack, and number and length of runs in a collection
+sizes = {
+	'1d': [10**5, 10**6, 10**7],
+	'2d': [500, 1000, 2000, 4000],
+	'3d': [(10,500,500), (20,1000,1000)],
+	'collection': [(100,1000), (1000,1000)],
+}
+quick_sizes = {
+	'1d': [10**4, 10**5],
+	'2d': [200, 500],
+	'3d': [(5,100,100)],
+	'collection': [(50,200)],
+}
+
+max_points_per_row = 10**5 ## Traces are stored in rows of array parameters, as a buffered measurement would
+
+class PeakMemory():
+	"""
+		Largest resident memory of the process since the last reset. On Linux the kernel peak (VmHWM)
+		is reset through /proc, elsewhere the allocations of Python and numpy are traced instead
+	"""
+	def __init__(self):
+		try:
+			self._clear_refs()
+			self.use_proc = True
+		except OSError:
+			self.use_proc = False
+		try:
+			self._malloc_trim = ctypes.CDLL('libc.so.6').malloc_trim
+		except (OSError, AttributeError):
+			self._malloc_trim = None
+
+	@staticmethod
+	def _clear_refs()->None:
+		with open('/proc/self/clear_refs', 'w') as file:
+			file.write('5')
+
+	@staticmethod
+	def _status(field:str)->int:
+		with open('/proc/self/status') as file:
+			for line in file:
+				if line.startswith(field):
+					return int(line.split()[1])*1024
+		return 0
+
+	def reset(self)->None:
+		## Memory freed by earlier stages is returned to the system first, otherwise reusing it would not count
+		gc.collect()
+		if self._malloc_trim is not None:
+			self._malloc_trim(0)
+		if self.use_proc:
+			self._clear_refs()
+			self.start = self._status('VmRSS')
+		else:
+			tracemalloc.start()
+			tracemalloc.reset_peak()
+			self.start = tracemalloc.get_traced_memory()[0]
+
+	def peak(self)->int:
+		if self.use_proc:
+			return max(0, self._status('VmHWM') - self.start)
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		return max(0, peak - self.start)
+
+class Suite():
+	def __init__(self, directory:str):
+		self.results = []
+		self.memory = PeakMemory()
+		initialise_or_create_database_at(os.path.join(directory, 'bench.db'))
+		self.experiment = load_or_create_experiment('benchmark', 'synthetic')
+		## Keep the benchmark parameters and cached runs out of the package
+		Parameter.use_store(JSONParameterStore(os.path.join(directory, 'verbose_params.json')))
+		qp.run_cache.directory = os.path.join(directory, 'run_cache')
+		qp.run_cache.max_bytes = 64*1024**3
+		## Every load reads the run, instead of taking it from the datasets loaded before
+		qp.DataOutput.memo.enabled = False
+		for key,scale in (('bench_x', 1e3), ('bench_y', 1e3), ('bench_z', 1), ('bench_signal', 1e9)):
+			if key not in Parameter._instances:
+				Parameter(key, scale=scale)
+
+	@contextlib.contextmanager
+	def stage(self, case:str, size:str, stage:str):
+		## Time and peak memory of the code in the with block
+		self.memory.reset()
+		start = time.perf_counter()
+		yield
+		elapsed = time.perf_counter() - start
+		peak = self.memory.peak()
+		self.results.append({'case': case, 'size': size, 'stage': stage, 'time': elapsed, 'peak_bytes': peak})
+		print(f"{case:<12} {size:>16} {stage:<14} {elapsed:>10.3f} {peak/1024**2:>10.1f}", flush=True)
+
+	def _measurement(self, setpoints:list)->tuple:
+		parameters = [ManualParameter(name) for name in ('bench_x', 'bench_y', 'bench_z')[:len(setpoints)]]
+		signal = ManualParameter('bench_signal')
+		measurement = Measurement(exp=self.experiment)
+		for parameter in parameters:
+			measurement.register_parameter(parameter, paramtype='array')
+		measurement.register_parameter(signal, setpoints=parameters, paramtype='array')
+		measurement.set_shapes({'bench_signal': tuple(len(values) for values in setpoints)})
+		return measurement, parameters, signal
+
+	def write_run(self, setpoints:list)->int:
+		"""
+			Write a run with a noisy signal on the grid of the setpoints, one row per line of the
+			grid (split in rows of at most max_points_per_row for traces), and return its run_id
+		"""
+		measurement, parameters, signal = self._measurement(setpoints)
+		shape = tuple(len(values) for values in setpoints)
+		grid = np.meshgrid(*setpoints, indexing='ij')
+		values = np.sin(grid[-1]*20)*np.exp(-grid[0]**2) + 0.01*np.random.rand(*shape)
+		line = shape[-1] if len(shape) > 1 else min(shape[0], max_points_per_row)
+		grid = [axis.reshape(-1, line) for axis in grid]
+		values = values.reshape(-1, line)
+		with measurement.run(write_in_background=False) as datasaver:
+			for row in range(values.shape[0]):
+				datasaver.add_result(*[(parameter, axis[row]) for parameter,axis in zip(parameters,grid)], (signal, values[row]))
+		return datasaver.run_id
+
+	def process(self, data_output, axis:str, stack:bool=False)->None:
+		## A typical chain: the average of a stack of repeated maps, normalized and rescaled data, and a centred fast axis
+		if stack:
+			data_output.reduce('bench_x', 'mean')
+		data_output.normalize()
+		data_output.multiply(2)
+		data_output.adjust_axis('centre', adjust=axis)
+
+	def run_case(self, case:str, size:str, run_ids:list, axis:str, stack:bool=False, plot:bool=True)->None:
+		qp.run_cache.enabled = False
+		with self.stage(case, size, 'load'):
+			data_output = qp.DataOutput(run_ids, reformat=False)
+		qp.run_cache.enabled = True
+		## Fill the run cache, then measure loading from it
+		qp.DataOutput(run_ids, reformat=False)
+		with self.stage(case, size, 'load (cache)'):
+			data_output = qp.DataOutput(run_ids, reformat=False)
+		with self.stage(case, size, 'reformat'):
+			data_output.reformat()
+		with self.stage(case, size, 'process'):
+			self.process(data_output, axis, stack=stack)
+		if plot:
+			with self.stage(case, size, 'autoplot'):
+				data_output.show()
+				## Render the figures, as a notebook or window would
+				for number in plt.get_fignums():
+					plt.figure(number).canvas.draw()
+			plt.close('all')
+		del data_output
+
+	def warm_up(self)->None:
+		## Imports and caches filled on first use are not part of the first measurement
+		run_id = self.write_run([np.linspace(-1, 1, 10), np.linspace(-1, 1, 10)])
+		for enabled in (False, True):
+			qp.run_cache.enabled = enabled
+			data_output = qp.DataOutput([run_id])
+			self.process(data_output, 'bench_y')
+			data_output.show()
+		plt.close('all')
+
+	def run(self, sizes:dict)->None:
+		self.warm_up()
+		print(f"{'case':<12} {'size':>16} {'stage':<14} {'time (s)':>10} {'peak (MB)':>10}")
+		for n_points in sizes.get('1d', []):
+			run_id = self.write_run([np.linspace(-1, 1, n_points)])
+			self.run_case('1d trace', f'{n_points:.0e}', [run_id], 'bench_x')
+		for side in sizes.get('2d', []):
+			run_id = self.write_run([np.linspace(-1, 1, side), np.linspace(-1, 1, side)])
+			self.run_case('2d map', f'{side}x{side}', [run_id], 'bench_y')
+		for shape in sizes.get('3d', []):
+			run_id = self.write_run([np.arange(shape[0], dtype=float)] + [np.linspace(-1, 1, size) for size in shape[1:]])
+			self.run_case('3d stack', 'x'.join(str(size) for size in shape), [run_id], 'bench_z', stack=True)
+		for n_runs,n_points in sizes.get('collection', []):
+			run_ids = [self.write_run([np.linspace(-1, 1, n_points)]) for idx in range(n_runs)]
+			self.run_case('collection', f'{n_runs} x {n_points}', run_ids, 'bench_x', plot=False)
+
+def main()->None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--quick', action='store_true', help='small sizes only')
+	parser.add_argument('--json', help='write the results to this file')
+	parser.add_argument('--all', action='store_true', help='also run bench_reformat and bench_processing')
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		suite = Suite(directory)
+		suite.run(quick_sizes if args.quick else sizes)
+	if args.json:
+		with open(args.json, 'w') as file:
+			json.dump({'quick': args.quick, 'results': suite.results}, file, indent=1)
+	if args.all:
+		from benchmarks import bench_reformat, bench_processing
+		print()
+		bench_reformat.run()
+		print()
+		bench_processing.run()
+
+if __name__ == '__main__':
+	main()
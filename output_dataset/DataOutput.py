@@ -1,11 +1,22 @@
-import os, sys, json, inspect, re
+import os, sys, json, inspect, re, threading, time, tempfile, warnings, multiprocessing, importlib, pickle
 from importlib import reload
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
+import numpy as np
 import qcodes as qc
 import xarray as xr
+from qcodes.dataset.sqlite.database import connect
+from qcodes.dataset.sqlite.queries import get_parameter_data, completed as run_completed
 
 from ._parameter_handler import *
 from ._autoplot import *
+from ._cache import RunCache, run_cache, DatasetMemo, _freeze
+from ._export import export_autoplot
+from ._fitting import fit_along
+from ._pipeline import Pipeline, Step
+from ._snapshot import SnapshotIndex, snapshot_cache, snapshot_values
+from ._run_index import RunIndex, run_index
+from ._archive import write_zarr, write_parquet, open_archive
 
 current_file_path = os.path.abspath(__file__)
 current_directory = os.path.dirname(current_file_path)
@@ -15,6 +26,7 @@ import _plotting
 import _processing
 
 import ultraplot as pplt
+import matplotlib.pyplot as plt
 pplt.rc['colorbar.width'] = 0.05
 pplt.rc['cmap.discrete'] = False
 pplt.rc['grid'] = False
@@ -82,40 +94,756 @@ def load_xarray_snapshot(ds:xr.Dataset) -> List[dict]:
 	"""
 	return json.loads('{' + ds.snapshot[1:-1] + '}')
 
-def load_qcodes_as_xarray(run_id:int)->xr.Dataset:
+def load_qcodes_as_xarray(run_id:int, conn=None, use_cache:bool=True, chunks:Optional[Union[dict,str,int]]=None)->xr.Dataset:
 	"""
 		Load a dataset from a QCoDeS database and convert it to 
 		an xarray Dataset object
+		Completed runs are stored in, and read back from, the on-disk run_cache,
+		unless they are smaller than run_cache.min_bytes
 		Args:
 			run_id (int): the id to load, needs to exist in the database
+			conn (optional): open connection to the database to read from,
+				by default QCoDeS opens a new connection to the current database
+			use_cache (bool): read and write completed runs through run_cache
+			chunks (optional): return a dask-chunked dataset with these chunk sizes,
+				e.g. {'V_gate': 100} or 'auto'. Cached runs are then read from disk
+				chunk by chunk, only when the data is computed
 		Returns:
 			xr.Dataset: the converted dataset in xarray format
 	"""
-	dset = qc.load_by_id(run_id)
+	dset = qc.load_by_id(run_id, conn=conn)
+	use_cache = use_cache and run_cache.enabled and dset.completed
+	if use_cache:
+		if chunks is not None:
+			ds = run_cache.open(dset.path_to_db, dset.guid, dset.run_id, chunks=chunks)
+		else:
+			ds = run_cache.load(dset.path_to_db, dset.guid, dset.run_id)
+		if ds is not None:
+			return ds
 	ds = dset.to_xarray_dataset()
+	if use_cache:
+		run_cache.store(dset.path_to_db, dset.guid, dset.run_id, ds)
+		if chunks is not None:
+			## Read back from the cache file, so the data is not held in memory
+			lazy_ds = run_cache.open(dset.path_to_db, dset.guid, dset.run_id, chunks=chunks)
+			if lazy_ds is not None:
+				return lazy_ds
+	if chunks is not None:
+		ds = ds.chunk(chunks)
 	return ds
 
+## Encodings that transform the stored values when decoding, such variables can not be mapped as stored
+_decoded_encodings = ('scale_factor', 'add_offset', 'units', 'calendar', 'dtype_in_file')
+
+def _memmap_values(h5_dataset, path:str)->Optional[np.ndarray]:
+	## A read-only memory map of an HDF5 dataset stored as a single uncompressed block, None otherwise
+	if h5_dataset.chunks is not None or h5_dataset.compression is not None or h5_dataset.size == 0:
+		return None
+	offset = h5_dataset.id.get_offset()
+	if offset is None:
+		return None
+	return np.memmap(path, dtype=h5_dataset.dtype, mode='r', offset=offset, shape=h5_dataset.shape)
+
+def load_netcdf_memmapped(path:str, data_keys:Optional[List[str]]=None)->xr.Dataset:
+	"""
+		Open a NetCDF4 (HDF5) file with its uncompressed, contiguous variables memory-mapped
+		The mapped variables are read-only and only occupy memory for the parts that are read.
+		Processing functions write to a private copy of a variable (copy-on-write), the file is
+		never modified. Other variables, e.g. compressed ones, are read lazily by xarray
+		Args:
+			path (str): the file to open
+			data_keys (list of str): optional, the data variables to keep
+		Returns:
+			xr.Dataset: the opened dataset
+	"""
+	import h5py
+	if not h5py.is_hdf5(path):
+		## e.g. NetCDF3 files, which xarray reads through a memory map of its own
+		dataset = xr.open_dataset(path)
+		return dataset[data_keys] if data_keys else dataset
+	dataset = xr.open_dataset(path, engine='h5netcdf')
+	if data_keys:
+		dataset = dataset[data_keys]
+	with h5py.File(path, 'r') as file:
+		for key,variable in dataset.variables.items():
+			## Index coordinates are held by pandas anyway
+			if key in dataset.indexes or any(name in variable.encoding for name in _decoded_encodings):
+				continue
+			h5_dataset = file.get(key)
+			if not isinstance(h5_dataset, h5py.Dataset) or h5_dataset.dtype != variable.dtype or h5_dataset.shape != variable.shape:
+				continue
+			## Fill values other than NaN are replaced by NaN when decoding
+			fill_value = variable.encoding.get('_FillValue')
+			if fill_value is not None and not (np.issubdtype(variable.dtype, np.floating) and np.isnan(fill_value)):
+				continue
+			values = _memmap_values(h5_dataset, path)
+			if values is not None:
+				variable.data = values
+	return dataset
+
+def current_db_path()->str:
+	"""Absolute path to the QCoDeS database currently in use"""
+	return os.path.abspath(os.path.expanduser(qc.config.core.db_location))
+
+default_load_workers = 4 ## Number of workers used to load multiple runs at once
+
+## Every loader worker keeps its own connection to the database,
+## sqlite connections can not be shared between threads
+_worker_state = threading.local()
+
+## Modules xarray imports on first use, when converting runs and reading the run cache
+_loader_modules = ('dask.base', 'dask.array', 'h5py', 'h5netcdf')
+
+def _import_loader_modules()->None:
+	## Importing a module in several threads at once can hand out a partially initialized module,
+	## so the modules the loaders need are imported in the calling thread first
+	for module in _loader_modules:
+		try:
+			importlib.import_module(module)
+		except ImportError:
+			pass
+	xr.backends.list_engines()
+
+def _init_load_worker(db_path:str)->None:
+	_worker_state.conn = connect(db_path)
+
+def _load_run_in_worker(run_id:int, chunks=None)->xr.Dataset:
+	return load_qcodes_as_xarray(run_id, conn=_worker_state.conn, chunks=chunks)
+
+def load_qcodes_runs_as_xarray(run_ids:List[int], workers:Optional[int]=None, db_path:Optional[str]=None,
+		use_processes:bool=False, chunks:Optional[Union[dict,str,int]]=None)->Tuple[List[Optional[xr.Dataset]],Dict[int,Exception]]:
+	"""
+		Load multiple datasets from a QCoDeS database in parallel and
+		convert them to xarray Dataset objects
+		A failing run does not stop the others from loading, its error is collected instead
+		Args:
+			run_ids (list of int): the ids to load
+			workers (int): optional, number of threads or processes used for loading.
+				Defaults to default_load_workers
+			db_path (str): optional, path to the database, defaults to the current QCoDeS database
+			use_processes (bool): load in separate processes instead of threads
+			chunks (optional): return dask-chunked datasets, see load_qcodes_as_xarray
+		Returns:
+			list of xr.Dataset: the converted datasets in the order of run_ids,
+				None for every run that could not be loaded
+			dict: the exception raised for every run that could not be loaded, by run_id
+	"""
+	db_path = current_db_path() if db_path is None else os.path.abspath(os.path.expanduser(db_path))
+	if workers is None:
+		workers = default_load_workers
+	workers = max(1, min(workers, len(run_ids)))
+
+	datasets = [None for run_id in run_ids]
+	errors = {}
+	if workers == 1:
+		conn = connect(db_path)
+		try:
+			for idx,run_id in enumerate(run_ids):
+				try:
+					datasets[idx] = load_qcodes_as_xarray(run_id, conn=conn, chunks=chunks)
+				except Exception as e:
+					errors[run_id] = e
+		finally:
+			conn.close()
+		return datasets, errors
+
+	if not use_processes:
+		_import_loader_modules()
+	executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+	with executor_class(max_workers=workers, initializer=_init_load_worker, initargs=(db_path,)) as executor:
+		futures = [executor.submit(_load_run_in_worker, run_id, chunks) for run_id in run_ids]
+		for idx,(run_id,future) in enumerate(zip(run_ids,futures)):
+			try:
+				datasets[idx] = future.result()
+			except Exception as e:
+				errors[run_id] = e
+	return datasets, errors
+
+def _is_completed(dataset:xr.Dataset)->bool:
+	## QCoDeS exports the completed timestamp of a run that is still being measured as -1
+	timestamp = dataset.attrs.get('completed_timestamp_raw')
+	return timestamp is not None and timestamp > 0
+
+def format_load_errors(errors:Dict[int,Exception])->str:
+	"""
+		Summarize the errors collected while loading runs
+		Args:
+			errors (dict): exceptions by run_id, as returned by load_qcodes_runs_as_xarray
+		Returns:
+			str: one line per failed run
+	"""
+	lines = [f"Could not load {len(errors)} run(s):"]
+	for run_id,error in errors.items():
+		lines.append(f"  run {run_id}: {type(error).__name__}: {error}")
+	return '\n'.join(lines)
+
+default_replay_workers = max(1, min(8, (os.cpu_count() or 2) - 1)) ## Number of processes replaying a pipeline at once
+
+## The pipeline replayed by the worker processes, passed to them when they start. A pipeline that
+## can not be pickled, e.g. with a lambda passed to adjust_axis, is inherited by forked workers instead
+_replay_pipeline = None
+_replay_store = None
+
+def _is_picklable(obj)->bool:
+	try:
+		pickle.dumps(obj)
+	except (pickle.PicklingError, AttributeError, TypeError):
+		return False
+	return True
+
+def _init_replay_worker(db_path:str, parameters:Dict[str,dict], pipeline:Optional[Pipeline]=None)->None:
+	global _replay_pipeline, _replay_store
+	_worker_state.conn = connect(db_path)
+	if pipeline is not None:
+		_replay_pipeline = pipeline
+	## A private copy of the parameters, so the workers never write to the parameter file
+	_replay_store = tempfile.TemporaryDirectory()
+	store = JSONParameterStore(os.path.join(_replay_store.name, 'verbose_params.json'))
+	store.save(parameters)
+	Parameter.use_store(store)
+
+def _replay_run(run_id:int, data_keys:Optional[List[str]], reformat:bool, output_path:Optional[str],
+		pipeline:Optional[Pipeline]=None, conn=None)->Union[xr.Dataset,str]:
+	## Load a run, process it with the pipeline, and return it or write it to output_path
+	pipeline = pipeline if pipeline is not None else _replay_pipeline
+	conn = conn if conn is not None else _worker_state.conn
+	data_output = DataOutput(load_qcodes_as_xarray(run_id, conn=conn), data_keys=data_keys, reformat=reformat,
+		deferred_processing=True)
+	data_output.replay(pipeline)
+	data_output.compute()
+	dataset = data_output.datasets[0]
+	if output_path is None:
+		return dataset
+	file_path = os.path.join(output_path, f'run_{run_id}.nc')
+	dataset.to_netcdf(file_path)
+	return file_path
+
+def replay_pipeline(pipeline:Pipeline, run_ids:List[int], workers:Optional[int]=None, db_path:Optional[str]=None,
+		data_keys:Optional[List[str]]=None, reformat:bool=True, output_path:Optional[str]=None,
+		progress:bool=True)->Tuple[List[Optional[Union[xr.Dataset,str]]],Dict[int,Exception]]:
+	"""
+		Load runs and process each of them with a pipeline, in parallel processes
+		Every run is loaded, reformatted and processed in a worker process. With output_path the
+		results are written to netCDF files by the workers, so they are never all held in memory
+		A failing run does not stop the others, its error is collected instead
+		The pipeline is pickled to pass it to the workers, a pipeline that can not be pickled
+		is only replayed by forked workers, where the fork start method is available
+		Args:
+			pipeline (Pipeline): the processing calls, e.g. recorded on a DataOutput
+			run_ids (list of int): the runs to process
+			workers (int): optional, number of processes, 1 processes the runs in the current process.
+				Defaults to default_replay_workers
+			db_path (str): optional, path to the database, defaults to the current QCoDeS database
+			data_keys (list of str): optional, the data variables to keep of every run
+			reformat (bool): rename and rescale the data according to the Parameter settings
+			output_path (str): optional, directory to write every result to as run_<run_id>.nc
+			progress (bool): print every processed run
+		Returns:
+			list: the processed datasets, or with output_path the written file paths,
+				in the order of run_ids, None for every run that failed
+			dict: the exception raised for every run that failed, by run_id
+	"""
+	global _replay_pipeline
+	db_path = current_db_path() if db_path is None else os.path.abspath(os.path.expanduser(db_path))
+	if output_path is not None:
+		os.makedirs(output_path, exist_ok=True)
+	workers = default_replay_workers if workers is None else workers
+	workers = max(1, min(workers, len(run_ids)))
+
+	results = {}
+	errors = {}
+	start = time.perf_counter()
+	def report(run_id:int)->None:
+		if not progress:
+			return
+		count = f'[{len(results) + len(errors)}/{len(run_ids)}]'
+		if run_id in errors:
+			print(f'{count} run {run_id} failed: {errors[run_id]}')
+		else:
+			print(f'{count} run {run_id} {time.perf_counter() - start:.2f} s')
+
+	if workers == 1:
+		conn = connect(db_path)
+		try:
+			for run_id in run_ids:
+				try:
+					results[run_id] = _replay_run(run_id, data_keys, reformat, output_path, pipeline=pipeline, conn=conn)
+				except Exception as e:
+					errors[run_id] = e
+				report(run_id)
+		finally:
+			conn.close()
+	else:
+		parameters = {name: parameter._as_dict() for name,parameter in Parameter._instances.items()}
+		if _is_picklable(pipeline):
+			executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_replay_worker,
+				initargs=(db_path, parameters, pipeline))
+		elif 'fork' in multiprocessing.get_all_start_methods():
+			## Forked workers inherit the pipeline, it does not need to be picklable
+			_replay_pipeline = pipeline
+			executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+				initializer=_init_replay_worker, initargs=(db_path, parameters))
+		else:
+			raise ValueError("The pipeline can not be pickled to pass it to the worker processes, "
+				"e.g. because a lambda was passed to one of its steps. Use functions defined at module level, or workers=1")
+		try:
+			with executor:
+				futures = {executor.submit(_replay_run, run_id, data_keys, reformat, output_path): run_id for run_id in run_ids}
+				for future in as_completed(futures):
+					run_id = futures[future]
+					try:
+						results[run_id] = future.result()
+					except Exception as e:
+						errors[run_id] = e
+					report(run_id)
+		finally:
+			_replay_pipeline = None
+	return [results.get(run_id) for run_id in run_ids], errors
+
+_affine_block_size = 2**16 ## Elements per block in _apply_affine, small enough to stay in the CPU cache
+
+def _apply_affine(values:np.ndarray, scale:float, offset:float)->np.ndarray:
+	"""
+		Compute (values - offset)*scale in place
+		Large arrays are processed in blocks that fit in the CPU cache,
+		so both operations are done in a single pass over memory
+		Args:
+			values (np.ndarray): writable array to transform
+			scale (float): the multiplier applied after subtracting the offset
+			offset (float): the offset to subtract
+		Returns:
+			np.ndarray: the transformed values (the same array)
+	"""
+	if offset == 0:
+		values *= scale
+		return values
+	if scale == 1:
+		values -= offset
+		return values
+	if values.size <= _affine_block_size or not values.flags.c_contiguous:
+		values -= offset
+		values *= scale
+		return values
+	flat_values = values.reshape(-1)
+	for start in range(0, flat_values.size, _affine_block_size):
+		block = flat_values[start:start+_affine_block_size]
+		block -= offset
+		block *= scale
+	return values
+
+def _reformat_dataset(dataset:xr.Dataset, inplace:bool=True, deferred:bool=False)->xr.Dataset:
+    """
+        Rename the labels and rescale the coordinates and data variables of a dataset
+        according to the Parameter settings, see DataOutput.reformat
+        All coordinates are replaced in a single assign_coords, and every data variable
+        is rescaled in a single pass. Parameters with scale 1 and offset 0 are skipped.
+        The applied scale and offset are recorded in the parameter_scale and parameter_offset
+        attributes of every variable, e.g. for archives written with to_zarr or to_parquet
+        Args:
+            dataset (xr.Dataset): the dataset to reformat
+            inplace (bool): rescale the data buffers in place, otherwise
+                the rescaled data is written to new arrays
+            deferred (bool): only mark the dataset for deferred scaling,
+                leaving the data untouched (see apply_deferred_scaling)
+        Returns:
+            xr.Dataset: the reformatted dataset
+    """
+    ## Look up all parameters at once, creating default parameters for new keys
+    coord_keys = list(dataset.coords)
+    var_keys = list(dataset.data_vars)
+    keys = coord_keys + var_keys
+    defaults = {key: (dataset.variables[key].attrs.get('long_name'), dataset.variables[key].attrs.get('units'))
+        for key in keys if key not in Parameter._instances}
+    resolved = Parameter.resolve(keys, defaults)
+    identity = resolved.identity
+
+    if deferred:
+        dataset.attrs['deferred_scaling'] = 1
+        return dataset
+    if not inplace:
+        dataset = dataset.copy(deep=False)
+    dataset.attrs.pop('deferred_scaling', None)
+
+    ## Rescale all coordinates at once. The scale and offset are used as Python floats,
+    ## which keep the precision of float32 data as when rescaling in place
+    new_coords = {}
+    for idx,key in enumerate(coord_keys):
+        if not identity[idx]:
+            coord = dataset.coords[key]
+            new_coords[key] = (coord.dims, (coord.values - float(resolved.offsets[idx]))*float(resolved.scales[idx]), dict(coord.attrs))
+    if new_coords:
+        dataset = dataset.assign_coords(new_coords)
+
+    ## Rename the coordinates and data variables, and record the scale and offset applied to them
+    for idx,key in enumerate(keys):
+        attrs = dataset.variables[key].attrs
+        attrs['long_name'] = resolved.verbose_names[idx]
+        attrs['unit'] = resolved.units[idx]
+        attrs['units'] = resolved.units[idx]
+        attrs['parameter_scale'] = float(resolved.scales[idx])
+        attrs['parameter_offset'] = float(resolved.offsets[idx])
+
+    ## Rescale the data variables
+    for idx,key in enumerate(var_keys, start=len(coord_keys)):
+        if identity[idx]:
+            continue
+        scale = float(resolved.scales[idx])
+        offset = float(resolved.offsets[idx])
+        if _processing._is_lazy(dataset[key]):
+            ## Dask-backed data is rescaled lazily, the transform is added to the task graph
+            attrs = dataset[key].attrs
+            dataset[key] = (dataset[key] - offset)*scale
+            dataset[key].attrs = attrs
+        elif inplace:
+            _apply_affine(_processing._writable_values(dataset, key), scale, offset)
+        else:
+            variable = dataset.variables[key]
+            variable.values = (variable.values - offset)*scale
+    return dataset
+
+def apply_deferred_scaling(dataset:xr.Dataset)->xr.Dataset:
+    """
+        Obtain a dataset with the current Parameter labels, scale and offset applied,
+        for a dataset reformatted with deferred scaling. The raw data is left untouched.
+        Args:
+            dataset (xr.Dataset): the dataset to read
+        Returns:
+            xr.Dataset: the rescaled dataset, or the dataset itself if no scaling is deferred
+    """
+    if not dataset.attrs.get('deferred_scaling'):
+        return dataset
+    return _reformat_dataset(dataset, inplace=False)
+
+class RunReference():
+    """
+        Reference to a run in a QCoDeS database that is loaded when its data is needed
+        Args:
+            run_id (int): the id of the run in the database
+            db_path (str): optional, path to the database, defaults to the current QCoDeS database
+            data_keys (list of str): optional, the data variables to keep after loading
+            reformat (bool): reformat the run after loading
+    """
+    def __init__(self, run_id:int, db_path:Optional[str]=None, data_keys:Optional[List[str]]=None, reformat:bool=True):
+        self.run_id = run_id
+        self.db_path = current_db_path() if db_path is None else db_path
+        self.data_keys = data_keys
+        self.reformat = reformat
+        self._data_vars = None
+
+    def __repr__(self):
+        return f"RunReference(run_id={self.run_id}, data_keys={self.data_keys})"
+
+    @property
+    def key(self)->tuple:
+        return (self.db_path, self.run_id)
+
+    @property
+    def data_vars(self)->List[str]:
+        """Names of the dependent parameters of the run, read from the run metadata only"""
+        if self.data_keys is not None:
+            return list(self.data_keys)
+        if self._data_vars is None:
+            conn = connect(self.db_path)
+            try:
+                dset = qc.load_by_id(self.run_id, conn=conn)
+                self._data_vars = [param.name for param in dset.dependent_parameters]
+            finally:
+                conn.close()
+        return list(self._data_vars)
+
+    def subset(self, data_keys:List[str])->'RunReference':
+        return RunReference(self.run_id, db_path=self.db_path, data_keys=data_keys, reformat=self.reformat)
+
+def _keeps_deferred_scaling(name:str, args:tuple, kwargs:dict)->bool:
+	## Whether a processing call gives the same result before the deferred scaling is applied, so a cut
+	## of a large (e.g. memory-mapped) dataset is rescaled without rescaling the rest. A selection
+	## matches coordinate values, it is only unaffected if the selected coordinates are not rescaled
+	if name == 'transpose':
+		return True
+	if name != 'select':
+		return False
+	sel_dict = args[0] if args else kwargs.get('sel_dict', {})
+	parameters = [Parameter._instances.get(key) for key in sel_dict]
+	return all(parameter is None or (parameter.scale == 1 and parameter.offset == 0) for parameter in parameters)
+
+def _shared_copy(dataset:xr.Dataset)->xr.Dataset:
+	## A dataset sharing the buffers of another, which are made read-only so neither is changed through the other
+	_freeze(dataset)
+	return dataset.copy(deep=False)
+
+def _shared_buffers(dataset:xr.Dataset)->List[str]:
+	## Variables holding read-only buffers shared with the memo or another DataOutput. Memory-mapped
+	## files are read-only by themselves and are not copied
+	return [key for key,variable in dataset.variables.items() if isinstance(variable._data, np.ndarray)
+		and not isinstance(variable._data, np.memmap) and not variable._data.flags.writeable]
+
+def _private_copy(dataset:xr.Dataset)->xr.Dataset:
+	## A dataset with writable copies of the shared buffers of another, the other buffers are still shared
+	keys = _shared_buffers(dataset)
+	if not keys:
+		return dataset
+	dataset = dataset.copy(deep=False)
+	for key in keys:
+		variable = dataset.variables[key]
+		variable.data = variable._data.copy()
+	return dataset
+
+def _run_guids(db_path:str, run_ids:List[int])->Dict[int,str]:
+	## The GUIDs of runs by run_id, read from the runs table only. Runs that do not exist are left out
+	conn = connect(db_path)
+	try:
+		rows = conn.execute(f"SELECT run_id, guid FROM runs WHERE run_id IN ({','.join('?'*len(run_ids))})",
+			tuple(run_ids)).fetchall()
+	finally:
+		conn.close()
+	return {run_id: guid for run_id,guid in rows}
+
 class DataOutput():
-    def __init__(self, datas, data_keys = None, reformat=True):
-        ## Load data (depending on input)
-        self.datasets = self._assemble_datasets(datas,data_keys)
+    ## Runs loaded from the database, shared by all DataOutput objects
+    memo = DatasetMemo()
+
+    def __init__(self, datas, data_keys = None, reformat=True, workers=None, use_processes=False, lazy=False, chunks=None,
+            deferred_scaling=False, deferred_processing=False):
+        """
+            Args:
+                datas: QCoDeS run_id(s) (int), xarray Dataset(s) or a list of these
+                data_keys: optional, data variables to keep for every dataset
+                reformat (bool): rename and rescale the data according to the Parameter settings
+                workers (int): optional, number of workers used to load runs in parallel
+                use_processes (bool): load runs in separate processes instead of threads
+                lazy (bool): only load runs from the database when their data is first accessed
+                chunks: optional, hold the data as dask-chunked arrays with these chunk sizes,
+                    e.g. {'V_gate': 100} or 'auto'. Processing then builds a task graph
+                    that is only computed when plotting or exporting
+                deferred_scaling (bool): keep the raw data in memory and apply the Parameter
+                    scale and offset only when the data is read for plotting, processing or export,
+                    so changes to a Parameter are reflected without reloading. The datasets then
+                    hold the raw values, read scaled_datasets for the rescaled data
+                deferred_processing (bool): only record calls of processing functions, e.g. do.normalize(),
+                    and run them as one optimized plan when the data is shown, plotted, exported
+                    or fitted, or on compute()
+        """
+        self.load_errors = {}
+        self._workers = workers
+        self._use_processes = use_processes
+        self._chunks = chunks
+        self._deferred_scaling = deferred_scaling
+        self._deferred_processing = deferred_processing
+        ## All processing calls made on this object, of which the first _n_executed have been run
+        self.pipeline = Pipeline()
+        self._n_executed = 0
+        ## Whether the datasets hold read-only buffers shared with the memo or another DataOutput.
+        ## Reading datasets replaces these by private copies, except while a processing function
+        ## that copies shared buffers itself before writing to them is running
+        self._shared = False
+        self._copy_on_write = False
+        ## Processing and plotting functions read the raw values of deferred scaling on purpose,
+        ## reading them from outside is warned about once
+        self._in_function = False
+        self._warned_raw = False
+        ## New parameters found while reformatting are saved at once
+        with Parameter.batch():
+            ## Assemble the datasets, runs from the database are only referenced
+            self._datasets = self._assemble_datasets(datas,data_keys,reformat=reformat)
+
+            ## Load the runs unless requested lazily
+            if not lazy:
+                self._materialize()
+
+    @classmethod
+    def from_query(cls, db_path:Optional[str]=None, data_keys=None, reformat:bool=True, workers:Optional[int]=None,
+            lazy:bool=False, **conditions)->'DataOutput':
+        """
+            Load the runs matching conditions on their metadata, found in the run index without loading any run,
+            e.g. DataOutput.from_query(dependent='I_lockin', independent='V_gate', ndim=2, since=timedelta(days=7))
+            Args:
+                db_path (str): optional, path to the database, defaults to the current QCoDeS database
+                data_keys: optional, data variables to keep for every run
+                reformat (bool): rename and rescale the data according to the Parameter settings
+                workers (int): optional, number of workers used to load the runs in parallel
+                lazy (bool): only load the runs when their data is first accessed
+                conditions: the conditions of RunIndex.query
+        """
+        db_path = current_db_path() if db_path is None else os.path.abspath(os.path.expanduser(db_path))
+        run_ids = run_index(db_path).query(**conditions)
+        if not run_ids:
+            raise ValueError(f"No runs in {db_path} match {conditions}")
+        references = [RunReference(run_id, db_path=db_path, data_keys=data_keys, reformat=reformat) for run_id in run_ids]
+        return cls(references, workers=workers, lazy=lazy)
+
+    @classmethod
+    def from_files(cls, paths:Union[str,List[str]], data_keys:Optional[List[str]]=None, reformat:bool=True,
+            deferred_scaling:bool=True, **kwargs)->'DataOutput':
+        """
+            Open NetCDF files, e.g. _xarray_dataset.nc, with their uncompressed variables memory-mapped
+            Inspecting and plotting the data only reads the parts that are used, processing
+            steps that write to a variable work on a private copy of it (see load_netcdf_memmapped)
+            Args:
+                paths (str or list of str): the files to open
+                data_keys (list of str): optional, the data variables to keep
+                reformat (bool): rename and rescale the data according to the Parameter settings
+                deferred_scaling (bool): apply the Parameter scale and offset only when the data is read,
+                    so rescaling does not copy the mapped variables
+                kwargs: passed on to DataOutput
+        """
+        paths = [paths] if isinstance(paths, (str, os.PathLike)) else list(paths)
+        datasets = [load_netcdf_memmapped(path, data_keys) for path in paths]
+        return cls(datasets, reformat=reformat, deferred_scaling=deferred_scaling, **kwargs)
+
+    @classmethod
+    def open(cls, path:str, runs:Optional[List[Union[int,str]]]=None, data_keys:Optional[List[str]]=None,
+            chunks:Optional[Union[dict,str]]=None)->'DataOutput':
+        """
+            Open a collection written with to_zarr or to_parquet
+            Zarr stores are read lazily, chunk by chunk when the data is used,
+            of Parquet collections only the selected runs and variables are read
+            Args:
+                path (str): the Zarr store or Parquet directory
+                runs (list): optional, the run_ids (or dataset names) to open, by default all
+                data_keys (list of str): optional, the data variables to keep
+                chunks: optional, dask chunks of the Zarr variables, by default the chunks of the store
+        """
+        datasets = open_archive(path, runs=runs, data_keys=data_keys, chunks=chunks)
+        ## The data was written reformatted, and is not rescaled again
+        return cls(datasets, reformat=False)
+
+    @property
+    def datasets(self)->List[xr.Dataset]:
+        """
+            The datasets, loading runs that are still only referenced
+            Buffers shared with the memo or with subsets are copied first, so the datasets can be modified in place.
+            With deferred scaling these hold the raw values, which is warned about once, see scaled_datasets
+        """
+        if not self._in_function and not self._warned_raw and self._has_deferred_scaling():
+            self._warned_raw = True
+            warnings.warn("The datasets hold the raw values, the Parameter scaling is deferred. "
+                "Read scaled_datasets for the rescaled data, or call apply_scaling()", stacklevel=2)
+        return self._private_datasets()
+
+    def _private_datasets(self)->List[xr.Dataset]:
+        ## The datasets, with the buffers shared with the memo or with subsets copied unless copy_on_write
+        datasets = self._materialize()
+        if self._shared and not self._copy_on_write:
+            ## The datasets may be modified in place from here on
+            self._datasets = datasets = [_private_copy(dataset) for dataset in datasets]
+            self._shared = False
+        return datasets
+
+    @datasets.setter
+    def datasets(self, datasets:List[xr.Dataset]):
+        self._datasets = list(datasets)
+
+    @property
+    def scaled_datasets(self)->List[xr.Dataset]:
+        """The datasets with any deferred Parameter scaling applied, without modifying the raw data"""
+        return [apply_deferred_scaling(dataset) for dataset in self._private_datasets()]
+
+    def _read_scaled_datasets(self)->List[xr.Dataset]:
+        ## As scaled_datasets for reading only, shared buffers are not copied
+        return [apply_deferred_scaling(dataset) for dataset in self._materialize()]
 
-        ## Reformat data labels and scale if desired
-        if reformat:
-            self.reformat()
+    def _has_deferred_scaling(self)->bool:
+        return any(dataset.attrs.get('deferred_scaling') for dataset in self._materialize())
+
+    def _run_processing(self, func, copy_on_write:bool, *args, **kwargs):
+        ## Run a processing or plotting function, with copy_on_write it reads the datasets without
+        ## copying the shared buffers, as it does not write to them or copies them first itself
+        in_function = self._in_function
+        self._copy_on_write = copy_on_write
+        self._in_function = True
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self._copy_on_write = False
+            self._in_function = in_function
+
+    def apply_scaling(self)->None:
+        """
+            Permanently apply deferred Parameter scaling to the data,
+            later changes to the Parameters are then no longer reflected
+        """
+        datasets = self._materialize()
+        for idx,dataset in enumerate(datasets):
+            if dataset.attrs.get('deferred_scaling'):
+                ## The raw dataset can be shared with other DataOutput objects, e.g. the one this is a subset of
+                datasets[idx] = _reformat_dataset(dataset, inplace=False)
+
+    @property
+    def pending(self)->Pipeline:
+        """The recorded processing calls that have not been run yet"""
+        return self.pipeline[self._n_executed:]
+
+    def compute(self, optimize:bool=True)->None:
+        """
+            Run the pending processing calls
+            Args:
+                optimize (bool): run them as an optimized plan, see Pipeline.optimized
+        """
+        pending = self.pending
+        if not pending:
+            return
+        self._n_executed = len(self.pipeline)
+        for step in (pending.optimized() if optimize else pending):
+            ## Processing consumes the values, so deferred scaling is applied first
+            if not _keeps_deferred_scaling(step.name, step.args, step.kwargs):
+                self.apply_scaling()
+            self._run_processing(step.run, step.name in _processing._copy_on_write_functions)
+
+    def replay(self, pipeline:Pipeline)->None:
+        """
+            Make the processing calls of a pipeline, e.g. recorded on another DataOutput:
+            do_2.replay(do_1.pipeline)
+        """
+        for step in pipeline.unfused():
+            getattr(self, step.name)(*step.args, **step.kwargs)
+
+    def apply_to_runs(self, run_ids:List[int], workers:Optional[int]=None, output_path:Optional[str]=None,
+            db_path:Optional[str]=None, data_keys:Optional[List[str]]=None, progress:bool=True)->Union['DataOutput',List[str]]:
+        """
+            Process other runs with all processing calls made on this DataOutput, in parallel processes,
+            e.g. do.apply_to_runs(range(100, 400)) after trying out the processing on a single run
+            Args:
+                run_ids (list of int): the runs to process
+                workers (int): optional, number of processes, 1 processes the runs in this process
+                output_path (str): optional, directory to write every result to as run_<run_id>.nc,
+                    instead of collecting them in memory
+                db_path (str): optional, path to the database, defaults to the current QCoDeS database
+                data_keys (list of str): optional, the data variables to keep of every run
+                progress (bool): print every processed run
+            Returns:
+                DataOutput: the processed runs, or with output_path the paths of the written files.
+                Runs that failed are left out, with a warning
+        """
+        results, errors = replay_pipeline(self.pipeline, list(run_ids), workers=workers, db_path=db_path, data_keys=data_keys,
+            output_path=output_path, progress=progress)
+        results = [result for result in results if result is not None]
+        if errors:
+            if not results:
+                raise ValueError(format_load_errors(errors))
+            warnings.warn(format_load_errors(errors))
+        if output_path is not None:
+            return results
+        data_output = DataOutput(results, reformat=False, workers=self._workers, use_processes=self._use_processes)
+        data_output.load_errors = errors
+        return data_output
+
+    @property
+    def n_loaded(self)->int:
+        """Number of datasets that are loaded in memory"""
+        return len([entry for entry in self._datasets if not isinstance(entry, RunReference)])
 
     @staticmethod
     def parse_data_input(datas):
         ## Ensure that data to be loaded is of correct format
         if not isinstance(datas,list):
-            if isinstance(datas,(int,xr.Dataset)):
+            if isinstance(datas,(int,xr.Dataset,RunReference)):
                 datas = [datas]
             elif isinstance(datas,int):
                 datas = [datas]
             else:
                 raise ValueError("Data to be loaded must be provided as an int, xarray.Dataset or list of these")
 
-        if not all([isinstance(data,(int,xr.Dataset)) for data in datas]):
+        if not all([isinstance(data,(int,xr.Dataset,RunReference)) for data in datas]):
             raise ValueError("Data must be supplied as QCodes run_ids to load (int), or as xarray datasets")
         
         return datas
@@ -138,48 +866,220 @@ class DataOutput():
                 raise ValueError("Data keys must be provided as strings or lists of strings")
         return data_keys
 		
-    def _assemble_datasets(self,datas, data_keys=None):
+    def _assemble_datasets(self,datas, data_keys=None, reformat=True):
         ## Parse datas and data_keys into correct format
         datas = self.parse_data_input(datas)
         if data_keys is not None:
             data_keys = self.parse_data_keys(datas,data_keys)
-            
+
         datasets = []
-        ### Loop over the run_ids and get the data as given by data_keys	
+        ### Loop over the inputs and get the data as given by data_keys	
         for data_idx,data in enumerate(datas):
+            keys = data_keys[data_idx] if data_keys else None
+            ## Runs in the database are referenced, and loaded when materialized
             if isinstance(data, int):
-                dataset = load_qcodes_as_xarray(data)
-            else:
-                dataset = data
-        
+                datasets.append(RunReference(data, data_keys=keys, reformat=reformat))
+                continue
+            elif isinstance(data, RunReference):
+                datasets.append(data.subset(keys) if keys else data)
+                continue
+
             try:
                 ## New_dataset is subset of previous dataset
-                if data_keys:
-                    new_dataset = dataset[data_keys[data_idx]]
-                    datasets.append(new_dataset)
-                ## Pass entire dataset if data_keys filter is not supplied
-                else:
-                    datasets.append(dataset)
+                dataset = data[keys] if keys else data
             except KeyError as e:
-                if isinstance(data,int):
-                    run_id = data
-                else:
-                    run_id = data.run_id
-                raise KeyError(f"Could not load data in run {run_id}: {e}")
+                raise KeyError(f"Could not load data in run {data.run_id}: {e}")
+            if self._chunks is not None:
+                dataset = dataset.chunk(self._chunks)
+            if reformat:
+                dataset = _reformat_dataset(dataset, deferred=self._deferred_scaling)
+            datasets.append(dataset)
         return datasets
-    
+
+    def _load_runs(self, references:List[RunReference])->Dict[tuple,xr.Dataset]:
+        ## Take runs from the memo if possible, and load the others in one batch per database
+        loaded = {}
+        keys = list(dict.fromkeys([reference.key for reference in references]))
+        ## Chunked runs stay on disk and are not memoized
+        use_memo = self._chunks is None and self.memo.enabled
+        ## The memo is keyed by GUID as well, so a database replaced at the same path is not served from it
+        guids = {}
+        if use_memo:
+            for db_path in dict.fromkeys([db_path for db_path,run_id in keys]):
+                db_guids = _run_guids(db_path, [run_id for key_db_path,run_id in keys if key_db_path == db_path])
+                guids.update({(db_path,run_id): guid for run_id,guid in db_guids.items()})
+        for key in keys:
+            dataset = self.memo.get((*key, guids[key])) if key in guids else None
+            if dataset is not None:
+                loaded[key] = dataset
+                self._shared = True
+
+        missing_keys = [key for key in keys if key not in loaded]
+        errors = {}
+        for db_path in dict.fromkeys([db_path for db_path,run_id in missing_keys]):
+            run_ids = [run_id for key_db_path,run_id in missing_keys if key_db_path == db_path]
+            loaded_datasets, db_errors = load_qcodes_runs_as_xarray(run_ids, db_path=db_path, workers=self._workers,
+                use_processes=self._use_processes, chunks=self._chunks)
+            errors.update(db_errors)
+            for run_id,dataset in zip(run_ids,loaded_datasets):
+                if dataset is None:
+                    continue
+                ## Runs that are still being measured can change and are not memoized
+                if use_memo and _is_completed(dataset) and dataset.attrs.get('guid') is not None:
+                    dataset = self.memo.put((db_path,run_id,dataset.attrs['guid']),dataset)
+                    self._shared = True
+                loaded[(db_path,run_id)] = dataset
+
+        if errors:
+            self.load_errors.update(errors)
+            if not loaded and len(self._datasets) == len(references):
+                raise ValueError(format_load_errors(errors))
+            warnings.warn(format_load_errors(errors))
+        return loaded
+
+    def _materialize(self)->List[xr.Dataset]:
+        ## Replace all run references by the loaded (and reformatted) datasets
+        references = [entry for entry in self._datasets if isinstance(entry, RunReference)]
+        if not references:
+            return self._datasets
+        with Parameter.batch():
+            return self._materialize_references(references)
+
+    def _materialize_references(self, references:List[RunReference])->List[xr.Dataset]:
+        loaded = self._load_runs(references)
+
+        datasets = []
+        used_keys = set()
+        for entry in self._datasets:
+            if not isinstance(entry, RunReference):
+                datasets.append(entry)
+                continue
+            if entry.key not in loaded:
+                continue
+            ## A run requested more than once gets an independent copy
+            dataset = loaded[entry.key] if entry.key not in used_keys else loaded[entry.key].copy(deep=True)
+            used_keys.add(entry.key)
+            try:
+                if entry.data_keys:
+                    dataset = dataset[entry.data_keys]
+            except KeyError as e:
+                raise KeyError(f"Could not load data in run {entry.run_id}: {e}")
+            if entry.reformat:
+                dataset = _reformat_dataset(dataset, deferred=self._deferred_scaling)
+            datasets.append(dataset)
+        self._datasets = datasets
+        return self._datasets
+
     ## Autoplot the dataset
-    def show(self):
-        output = autoplot(self.datasets)
+    def show(self, rebuild:bool=False):
+        """
+            Plot the data with autoplot
+            When called again, the new data is pushed into the existing figures,
+            they are only rebuilt when the grid of axes, the shapes, coordinates or labels change
+            Args:
+                rebuild (bool): always create new figures
+        """
+        self.compute()
+        datasets = self._read_scaled_datasets()
+        plots = self.__dict__.get('plots')
+        if not rebuild and plots is not None and update_autoplot(plots, datasets) and redisplay_autoplot(plots):
+            return
+        output = autoplot(datasets)
         setattr(self,'plots',output)
+
+    def export_figures(self, path:str, fmt:str='png', workers:Optional[int]=None, dpi:Optional[float]=None,
+            progress:bool=True)->Dict[str,float]:
+        """
+            Write the figures show() would create to files, rendered in parallel processes
+            Args:
+                path (str): directory to write the figures to
+                fmt (str): file format, e.g. 'png', 'pdf' or 'svg'
+                workers (int): optional, number of rendering processes, 1 renders in this process
+                dpi (float): optional, resolution of raster formats
+                progress (bool): print every written figure with its rendering time
+            Returns:
+                dict: rendering time in seconds by written file path
+        """
+        self.compute()
+        return export_autoplot(self._read_scaled_datasets(), path, fmt=fmt, workers=workers, dpi=dpi, progress=progress)
+
+    def to_zarr(self, store:str, workers:Optional[int]=None)->List[str]:
+        """
+            Write all datasets to a Zarr store, each in its own group, in parallel
+            Labels, units and the Parameter scale and offset are kept in the attributes.
+            Requires the optional dependency zarr
+            Args:
+                store (str): path of the store, replaced if it exists
+                workers (int): optional, number of datasets written at once
+            Returns:
+                list of str: the group names, run_<run_id> for runs from a database
+        """
+        self.compute()
+        return write_zarr(self._read_scaled_datasets(), store, workers=workers)
+
+    def to_parquet(self, path:str, workers:Optional[int]=None)->List[str]:
+        """
+            Write all datasets to a directory of Parquet files, one per dataset, in parallel
+            Every file holds a column per coordinate and data variable, labels, units and
+            the Parameter scale and offset are kept in the file metadata.
+            Requires the optional dependency pyarrow
+            Args:
+                path (str): the directory to write to
+                workers (int): optional, number of datasets written at once
+            Returns:
+                list of str: the file names without extension, run_<run_id> for runs from a database
+        """
+        self.compute()
+        return write_parquet(self._read_scaled_datasets(), path, workers=workers)
+
+    def fit(self, func, dim:str, data_var:Optional[str]=None, p0=None, workers:Optional[int]=None,
+            warm_start:bool=True, **kwargs)->List[xr.Dataset]:
+        """
+            Fit a model along a dimension, to every slice of the data in each dataset
+            The data is not modified, e.g. do.fit(lorentzian, 'V_bias') fits a line cut per gate voltage
+            Args:
+                func: the model func(x, *params), as for scipy.optimize.curve_fit
+                dim (str): the dimension to fit along
+                data_var (str): optional, the variable to fit, by default the first variable of each dataset
+                p0: optional, initial guess of the parameters
+                workers (int): optional, number of fitting processes, 1 fits in this process
+                warm_start (bool): start every fit from the result of the neighbouring slice
+                kwargs: passed on to scipy.optimize.curve_fit, e.g. bounds or maxfev
+            Returns:
+                list[xr.Dataset]: per dataset popt, perr, pcov and success, indexed by the remaining coordinates
+        """
+        self.compute()
+        results = []
+        for dataset in self._read_scaled_datasets():
+            key = data_var if data_var is not None else list(dataset.data_vars)[0]
+            results.append(fit_along(dataset[key], func, dim, p0=p0, workers=workers, warm_start=warm_start, **kwargs))
+        return results
+
+    def _scaled_view(self)->'DataOutput':
+        ## DataOutput sharing the plots of this one, holding the datasets with deferred scaling applied
+        view = DataOutput(self._read_scaled_datasets(), reformat=False)
+        if 'plots' in self.__dict__:
+            view.plots = self.plots
+        return view
     
     def __getattr__(self, name):
+        ## The underscore helpers of the plotting and processing files are not methods
+        if name.startswith('_'):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
         # Check if the function exists in _plotting file
         if hasattr(_plotting, name):
             func = getattr(_plotting, name)
             # Return a callable that passes the datasets to the plotting function
             def wrapper(*args, **kwargs):
-                return func(self, *args, **kwargs)
+                self.compute()
+                if not self._has_deferred_scaling():
+                    return self._run_processing(func, True, *args, **kwargs)
+                ## Plot the rescaled data, and keep the plots on this object
+                view = self._scaled_view()
+                output = view._run_processing(func, True, *args, **kwargs)
+                if 'plots' in view.__dict__:
+                    self.plots = view.plots
+                return output
             return wrapper
 
         # Check if the function exists in _processing file
@@ -187,9 +1087,17 @@ class DataOutput():
             func = getattr(_processing,name)
             # Return a callable that passes the datasets to the processing function
             def wrapper(*args, **kwargs):
-
-
-                return func(self, *args, **kwargs)
+                if self._deferred_processing:
+                    self.pipeline.record(name, *args, **kwargs)
+                    return
+                self.compute()
+                ## Processing consumes the values, so deferred scaling is applied first
+                if not _keeps_deferred_scaling(name, args, kwargs):
+                    self.apply_scaling()
+                output = self._run_processing(func, name in _processing._copy_on_write_functions, *args, **kwargs)
+                self.pipeline.record(name, *args, **kwargs)
+                self._n_executed = len(self.pipeline)
+                return output
             return wrapper
         
         raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
@@ -216,28 +1124,46 @@ class DataOutput():
         print(f"Getting subset by list is not yet supported")
         return self
 
+    def _subset(self, entries)->'DataOutput':
+        ## Subsets keep unloaded runs as references, so only the selected runs are ever loaded.
+        ## Loaded datasets are shared copy-on-write: the subset gets shallow copies and the shared
+        ## buffers are made read-only, so processing either of them in place copies a buffer first
+        entries = [entry if isinstance(entry, RunReference) else _shared_copy(entry) for entry in entries]
+        shared = any(not isinstance(entry, RunReference) for entry in entries)
+        self._shared = self._shared or shared
+        subset = DataOutput(entries, reformat=False, workers=self._workers, use_processes=self._use_processes, lazy=True, chunks=self._chunks,
+            deferred_scaling=self._deferred_scaling, deferred_processing=self._deferred_processing)
+        ## The subset is processed by the same calls, the pending ones run on its own copies of the data
+        subset.pipeline = self.pipeline[:]
+        subset._n_executed = self._n_executed
+        subset._shared = shared
+        return subset
+
     def _get_slice(self,indexing: slice):
-        subset = DataOutput(self.datasets[indexing], reformat=False)
+        subset = self._subset(self._datasets[indexing])
         return subset
         
     def _get_tuple(self,indexing: tuple):
-        subset = DataOutput([self.datasets[i] for i in indexing], reformat=False)
+        subset = self._subset([self._datasets[i] for i in indexing])
         return subset
     
     def _get_int(self,indexing: int):
-        if indexing > (len(self.datasets)) - 1:
-            raise KeyError(f"Requested index ({indexing}) out of range for DataOutput with {len(self.datasets)} dataset(s)")
-        subset = DataOutput([self.datasets[indexing]], reformat=False)
+        if indexing > (len(self._datasets)) - 1:
+            raise KeyError(f"Requested index ({indexing}) out of range for DataOutput with {len(self._datasets)} dataset(s)")
+        subset = self._subset([self._datasets[indexing]])
         return subset
 
     def _get_str(self,indexing: str):
         new_datasets = []
-        for dataset in self.datasets:
-            if indexing in dataset.data_vars:
-                new_datasets.append(dataset[[indexing]])
-        subset = DataOutput(new_datasets, reformat=False)
-        if len(subset.datasets) < 1:
+        for entry in self._datasets:
+            if isinstance(entry, RunReference):
+                if indexing in entry.data_vars:
+                    new_datasets.append(entry.subset([indexing]))
+            elif indexing in entry.data_vars:
+                new_datasets.append(entry[[indexing]])
+        if len(new_datasets) < 1:
             raise KeyError(f"No data found for query: '{indexing}'")
+        subset = self._subset(new_datasets)
         return subset
     
     def reformat(self) -> None:
@@ -247,51 +1173,249 @@ class DataOutput():
             Settings are obtained from the data loaded into the Parameter class 
             If a new variable is encountered a new parameter will be created with default settings
         """
+        with Parameter.batch():
+            ## Shared buffers are copied before rescaling them
+            datasets = self._materialize()
+            for idx,dataset in enumerate(datasets):
+                datasets[idx] = _reformat_dataset(dataset, deferred=self._deferred_scaling)
 
-        for idx,dataset in enumerate(self.datasets):
-            coord_keys = dataset.coords
-            ## Obtain rescaled data coordinates
-            for key in coord_keys:
-                if key not in Parameter._instances.keys():
-                    Parameter(key, verbose_name = dataset[key].attrs.get('long_name'), unit = dataset[key].attrs.get('units'))
-                    Parameter.save()
-
-                parameter = Parameter[key]
-                old_attrs = dataset[key].attrs
-                dataset = dataset.assign_coords({f'{key}': (dataset[key].values - parameter.offset)*parameter.scale})
-                dataset[key].attrs = old_attrs
-
-            ## Rename the rescaled coordinates
-            for key in coord_keys:
-                parameter = Parameter[key]
-                dataset[key].attrs['long_name'] = parameter.verbose_name
-                #dataset[key].attrs['label'] = parameter.verbose_name
-
-                dataset[key].attrs['unit'] = parameter.unit
-                dataset[key].attrs['units'] = parameter.unit
-
-            ## Rescale and rename the data variables
-            for key in dataset.data_vars:
-                if key not in Parameter._instances.keys():
-                    Parameter(key, verbose_name = dataset[key].attrs.get('long_name'), unit = dataset[key].attrs.get('units'))
-                    Parameter.save()
-                parameter = Parameter[key]
-                dataset[key].attrs['long_name'] = parameter.verbose_name
-                #dataset[key].attrs['label'] = parameter.verbose_name
-
-                dataset[key].attrs['unit'] = parameter.unit
-                dataset[key].attrs['units'] = parameter.unit
-                dataset[key].values -= parameter.offset
-                dataset[key].values *= parameter.scale
-            self.datasets[idx] = dataset
-
-    def snapshots(self):
+    def snapshots(self)->List[Optional[dict]]:
+        """
+            The QCoDeS snapshot of every dataset, None for datasets without one
+            Snapshots are parsed once per run and shared between calls, copy them before modifying
+        """
         all_snapshots = []
-        for dataset in self.datasets:
-            all_snapshots.append(load_xarray_snapshot(dataset))
+        for dataset in self._materialize():
+            index = snapshot_cache.index(dataset)
+            all_snapshots.append(index.tree if index is not None else None)
         return all_snapshots
 
+    def snapshot_values(self, path:str, default=np.nan)->np.ndarray:
+        """
+            Look up a value in the snapshot of every dataset,
+            e.g. do.snapshot_values('station.instruments.dac.parameters.ch01.value')
+            Args:
+                path (str): dotted path of the value in the snapshot
+                default: value for datasets without a snapshot or without the path
+            Returns:
+                np.ndarray: one value per dataset, as float if all values are numeric
+        """
+        return snapshot_values(self._materialize(), path, default)
+
 
             
             
-       
\ No newline at end of file
+       
+
+
+def _fill_pending_coordinates(dataset:xr.Dataset)->xr.Dataset:
+	"""
+		Runs with a predefined shape hold NaN for setpoints that are not measured yet,
+		these are extrapolated with the last measured step so the data can be plotted
+		with its final shape while the run is still going
+	"""
+	pending = {}
+	for key in dataset.dims:
+		if key not in dataset.coords:
+			continue
+		values = np.asarray(dataset[key].values)
+		if values.dtype.kind != 'f':
+			continue
+		missing = np.isnan(values)
+		if not missing.any():
+			continue
+		known = np.flatnonzero(~missing)
+		if known.size > 1:
+			start, step = values[known[0]], (values[known[-1]] - values[known[0]])/(known[-1] - known[0])
+		else:
+			start, step = (values[known[0]] if known.size else 0.0), 1.0
+		filled = values.copy()
+		filled[missing] = start + step*(np.flatnonzero(missing) - (known[0] if known.size else 0))
+		pending[key] = (key, filled, dataset[key].attrs)
+	return dataset.assign_coords(pending) if pending else dataset
+
+class LiveDataOutput(DataOutput):
+    """
+        DataOutput following a QCoDeS run that is still being measured
+        Every poll reads only the rows written to the database since the previous poll. For runs with a
+        predefined shape (see Measurement.set_shapes) the new rows are written into the data read so far,
+        and if all processing calls made are pointwise (e.g. multiply) only the new values are reformatted
+        and processed. Other runs are converted again, and other processing is repeated on all data.
+        The new data is pushed into the plots created by show(), without rebuilding them
+        The connection to the database is kept open until close(), or use it as a context manager:
+            with LiveDataOutput(run_id) as live:
+                live.follow()
+    """
+    def __init__(self, run_id:int, data_keys = None, reformat=True, db_path:Optional[str]=None):
+        """
+            Args:
+                run_id (int): the id of the run to follow
+                data_keys: optional, data variables to keep
+                reformat (bool): rename and rescale the data according to the Parameter settings
+                db_path (str): optional, database containing the run, defaults to the current database
+        """
+        self.run_id = run_id
+        self._live_data_keys = data_keys
+        self._live_reformat = reformat
+        self._conn = connect(db_path or current_db_path())
+        self._dset = qc.load_by_id(run_id, conn=self._conn)
+        self._completed = self._dset.completed
+        self._n_results = self._dset.number_of_results
+        self._read_run()
+        super().__init__(self._raw_copy(), data_keys=data_keys, reformat=reformat)
+        self._settings = self._parameter_settings()
+
+    @property
+    def completed(self)->bool:
+        """Whether the run was marked completed at the last poll"""
+        return self._completed
+
+    def _count_rows(self)->Dict[str,int]:
+        ## Rows holding a value of every dependent parameter, rows with NULL are skipped as by get_parameter_data
+        table_name = self._dset.table_name
+        return {param.name: self._conn.execute(f'SELECT COUNT("{param.name}") FROM "{table_name}"').fetchone()[0]
+            for param in self._dset.dependent_parameters}
+
+    def _read_run(self)->None:
+        ## Convert the whole run. The rows are counted first, rows written in between are read again
+        ## at the next poll, which writes them to the same place
+        ## The QCoDeS cache converts runs with a predefined shape to arrays of that shape, holding NaN
+        ## for the points not measured yet. These share their buffers with the cache and are copied
+        self._rows = self._count_rows()
+        self._raw = self._dset.cache.to_xarray_dataset().copy(deep=True)
+        self._coords = {dim: np.array(self._raw[dim].values) for dim in self._raw.dims if dim in self._raw.coords}
+        shapes = self._dset.description.shapes or {}
+        self._shaped = all(shapes.get(key) is not None and tuple(shapes[key]) == self._raw[key].shape
+            for key in self._raw.data_vars)
+
+    def _raw_copy(self)->xr.Dataset:
+        ## The raw data to reformat and process, in buffers of its own
+        return _fill_pending_coordinates(self._raw).copy(deep=True)
+
+    def _read_new_rows(self)->Optional[Dict[str,Tuple[int,int]]]:
+        """
+            Write the rows added since the previous read into the raw data of a run with a predefined shape
+            Returns:
+                dict: the range of flat indices of the new values of every variable,
+                None if the rows do not fit the shape and the run has to be converted again
+        """
+        ranges = {}
+        for key in self._raw.data_vars:
+            data = get_parameter_data(self._conn, self._dset.table_name, [key], start=self._rows[key] + 1).get(key, {})
+            values = np.asarray(data.get(key, []))
+            if values.shape[0] == 0:
+                continue
+            ## Parameters with setpoints add an array per row
+            per_row = int(np.prod(values.shape[1:]))
+            start = self._rows[key]*per_row
+            stop = start + values.size
+            if stop > self._raw[key].size:
+                return None
+            self._raw[key].values.flat[start:stop] = values.ravel()
+            positions = np.unravel_index(np.arange(start, stop), self._raw[key].shape)
+            for dim,index in zip(self._raw[key].dims, positions):
+                coord = self._coords.get(dim)
+                if coord is None or dim not in data or coord.dtype.kind != 'f':
+                    continue
+                ## Setpoints that are not measured yet are NaN
+                unknown = np.isnan(coord[index])
+                coord[index[unknown]] = np.asarray(data[dim]).ravel()[unknown]
+            self._rows[key] += values.shape[0]
+            ranges[key] = (start, stop)
+        self._raw = self._raw.assign_coords({dim: (dim, coord, self._raw[dim].attrs) for dim,coord in self._coords.items()})
+        return ranges
+
+    def _parameter_settings(self)->dict:
+        ## The Parameter settings the data was reformatted with
+        if not self._live_reformat:
+            return {}
+        return {key: Parameter._instances[key]._as_dict() for key in self._raw.variables if key in Parameter._instances}
+
+    def _process_new_values(self, ranges:Dict[str,Tuple[int,int]])->bool:
+        """
+            Reformat and process only the new values, and write them into the processed data
+            Returns:
+                bool: False if the processing made so far is not pointwise, or the Parameter settings
+                changed, and all data has to be processed again
+        """
+        executed = self.pipeline[:self._n_executed]
+        if any(step.name not in _processing._pointwise_functions for step in executed):
+            return False
+        if self._parameter_settings() != self._settings:
+            return False
+        dataset = self._datasets[0]
+        keys = [key for key in ranges if key in dataset.data_vars]
+        if any(dataset[key].dims != self._raw[key].dims for key in keys):
+            return False
+        points = xr.Dataset({key: (('point',), np.array(self._raw[key].values.flat[slice(*ranges[key])])) for key in keys})
+        for key in keys:
+            points[key].attrs = dict(self._raw[key].attrs)
+        processed = DataOutput(points, reformat=self._live_reformat)
+        processed.replay(executed)
+        for key in keys:
+            _processing._writable_values(dataset, key).flat[slice(*ranges[key])] = processed.datasets[0][key].values
+        ## Pointwise processing leaves the coordinates as reformatted
+        coords = xr.Dataset(coords=_fill_pending_coordinates(self._raw).coords).copy(deep=True)
+        if self._live_reformat:
+            coords = _reformat_dataset(coords, inplace=False)
+        self._datasets[0] = dataset.assign_coords({dim: coords[dim] for dim in dataset.dims if dim in coords.coords})
+        return True
+
+    def close(self)->None:
+        """Close the connection to the database, the data read so far is kept"""
+        self._conn.close()
+
+    def __enter__(self)->'LiveDataOutput':
+        return self
+
+    def __exit__(self, *exc_info)->None:
+        self.close()
+
+    def poll(self)->bool:
+        """
+            Read the new rows of the run, and update the plots in place
+            The figures are only rebuilt if the layout of the data changed,
+            e.g. when a 2D map without a predefined shape gains a new row
+            Returns:
+                bool: True if new data was found
+        """
+        ## Checked before reading, so all rows written before the run completed are read
+        self._completed = bool(run_completed(self._conn, self.run_id))
+        n_results = self._dset.number_of_results
+        if n_results == self._n_results:
+            return False
+        self._n_results = n_results
+        ranges = self._read_new_rows() if self._shaped else None
+        if ranges is None:
+            self._read_run()
+        if ranges is None or not self._process_new_values(ranges):
+            with Parameter.batch():
+                self._datasets = self._assemble_datasets(self._raw_copy(), self._live_data_keys, reformat=self._live_reformat)
+            self._settings = self._parameter_settings()
+            ## The processing calls made so far are repeated on the new data
+            self._n_executed = 0
+            if not self._deferred_processing:
+                self.compute()
+        if 'plots' in self.__dict__:
+            self.show()
+        return True
+
+    def follow(self, interval:float=1, timeout:Optional[float]=None)->None:
+        """
+            Show the data and keep polling until the run completes
+            In notebooks the updates are only visible with an interactive backend, e.g. %matplotlib widget
+            Args:
+                interval (float): seconds between polls
+                timeout (float): optional, stop following after this many seconds
+        """
+        if 'plots' not in self.__dict__:
+            self.show()
+        start = time.monotonic()
+        while True:
+            self.poll()
+            if self.completed:
+                break
+            if timeout is not None and time.monotonic() - start > timeout:
+                break
+            ## Lets interactive backends redraw, sleeps otherwise
+            plt.pause(interval)
@@ -0,0 +1,210 @@
+import os, json, math, importlib, warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
+
+import numpy as np
+import xarray as xr
+
+default_archive_workers = min(8, os.cpu_count() or 1) ## Number of datasets written at once
+chunk_bytes = 4*1024**2 ## Target size of the chunks of a Zarr store, and of the row groups of Parquet files
+
+## Name of the file listing the datasets of a Parquet collection
+_parquet_collection_file = '_collection.json'
+## Key of the xarray metadata in the schema of a Parquet file
+_parquet_metadata_key = b'output_dataset'
+
+def _require(module:str, feature:str):
+	## Import an optional dependency, with install instructions when it is missing
+	try:
+		return importlib.import_module(module)
+	except ImportError:
+		raise ImportError(f"{feature} requires the optional dependency '{module}', install it with: pip install {module}") from None
+
+def _entry_names(datasets:List[xr.Dataset])->List[str]:
+	## Datasets of a single run are named after it, others by their position
+	names = []
+	for idx,dataset in enumerate(datasets):
+		run_id = dataset.attrs.get('run_id')
+		name = f'run_{run_id}' if run_id is not None else f'dataset_{idx}'
+		if name in names:
+			name = f'{name}_{idx}'
+		names.append(name)
+	return names
+
+def _json_safe(value):
+	if isinstance(value, np.generic):
+		return value.item()
+	if isinstance(value, np.ndarray):
+		return value.tolist()
+	return str(value)
+
+def _chunk_shape(shape:tuple, itemsize:int)->tuple:
+	## Halve the largest dimension until a chunk is at most chunk_bytes
+	chunks = [max(1, size) for size in shape]
+	while math.prod(chunks)*itemsize > chunk_bytes and max(chunks) > 1:
+		idx = int(np.argmax(chunks))
+		chunks[idx] = math.ceil(chunks[idx]/2)
+	return tuple(chunks)
+
+def _write_parallel(function, jobs:list, workers:Optional[int])->None:
+	## The compression in zarr and pyarrow releases the GIL, so datasets are written in threads
+	workers = default_archive_workers if workers is None else workers
+	workers = max(1, min(workers, len(jobs)))
+	if workers == 1:
+		for job in jobs:
+			function(*job)
+		return
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		for future in [executor.submit(function, *job) for job in jobs]:
+			future.result()
+
+def _write_zarr_group(dataset:xr.Dataset, store:str, group:str)->None:
+	encoding = {}
+	for key,variable in dataset.variables.items():
+		if variable.chunks is None and variable.ndim > 0:
+			encoding[key] = {'chunks': _chunk_shape(variable.shape, variable.dtype.itemsize)}
+	## The groups are written at the same time, the metadata is consolidated once all are written
+	dataset.to_zarr(store, group=group, mode='w', encoding=encoding, consolidated=False)
+
+def write_zarr(datasets:List[xr.Dataset], store:str, workers:Optional[int]=None)->List[str]:
+	"""
+		Write datasets to a Zarr store, every dataset in its own group
+		Variables are split in chunks of about chunk_bytes, compressed with the default compressor of zarr,
+		and keep their attributes, including the Parameter scale and offset of reformatted variables
+		Args:
+			datasets (list of xr.Dataset): the datasets to write
+			store (str): path of the store, replaced if it exists
+			workers (int): optional, number of datasets written at once
+		Returns:
+			list of str: the names of the groups, in the order of the datasets
+	"""
+	zarr = _require('zarr', 'Writing to Zarr')
+	names = _entry_names(datasets)
+	xr.Dataset(attrs={'datasets': names}).to_zarr(store, mode='w', consolidated=False)
+	_write_parallel(_write_zarr_group, [(dataset, store, name) for dataset,name in zip(datasets,names)], workers)
+	## The metadata of all groups in a single file at the root, so opening the store reads one file.
+	## Zarr warns that format 3 does not specify consolidated metadata yet, xarray reads it all the same
+	with warnings.catch_warnings():
+		warnings.filterwarnings('ignore', message='Consolidated metadata')
+		zarr.consolidate_metadata(store)
+	return names
+
+def _parquet_parts(dataset:xr.Dataset)->List[xr.Dataset]:
+	## Variables along different dimensions can not share a table without filling the
+	## product of all dimensions, every group of variables with the same dimensions gets a table
+	groups = {}
+	for key in dataset.data_vars:
+		groups.setdefault(dataset[key].dims, []).append(key)
+	return [dataset[keys] for keys in groups.values()]
+
+def _write_parquet_file(dataset:xr.Dataset, file_path:str)->None:
+	pa = _require('pyarrow', 'Writing to Parquet')
+	pq = importlib.import_module('pyarrow.parquet')
+	table = pa.Table.from_pandas(dataset.to_dataframe().reset_index(), preserve_index=False)
+	metadata = {
+		'attrs': dataset.attrs,
+		'dims': list(dataset.dims),
+		'coords': list(dataset.coords),
+		'data_vars': list(dataset.data_vars),
+		'variable_attrs': {key: dict(variable.attrs) for key,variable in dataset.variables.items()},
+	}
+	table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+		_parquet_metadata_key: json.dumps(metadata, default=_json_safe).encode()})
+	row_bytes = max(1, sum(getattr(field.type, 'bit_width', 64)//8 for field in table.schema))
+	pq.write_table(table, file_path, compression='zstd', row_group_size=max(1, chunk_bytes//row_bytes))
+
+def write_parquet(datasets:List[xr.Dataset], path:str, workers:Optional[int]=None)->List[str]:
+	"""
+		Write datasets to a directory of Parquet files
+		Every group of variables along the same dimensions of a dataset is written to a table with
+		a column per coordinate and variable, compressed with zstd. The attributes, including the
+		Parameter scale and offset of reformatted variables, are kept in the file metadata
+		Args:
+			datasets (list of xr.Dataset): the datasets to write
+			path (str): the directory to write to, created if needed
+			workers (int): optional, number of files written at once
+		Returns:
+			list of str: the names of the datasets, in the order of the datasets
+	"""
+	_require('pyarrow', 'Writing to Parquet')
+	os.makedirs(path, exist_ok=True)
+	names = _entry_names(datasets)
+	files = {}
+	data_vars = {}
+	jobs = []
+	for dataset,name in zip(datasets,names):
+		parts = _parquet_parts(dataset)
+		files[name] = [f'{name}.parquet' if len(parts) == 1 else f'{name}.{idx}.parquet' for idx in range(len(parts))]
+		data_vars[name] = list(dataset.data_vars)
+		jobs += [(part, os.path.join(path, file_name)) for part,file_name in zip(parts,files[name])]
+	_write_parallel(_write_parquet_file, jobs, workers)
+	with open(os.path.join(path, _parquet_collection_file), 'w') as file:
+		json.dump({'datasets': names, 'files': files, 'data_vars': data_vars}, file)
+	return names
+
+def _select_entries(names:List[str], runs:Optional[List[Union[int,str]]])->List[str]:
+	## Entries by run_id or by name, in the order requested
+	if runs is None:
+		return names
+	selected = []
+	for run in runs:
+		name = f'run_{run}' if isinstance(run, (int, np.integer)) else run
+		if name not in names:
+			raise KeyError(f"No dataset '{name}' in the archive, it holds {names}")
+		selected.append(name)
+	return selected
+
+def _read_parquet_file(file_path:str, data_keys:Optional[List[str]])->Optional[xr.Dataset]:
+	## Only the coordinates and requested variables are read from the file, None if it holds none of them
+	_require('pyarrow', 'Reading Parquet')
+	pq = importlib.import_module('pyarrow.parquet')
+	metadata = json.loads(pq.read_schema(file_path).metadata[_parquet_metadata_key])
+	keys = metadata['data_vars'] if data_keys is None else [key for key in metadata['data_vars'] if key in data_keys]
+	if not keys:
+		return None
+	columns = list(dict.fromkeys(metadata['coords'] + keys))
+	frame = pq.read_table(file_path, columns=columns).to_pandas()
+	dataset = frame.set_index(metadata['dims']).to_xarray() if metadata['dims'] else xr.Dataset.from_dataframe(frame)
+	dataset = dataset.set_coords([key for key in metadata['coords'] if key in dataset.variables and key not in dataset.dims])
+	for key in dataset.variables:
+		dataset.variables[key].attrs = metadata['variable_attrs'].get(key, {})
+	dataset.attrs = metadata['attrs']
+	return dataset
+
+def _read_parquet_dataset(path:str, file_names:List[str], data_vars:List[str], data_keys:Optional[List[str]])->xr.Dataset:
+	parts = [_read_parquet_file(os.path.join(path, file_name), data_keys) for file_name in file_names]
+	parts = [part for part in parts if part is not None]
+	if len(parts) == 1:
+		return parts[0]
+	dataset = xr.merge(parts, combine_attrs='override', join='outer')
+	## In the original order of the variables
+	return dataset[[key for key in data_vars if key in dataset.data_vars]]
+
+def open_archive(path:str, runs:Optional[List[Union[int,str]]]=None, data_keys:Optional[List[str]]=None,
+		chunks:Optional[Union[dict,str]]=None)->List[xr.Dataset]:
+	"""
+		Open datasets written by write_zarr or write_parquet
+		Zarr stores are opened lazily: only the chunks that are used are read, when they are used.
+		Of Parquet files only the selected runs and variables are read
+		Args:
+			path (str): the Zarr store or Parquet directory
+			runs (list): optional, the run_ids or names of the datasets to open, by default all
+			data_keys (list of str): optional, the data variables to keep
+			chunks: optional, dask chunks of the Zarr variables, by default the chunks of the store
+		Returns:
+			list of xr.Dataset: the opened datasets
+	"""
+	collection_file = os.path.join(path, _parquet_collection_file)
+	if os.path.exists(collection_file):
+		with open(collection_file) as file:
+			collection = json.load(file)
+		return [_read_parquet_dataset(path, collection['files'][name], collection['data_vars'][name], data_keys)
+			for name in _select_entries(collection['datasets'], runs)]
+
+	_require('zarr', 'Reading Zarr')
+	names = list(xr.open_zarr(path, consolidated=True).attrs['datasets'])
+	datasets = []
+	for name in _select_entries(names, runs):
+		dataset = xr.open_zarr(path, group=name, chunks=chunks if chunks is not None else {}, consolidated=True)
+		datasets.append(dataset[data_keys] if data_keys is not None else dataset)
+	return datasets
@@ -2,14 +2,19 @@
 import ultraplot as pplt
 import xarray as xr
 import numpy as np 
+import matplotlib.pyplot as plt
 from matplotlib.ticker import AutoMinorLocator
+from matplotlib.collections import QuadMesh
+from matplotlib.image import AxesImage, NonUniformImage
+from matplotlib.lines import Line2D
 
-import os,sys,json
+import os,sys,json,copy
 
 current_file_path = os.path.abspath(__file__)
 current_directory = os.path.dirname(current_file_path)
 sys.path.append(current_directory)
 from _parameter_handler import Parameter
+from _decimation import decimate_map, DecimatedLine, DecimatedMap
 
 def get_file_path(filename:str)->str:
 	""" 
@@ -24,6 +29,44 @@ def get_file_path(filename:str)->str:
 	module_dir = os.path.dirname(os.path.abspath(__file__))
 	return os.path.join(module_dir, filename)
 
+## Content of a default config file
+default_configs = {
+	'figs':{
+		'max_cols': 3,
+		'row_height': 2,
+		'col_width': 2,   
+		'minorticks':2,
+		'majorticks':2,
+		'add_colorbars': True,
+		'set_title':True,
+	},
+	'colorbar':{
+		'length': 0.8,
+		'width': 0.05,
+		'align':'right',
+		'location':'top',
+		'pad':-1,
+		'ticklabelsize':7,
+	},
+	'2D':{
+		'levels':1000,
+		'cmap':'magma',
+	},
+	'1D':{
+		'linewidth': 1,
+	},
+	'raster':{
+		'mode': 'auto',             ## 'mesh', 'image', or 'auto': an image above rasterize_above points
+		'rasterize_above': 250000,  ## Number of points above which maps are drawn as raster
+		'downsample': True,         ## Reduce maps drawn as image to the resolution of the axis when drawing
+	},
+	'decimation':{
+		'method': 'minmax',         ## 'minmax' envelope, 'lttb' or 'none'
+		'above': 10000,             ## Number of points above which lines are decimated
+		'points_per_pixel': 2,      ## Points drawn per pixel of the width of the axis
+	},
+}
+
 def load_dictionary(filename:str)->dict:
 	"""
 		Reads the data from json files, 
@@ -41,36 +84,19 @@ def load_dictionary(filename:str)->dict:
 
 	else:
 		with open(file_path, 'w') as f:
-			## Content of a default config file
-			default = configs_template = {
-				'figs':{
-					'max_cols': 3,
-					'row_height': 2,
-					'col_width': 2,   
-					'minorticks':2,
-					'majorticks':2,
-					'add_colorbars': True,
-					'set_title':True,
-				},
-				'colorbar':{
-					'length': 0.8,
-					'width': 0.05,
-					'align':'right',
-					'location':'top',
-					'pad':-1,
-					'ticklabelsize':7,
-				},
-				'2D':{
-					'levels':1000,
-					'cmap':'magma',
-				},
-				'1D':{
-					'linewidth': 1,
-				}
-			}
+			default = copy.deepcopy(default_configs)
 			json.dump(default, f)
 			return default
-		
+
+def with_default_configs(dictionary:dict)->dict:
+	"""
+		Add the sections and settings missing from a config file,
+		so config files written by older versions keep working
+	"""
+	for section,settings in default_configs.items():
+		for key,value in settings.items():
+			dictionary.setdefault(section, {}).setdefault(key, copy.deepcopy(value))
+	return dictionary
 
 def save_dictionary(dictionary:dict, filename:str)->None:
 	"""
@@ -91,10 +117,19 @@ def save_configs(dictionary:dict)->None:
 	"""
 	file_path = get_file_path(filename_config)
 	save_dictionary(dictionary, file_path)
-	configs.update(load_dictionary(filename_config))
+	configs.update(with_default_configs(load_dictionary(filename_config)))
 
 filename_config = "plot_configs.json" ## Hardcoded config filename
-configs = load_dictionary(filename_config)
+configs = with_default_configs(load_dictionary(filename_config))
+
+def _resolve_labels(data:xr.Dataset|xr.DataArray, keys:list[str]):
+	## Plotting only reads the Parameters, keys without one are labelled by the attributes of the data
+	## instead of creating and saving a new Parameter
+	defaults = {}
+	for key in keys:
+		attrs = data.attrs if isinstance(data, xr.DataArray) and key == data.name else data[key].attrs
+		defaults[key] = (attrs.get('long_name'), attrs.get('units'))
+	return Parameter.resolve(keys, defaults, create=False)
 
 def handle_plot(data_array: xr.DataArray,ax:pplt.axes.Axes):
 	"""
@@ -106,7 +141,10 @@ def handle_plot(data_array: xr.DataArray,ax:pplt.axes.Axes):
 		Args:
 			data_array (xr.DataArray): DataArray object to be plotted
 			ax (matplot.Axes): axis object in which the data should be plotted
+		Returns:
+			the created artist: a QuadMesh or image for 2D data, a Line2D for 1D data
 	"""
+	artist = None
 	coords = list(data_array.coords)
 	len_coords = [data_array[key].values.size > 1 for key in coords ]
 	filt_coords = [key for key in coords if data_array[key].values.size > 1]
@@ -116,16 +154,285 @@ def handle_plot(data_array: xr.DataArray,ax:pplt.axes.Axes):
 	ax.yaxis.set_minor_locator(AutoMinorLocator(configs['figs']['minorticks']))
 	
 	if dim == 2:
-		im = ax.pcolormesh(data_array,**configs['2D'])
-		if len(coords) > len(filt_coords):
-			ax.format(xlabel = Parameter[filt_coords[1]].as_label(), ylabel = Parameter[filt_coords[0]].as_label())
+		## Look up all labels at once
+		ylabel,xlabel,clabel = _resolve_labels(data_array, [filt_coords[0], filt_coords[1], data_array.name]).labels()
+		im = _plot_map(data_array, ax)
+		artist = im
+		## Images are drawn from plain arrays, and are not labelled by xarray
+		if len(coords) > len(filt_coords) or not isinstance(im, QuadMesh):
+			ax.format(xlabel = xlabel, ylabel = ylabel)
 
 		if configs['figs']['add_colorbars']:
 			cbar = ax.colorbar(im, **{**configs['colorbar'],'locator': pplt.MaxNLocator(2)},)
-			cbar.set_label(Parameter[data_array.name].as_label())
+			cbar.set_label(clabel)
 
 	if dim == 1:
-		ax.plot(data_array, **configs['1D'])
+		artist = plot_line(data_array, ax, **configs['1D'])
+	return artist
+
+def plot_line(data_array:xr.DataArray, ax:pplt.axes.Axes, **kwargs):
+	"""
+		Plot 1D data, decimated to the resolution of the axis following the decimation configs
+		The line keeps the full data and decimates the visible range again when zooming or panning,
+		the data array itself is left untouched, e.g. for fitting.
+		Args:
+			data_array (xr.DataArray): the data to plot
+			ax (matplot.Axes): axis object in which the data should be plotted
+			kwargs: passed on to ax.plot
+		Returns:
+			the created Line2D
+	"""
+	decimation = configs['decimation']
+	plotted = _plotted_array(data_array)
+	if (decimation['method'] == 'none' or plotted.ndim != 1 or plotted.size <= decimation['above']
+			or plotted[plotted.dims[0]].dtype.kind not in 'iuf' or plotted.dtype.kind not in 'iuf'):
+		return ax.plot(data_array, **kwargs)[0]
+	## Plot the first points only for the labels, the line then draws the decimated data
+	dim = plotted.dims[0]
+	line = ax.plot(plotted.isel({dim: slice(0, 2)}), **kwargs)[0]
+	DecimatedLine(line, plotted[dim].values, np.asarray(plotted.values), method = decimation['method'],
+		points_per_pixel = decimation['points_per_pixel'])
+	return line
+
+def _plotted_array(data_array:xr.DataArray)->xr.DataArray:
+	## The data as drawn by handle_plot, without the coordinates of length 1
+	return data_array.squeeze(drop=True)
+
+def _is_monotonic(coord:np.ndarray)->bool:
+	steps = np.diff(coord)
+	return bool(np.all(steps > 0) or np.all(steps < 0))
+
+def _is_uniform(coord:np.ndarray)->bool:
+	## Evenly spaced coordinates can be drawn as a plain image
+	if coord.size < 3:
+		return True
+	steps = np.diff(coord)
+	return bool(np.allclose(steps, steps[0], rtol=1e-3, atol=0))
+
+def _axis_shape(ax:pplt.axes.Axes)->tuple:
+	## Size of an axis in pixels, the resolution a map drawn in it can show
+	bbox = ax.get_window_extent()
+	return int(np.ceil(bbox.height)), int(np.ceil(bbox.width))
+
+def _map_array(plotted:xr.DataArray, shape:tuple=None)->xr.DataArray:
+	## The 2D data as it is drawn: reduced to at most shape points, keeping its extremes
+	if shape is None or any(plotted[dim].dtype.kind not in 'iuf' for dim in plotted.dims):
+		return plotted
+	ydim,xdim = plotted.dims
+	values,y,x = decimate_map(np.asarray(plotted.values), plotted[ydim].values, plotted[xdim].values, shape)
+	if values.shape == plotted.shape:
+		return plotted
+	return xr.DataArray(values, dims = plotted.dims, name = plotted.name, attrs = plotted.attrs,
+		coords = {ydim: (ydim, y, plotted[ydim].attrs), xdim: (xdim, x, plotted[xdim].attrs)})
+
+def _image_data(shown:xr.DataArray)->tuple:
+	## Coordinates and values of a map with ascending coordinates, as images are drawn from the lowest coordinate up
+	ydim,xdim = shown.dims
+	values = np.asarray(shown.values)
+	y,x = shown[ydim].values, shown[xdim].values
+	if y.size > 1 and y[0] > y[-1]:
+		y,values = y[::-1], values[::-1]
+	if x.size > 1 and x[0] > x[-1]:
+		x,values = x[::-1], values[:,::-1]
+	return x,y,values
+
+def _image_extent(x:np.ndarray, y:np.ndarray)->tuple:
+	## The pixels of an image are centred on the coordinates
+	dx = (x[-1] - x[0])/(x.size - 1) if x.size > 1 else 1
+	dy = (y[-1] - y[0])/(y.size - 1) if y.size > 1 else 1
+	return (x[0] - dx/2, x[-1] + dx/2, y[0] - dy/2, y[-1] + dy/2)
+
+def _levels_norm(values:np.ndarray, n_levels:int, norm=None)->pplt.colors.DiscreteNorm:
+	## Norm with n_levels evenly spaced levels over the finite range of the values
+	finite = values[np.isfinite(values)]
+	vmin,vmax = (finite.min(), finite.max()) if finite.size else (0, 1)
+	if vmin == vmax:
+		vmax = vmin + 1
+	return pplt.colors.DiscreteNorm(np.linspace(vmin, vmax, n_levels), norm=norm)
+
+def _plot_map(data_array:xr.DataArray, ax:pplt.axes.Axes):
+	"""
+		Draw 2D data following the raster configs, as one of
+		- a pcolormesh, rasterized when it holds more than rasterize_above points
+		- an image, for evenly spaced coordinates
+		- a NonUniformImage, for other monotonic coordinates
+		In 'auto' mode maps with more than rasterize_above points are drawn as image.
+		With downsample set, images are reduced to the resolution of the axis every time
+		they are drawn (see DecimatedMap), meshes always show the full data.
+		Returns:
+			the QuadMesh or image showing the data
+	"""
+	raster = configs['raster']
+	plotted = _plotted_array(data_array)
+	mode = raster['mode']
+	if mode == 'auto':
+		mode = 'image' if plotted.size > raster['rasterize_above'] else 'mesh'
+	if mode not in ('mesh', 'image'):
+		raise ValueError(f"Unknown raster mode '{mode}', use 'mesh', 'image' or 'auto'")
+
+	if mode == 'image' and all(_is_monotonic(plotted[dim].values) for dim in plotted.dims):
+		## A first decimation for the size of the axis before the layout is done, the
+		## image is decimated again when drawn
+		downsample = raster['downsample'] and all(plotted[dim].dtype.kind in 'iuf' for dim in plotted.dims)
+		x,y,values = _image_data(_map_array(plotted, _axis_shape(ax)) if downsample else plotted)
+		## Spacing and extent follow the full data, the decimated blocks at the edges can be incomplete
+		full_x,full_y,full_values = _image_data(plotted)
+		if _is_uniform(full_x) and _is_uniform(full_y):
+			extent = _image_extent(full_x,full_y)
+			image = ax.imshow(values, extent = extent, origin = 'lower', aspect = 'auto', interpolation = 'nearest', **configs['2D'])
+		else:
+			extent = (x[0], x[-1], y[0], y[-1])
+			image = NonUniformImage(ax, interpolation = 'nearest', cmap = pplt.Colormap(configs['2D']['cmap']), extent = extent)
+			image.set_norm(_levels_norm(values, configs['2D']['levels']))
+			image.set_data(x, y, values)
+			ax.add_image(image)
+		if downsample:
+			DecimatedMap(image, full_values, full_y, full_x)
+		## Descending coordinates run down the axis, as for a mesh
+		ydim,xdim = plotted.dims
+		ascending = [plotted[dim].values[0] <= plotted[dim].values[-1] for dim in (xdim,ydim)]
+		ax.set_xlim(extent[:2] if ascending[0] else extent[1::-1])
+		ax.set_ylim(extent[2:] if ascending[1] else extent[:1:-1])
+		return image
+	return ax.pcolormesh(plotted, rasterized = plotted.size > raster['rasterize_above'], **configs['2D'])
+
+def _track(plot_output:dict, artist, data_array:xr.DataArray, dataset_idx:int, sel:dict=None)->None:
+	## Remember which data an artist shows, so it can be updated in place later on
+	if artist is None:
+		return
+	plotted = _plotted_array(data_array)
+	plot_output.setdefault('artists', []).append({
+		'artist': artist,
+		'dataset': dataset_idx,
+		'var': data_array.name,
+		'sel': sel,
+		'coords': [plotted[dim].values.copy() for dim in plotted.dims] if isinstance(artist, (QuadMesh, AxesImage)) else None,
+	})
+
+def _layout_signature(datasets:list[xr.Dataset])->tuple:
+	## Describes the grid of axes autoplot creates for the datasets: the variables,
+	## the dimensions plotted for each, the number of cuts of 3D data and all labels
+	signature = []
+	for ds in datasets:
+		for var in ds.data_vars:
+			shape = ds[var].shape
+			plotted_dims = tuple(dim for dim,size in zip(ds[var].dims, shape) if size > 1)
+			n_cuts = shape[0] if len(plotted_dims) > 2 else None
+			labels = tuple(_resolve_labels(ds, [*plotted_dims, var]).labels())
+			attr_labels = tuple((ds[key].attrs.get('long_name'), ds[key].attrs.get('units')) for key in (*plotted_dims, var))
+			signature.append((var, plotted_dims, n_cuts, labels, attr_labels))
+		signature.append(ds.attrs.get('run_id'))
+	return tuple(signature)
+
+def _rescale_norm(artist, values:np.ndarray)->None:
+	## Fit the colour range of a map to new values
+	norm = artist.norm
+	if isinstance(norm, pplt.colors.DiscreteNorm):
+		## Rebuild the norm, changing the limits of a DiscreteNorm in place does not reach the colorbar
+		colorbar = artist.colorbar
+		if colorbar is not None:
+			locators = colorbar.locator, colorbar.minorlocator
+		## Assigned as property, NonUniformImage refuses set_norm once it holds data
+		artist.norm = _levels_norm(values, len(norm.boundaries), norm=copy.copy(norm._norm))
+		## A new norm resets the ticks of the colorbar
+		if colorbar is not None:
+			colorbar.locator, colorbar.minorlocator = locators
+	else:
+		finite = values[np.isfinite(values)]
+		if finite.size:
+			artist.set_clim(finite.min(), finite.max())
+
+def _update_artist(artist, data_array:xr.DataArray, old_coords=None)->bool:
+	## Push new data into an existing artist, returns False if the artist can not show it
+	plotted = _plotted_array(data_array)
+	if isinstance(artist, (QuadMesh, AxesImage)):
+		if plotted.ndim != 2 or old_coords is None:
+			return False
+		if any(old.shape != plotted[dim].shape or not np.allclose(old, plotted[dim].values) for old,dim in zip(old_coords, plotted.dims)):
+			return False
+		if isinstance(artist, QuadMesh):
+			values = np.asarray(plotted.values)
+			if values.shape != artist.get_array().shape:
+				return False
+			artist.set_array(values)
+		else:
+			x,y,values = _image_data(plotted)
+			decimated = DecimatedMap.of(artist)
+			if decimated is not None:
+				decimated.set_data(values, y, x)
+			elif values.shape != artist.get_array().shape:
+				return False
+			elif isinstance(artist, NonUniformImage):
+				artist.set_data(x, y, values)
+			else:
+				artist.set_data(values)
+		_rescale_norm(artist, values)
+		return True
+	if isinstance(artist, Line2D):
+		if plotted.ndim != 1:
+			return False
+		decimated = DecimatedLine.of(artist)
+		if decimated is not None:
+			decimated.set_data(plotted[plotted.dims[0]].values, np.asarray(plotted.values))
+			return True
+		artist.set_data(plotted[plotted.dims[0]].values, np.asarray(plotted.values))
+		artist.axes.relim()
+		artist.axes.autoscale_view()
+		return True
+	return False
+
+def update_autoplot(plot_output:dict, datasets:list[xr.Dataset])->bool:
+	"""
+		Update the figures created by autoplot with new data, without rebuilding them
+		The artists keep their figure, axes, colorbars and labels, only the plotted values change.
+		Args:
+			plot_output (dict): the output of autoplot for datasets with the same layout
+			datasets (list[xr.Dataset]): the datasets with the new data
+		Returns:
+			bool: True if all artists were updated, False if the figures have to be rebuilt
+			because the layout, shape or coordinates of the data changed
+	"""
+	Parameter.reload()
+	if plot_output.get('layout') != _layout_signature(datasets):
+		return False
+	entries = plot_output.get('artists', [])
+	for entry in entries:
+		data_array = datasets[entry['dataset']][entry['var']]
+		if entry['sel'] is not None:
+			data_array = data_array.sel(entry['sel'], method = 'nearest')
+		if not _update_artist(entry['artist'], data_array, entry['coords']):
+			return False
+	for figure in _figures(plot_output):
+		figure.canvas.draw_idle()
+	return True
+
+def _figures(plot_output:dict)->list:
+	## Nested outputs hold a list of figures per dataset
+	figures = []
+	for fig in plot_output['fig']:
+		figures.extend(fig if isinstance(fig, list) else [fig])
+	return figures
+
+def redisplay_autoplot(plot_output:dict)->bool:
+	"""
+		Show updated figures again if they were closed by the backend,
+		as the inline backend of notebooks does after every cell
+		Returns:
+			bool: False if a closed figure can not be displayed outside of IPython
+	"""
+	closed = [figure for figure in _figures(plot_output) if not plt.fignum_exists(figure.number)]
+	if not closed:
+		return True
+	try:
+		from IPython import get_ipython
+		from IPython.display import display
+	except ImportError:
+		return False
+	if get_ipython() is None:
+		return False
+	for figure in closed:
+		display(figure)
+	return True
 
 def _construct_auto_fig(N:int):
 	"""
@@ -173,8 +480,8 @@ def autoplot(datasets: list[xr.Dataset]):
 			- Create a single figure with an axis for each dataset, 
 			to plot the single data variable for each.
 	"""
-	## Reload Parameter class to make sure latest config is used
-	## TODO check if this becomes a speed bottleneck for large number of parameters
+	## Reload Parameter class to make sure latest config is used,
+	## the parameter file is only read again if it changed since the last load
 	Parameter.reload()
 
 	## Check the contents of the supplied datasets
@@ -193,11 +500,15 @@ def autoplot(datasets: list[xr.Dataset]):
 		plot_output = {
 			'fig':[],
 			'axs':[],
+			'artists':[],
 		}
-		for dataset in datasets:
+		for dataset_idx,dataset in enumerate(datasets):
 			sub_output = autoplot([dataset])
 			plot_output['fig'].append(sub_output['fig'])
 			plot_output['axs'].append(sub_output['axs'])
+			for entry in sub_output['artists']:
+				plot_output['artists'].append({**entry, 'dataset': dataset_idx})
+		plot_output['layout'] = _layout_signature(datasets)
 		return plot_output
 
 	## Multiple datasets with each 1 variable: create a single figure
@@ -209,16 +520,19 @@ def autoplot(datasets: list[xr.Dataset]):
 		n_axs = n_datasets
 		fig,axs = _construct_auto_fig(n_axs)
 		title = 'Datasets '
+		plot_output = {
+			'fig': [fig],
+			'axs': [axs],
+			'artists': [],
+			'layout': _layout_signature(datasets),
+		}
 		for idx,dset in enumerate(datasets):
-			handle_plot(dset[list(dset.data_vars)[0]],ax=axs[idx])
+			data_array = dset[list(dset.data_vars)[0]]
+			_track(plot_output, handle_plot(data_array,ax=axs[idx]), data_array, idx)
 			if hasattr(dset, 'run_id'):
 				title += f'{dset.run_id},'
 		if configs['figs']['set_title']:
 			fig.format(suptitle = title[:-1])
-		plot_output = {
-			'fig': [fig],
-			'axs': [axs],
-		}
 		return plot_output
 
 	## A single dataset with multiple variables: create a single figure
@@ -230,6 +544,10 @@ def autoplot(datasets: list[xr.Dataset]):
 		if (n_dims[0] > 2) and (n_datavars[0] > 1):
 			raise ValueError("Auto-plotting a multidimensional dataset with multiple variables is not supported. Select a single variable to ouput")
 
+		plot_output = {
+			'artists': [],
+			'layout': _layout_signature(datasets),
+		}
 		if n_dims[0] < 3:
 			n_axs = n_datavars[0]
 			fig,axs = _construct_auto_fig(n_axs)
@@ -238,19 +556,19 @@ def autoplot(datasets: list[xr.Dataset]):
 					fig.format(suptitle = f'Dataset {dataset.run_id}')
 
 			for idx,var in enumerate(dataset.data_vars):
-				handle_plot(dataset[var],ax = axs[idx])
+				_track(plot_output, handle_plot(dataset[var],ax = axs[idx]), dataset[var], 0)
 		else:
 			n_axs = len(dataset[coords[0]].values)
 			fig,axs = _construct_auto_fig(n_axs)
 
+			coord = coords[0]
+			outer = _resolve_labels(dataset, [coord])
 			for idx,coord_val in enumerate(dataset[coords[0]].values):
-				coord = coords[0]
-				axs[idx].format(title = f'{Parameter[coord].verbose_name} = {coord_val} ({Parameter[coord].unit})',fontsize = 7)
+				axs[idx].format(title = f'{outer.verbose_names[0]} = {coord_val} ({outer.units[0]})',fontsize = 7)
 				cut_dataset = dataset.sel({f'{coords[0]}':coord_val}, method = 'nearest')
-				handle_plot(cut_dataset[list(dataset.data_vars)[0]], ax = axs[idx])
+				data_array = cut_dataset[list(dataset.data_vars)[0]]
+				_track(plot_output, handle_plot(data_array, ax = axs[idx]), data_array, 0, {coord: coord_val})
 
-		plot_output = {
-			'fig': [fig],
-			'axs': [axs],
-		}
+		plot_output['fig'] = [fig]
+		plot_output['axs'] = [axs]
 		return plot_output
\ No newline at end of file
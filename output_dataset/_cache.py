@@ -0,0 +1,320 @@
+import os, json, glob, hashlib, tempfile, warnings
+from collections import OrderedDict
+from typing import List, Tuple, Dict
+from typing import Optional, Union,Callable
+
+import numpy as np
+import xarray as xr
+
+from ._parameter_handler import _file_mode
+
+## Attributes that can not be stored as netcdf attributes are stored as json,
+## the names of the converted attributes are kept under this key
+_json_attrs_key = 'cache_json_attrs'
+
+def _encode_attrs(attrs:dict)->dict:
+	json_keys = [key for key,value in attrs.items() if isinstance(value,(list,tuple,dict))]
+	if not json_keys:
+		return dict(attrs)
+	encoded = {key:(json.dumps(value) if key in json_keys else value) for key,value in attrs.items()}
+	encoded[_json_attrs_key] = json.dumps(json_keys)
+	return encoded
+
+def _decode_attrs(attrs:dict)->dict:
+	if _json_attrs_key not in attrs:
+		return attrs
+	json_keys = json.loads(attrs.pop(_json_attrs_key))
+	for key in json_keys:
+		attrs[key] = json.loads(attrs[key])
+	return attrs
+
+def _decode_dataset_attrs(dataset:xr.Dataset)->xr.Dataset:
+	dataset.attrs = _decode_attrs(dataset.attrs)
+	for key in dataset.variables:
+		dataset[key].attrs = _decode_attrs(dataset[key].attrs)
+	return dataset
+
+def get_cache_path(name:str)->str:
+	"""
+		Path of a directory in the cache directory of the user, outside the package so it can be
+		installed read-only and shared between users, e.g. ~/.cache/output_dataset/<name> on Linux
+		Args:
+			name (str): the name of the directory
+		Returns:
+			String containing the path to the directory, which is not created
+	"""
+	try:
+		from platformdirs import user_cache_dir
+	except ImportError:
+		return os.path.join(os.path.expanduser('~'), '.cache', 'output_dataset', name)
+	return os.path.join(user_cache_dir('output_dataset', appauthor=False), name)
+
+class RunCache():
+	"""
+		On-disk cache of QCoDeS runs converted to xarray, stored as NetCDF files
+		Every file is keyed by the database path, GUID and run_id of the run,
+		only completed runs are stored since their data can no longer change.
+		Opening a cache file takes about 20 ms whatever its size, runs smaller than min_bytes
+		are read from the database at least as fast and are not stored.
+		When the total size exceeds max_bytes, the least recently used files are removed.
+		Args:
+			directory (str): optional, directory holding the cache files, by default
+				run_cache in the cache directory of the user (see get_cache_path)
+	"""
+	extension = '.nc'
+
+	def __init__(self, directory:Optional[str]=None, max_bytes:int=2*1024**3, enabled:bool=True, min_bytes:int=256*1024):
+		self.directory = directory if directory is not None else get_cache_path('run_cache')
+		self.max_bytes = max_bytes
+		self.min_bytes = min_bytes
+		self.enabled = enabled
+
+	def __repr__(self):
+		return f"RunCache(directory={self.directory}, size={self.size()/1024**2:.1f} MB, max={self.max_bytes/1024**2:.1f} MB)"
+
+	@staticmethod
+	def _db_key(db_path:str)->str:
+		db_path = os.path.abspath(os.path.expanduser(str(db_path)))
+		return hashlib.sha1(db_path.encode()).hexdigest()[:16]
+
+	def file_path(self, db_path:str, guid:str, run_id:int)->str:
+		"""
+			Obtain the location of the cache file of a run
+			Args:
+				db_path (str): path to the database containing the run
+				guid (str): the GUID of the run
+				run_id (int): the id of the run in the database
+			Returns:
+				str: path to the (possibly not yet existing) cache file
+		"""
+		return os.path.join(self.directory, f"{self._db_key(db_path)}_{run_id}_{guid}{self.extension}")
+
+	def load(self, db_path:str, guid:str, run_id:int)->Optional[xr.Dataset]:
+		"""
+			Load a run from the cache
+			Returns:
+				xr.Dataset: the cached dataset, or None if the run is not in the cache
+		"""
+		file_path = self.file_path(db_path, guid, run_id)
+		if not os.path.exists(file_path):
+			return None
+		try:
+			dataset = _decode_dataset_attrs(xr.load_dataset(file_path, engine='h5netcdf'))
+		except FileNotFoundError:
+			return None
+		except (OSError, ValueError) as e:
+			## Only files that can not be decoded are removed, other errors do not say anything about the file
+			warnings.warn(f"Removing unreadable cache file {file_path}: {e}")
+			self._remove(file_path)
+			return None
+		self._touch(file_path)
+		return dataset
+
+	def open(self, db_path:str, guid:str, run_id:int, chunks:Union[dict,str,int]='auto')->Optional[xr.Dataset]:
+		"""
+			Open a run from the cache as dask-chunked dataset, without reading the data
+			Args:
+				chunks: chunk sizes per dimension, as accepted by xarray.open_dataset
+			Returns:
+				xr.Dataset: the lazily opened dataset, or None if the run is not in the cache
+		"""
+		file_path = self.file_path(db_path, guid, run_id)
+		if not os.path.exists(file_path):
+			return None
+		try:
+			dataset = xr.open_dataset(file_path, engine='h5netcdf', chunks=chunks)
+		except (OSError, ValueError) as e:
+			warnings.warn(f"Could not open cache file {file_path}: {e}")
+			return None
+		self._touch(file_path)
+		return _decode_dataset_attrs(dataset)
+
+	@staticmethod
+	def _touch(file_path:str)->None:
+		## Mark as recently used for the LRU eviction
+		try:
+			os.utime(file_path)
+		except OSError:
+			pass
+
+	def store(self, db_path:str, guid:str, run_id:int, dataset:xr.Dataset)->None:
+		"""
+			Write a run to the cache, replacing any previous version atomically
+			and evicting old files when the cache grows beyond max_bytes
+			Runs smaller than min_bytes are not written
+		"""
+		if dataset.nbytes < self.min_bytes:
+			return
+		os.makedirs(self.directory, exist_ok=True)
+		file_path = self.file_path(db_path, guid, run_id)
+		to_write = dataset.copy(deep=False)
+		to_write.attrs = _encode_attrs(dataset.attrs)
+		for key in to_write.variables:
+			to_write[key].attrs = _encode_attrs(dataset[key].attrs)
+
+		## Write to a temporary file first, so readers never see a partially written run
+		file_handle, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+		os.close(file_handle)
+		try:
+			## Complex data is not part of the netcdf standard, but readable by h5netcdf. h5netcdf
+			## only warns about this for files named .nc, the temporary file is not
+			to_write.to_netcdf(tmp_path, engine='h5netcdf', invalid_netcdf=True)
+			## mkstemp creates the file readable by the owner only
+			os.chmod(tmp_path, _file_mode(file_path))
+			os.replace(tmp_path, file_path)
+		except Exception as e:
+			self._remove(tmp_path)
+			warnings.warn(f"Could not cache run {run_id}: {e}")
+			return
+		self.evict()
+
+	def _files(self)->List[str]:
+		return glob.glob(os.path.join(self.directory, f"*{self.extension}"))
+
+	@staticmethod
+	def _remove(file_path:str)->None:
+		try:
+			os.remove(file_path)
+		except OSError:
+			pass
+
+	def size(self)->int:
+		"""Total size of the cache files in bytes"""
+		total = 0
+		for file_path in self._files():
+			try:
+				total += os.path.getsize(file_path)
+			except OSError:
+				pass
+		return total
+
+	def evict(self, max_bytes:Optional[int]=None)->None:
+		"""
+			Remove the least recently used files until the cache fits in max_bytes
+			Args:
+				max_bytes (int): optional, size to shrink to, defaults to the cache maximum
+		"""
+		max_bytes = self.max_bytes if max_bytes is None else max_bytes
+		entries = []
+		for file_path in self._files():
+			try:
+				stat = os.stat(file_path)
+			except OSError:
+				continue
+			entries.append((stat.st_mtime, stat.st_size, file_path))
+		total = sum(entry[1] for entry in entries)
+		for mtime,size,file_path in sorted(entries):
+			if total <= max_bytes:
+				break
+			self._remove(file_path)
+			total -= size
+
+	def invalidate(self, run_id:Optional[int]=None, guid:Optional[str]=None, db_path:Optional[str]=None)->int:
+		"""
+			Remove cached runs matching all of the given arguments,
+			calling without arguments clears the whole cache
+			Args:
+				run_id (int): optional, remove runs with this id
+				guid (str): optional, remove the run with this GUID
+				db_path (str): optional, only remove runs from this database
+			Returns:
+				int: the number of removed files
+		"""
+		db_part = self._db_key(db_path) if db_path is not None else '*'
+		run_part = str(run_id) if run_id is not None else '*'
+		guid_part = guid if guid is not None else '*'
+		file_paths = glob.glob(os.path.join(self.directory, f"{db_part}_{run_part}_{guid_part}{self.extension}"))
+		for file_path in file_paths:
+			self._remove(file_path)
+		return len(file_paths)
+
+	def clear(self)->int:
+		"""Remove all cached runs"""
+		return self.invalidate()
+
+run_cache = RunCache() ## Cache used when loading runs from a QCoDeS database
+
+def _freeze(dataset:xr.Dataset)->None:
+	## Make the numpy buffers of a dataset read-only, any in-place write
+	## to a shared buffer then raises instead of silently corrupting it
+	for variable in dataset.variables.values():
+		data = variable._data
+		if isinstance(data, np.ndarray):
+			data.flags.writeable = False
+
+class DatasetMemo():
+	"""
+		In-memory LRU cache of loaded datasets
+		The cached datasets are never handed out directly: every lookup returns a
+		shallow copy sharing the read-only buffers of the original. DataOutput copies these
+		buffers before they can be written to, so the cached originals are never modified.
+		Entries are keyed by (db_path, run_id, guid), a database replaced at the same path
+		does not match the runs of the old one.
+	"""
+	def __init__(self, max_bytes:int=1024**3, enabled:bool=True):
+		self.max_bytes = max_bytes
+		self.enabled = enabled
+		self.hits = 0
+		self.misses = 0
+		self.nbytes = 0
+		self._datasets = OrderedDict()
+
+	def __repr__(self):
+		return f"DatasetMemo(entries={len(self._datasets)}, hits={self.hits}, misses={self.misses}, size={self.nbytes/1024**2:.1f} MB)"
+
+	def __contains__(self, key)->bool:
+		return key in self._datasets
+
+	def get(self, key)->Optional[xr.Dataset]:
+		"""
+			Look up a dataset
+			Returns:
+				xr.Dataset: a copy-on-write view of the cached dataset, None if it is not cached
+		"""
+		dataset = self._datasets.get(key) if self.enabled else None
+		if dataset is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self._datasets.move_to_end(key)
+		return dataset.copy(deep=False)
+
+	def put(self, key, dataset:xr.Dataset)->xr.Dataset:
+		"""
+			Store a dataset, evicting the least recently used ones when exceeding max_bytes
+			Datasets larger than max_bytes are not stored
+			Returns:
+				xr.Dataset: the dataset to use in place of the stored one
+		"""
+		if not self.enabled or dataset.nbytes > self.max_bytes:
+			return dataset
+		self.discard(key)
+		_freeze(dataset)
+		self._datasets[key] = dataset
+		self.nbytes += dataset.nbytes
+		while self.nbytes > self.max_bytes:
+			old_key,old_dataset = self._datasets.popitem(last=False)
+			self.nbytes -= old_dataset.nbytes
+		return dataset.copy(deep=False)
+
+	def discard(self, key)->None:
+		"""Remove a dataset from the memo if present"""
+		dataset = self._datasets.pop(key, None)
+		if dataset is not None:
+			self.nbytes -= dataset.nbytes
+
+	def clear(self)->None:
+		"""Remove all datasets and reset the statistics"""
+		self._datasets.clear()
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+
+	def stats(self)->dict:
+		"""Hits, misses, number of entries and memory usage of the memo"""
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'entries': len(self._datasets),
+			'nbytes': self.nbytes,
+		}
@@ -0,0 +1,253 @@
+import warnings, weakref
+from typing import Tuple, Optional
+
+import numpy as np
+from matplotlib.image import NonUniformImage
+
+def _pad_to_blocks(values:np.ndarray, factor:int, axis:int)->np.ndarray:
+	## Pad an axis with NaN up to a multiple of the block size
+	remainder = values.shape[axis] % factor
+	if remainder == 0:
+		return values
+	pad_width = [(0, 0)]*values.ndim
+	pad_width[axis] = (0, factor - remainder)
+	return np.pad(values.astype(float, copy=False), pad_width, constant_values=np.nan)
+
+def _block_centres(coord:np.ndarray, factor:int)->np.ndarray:
+	## Coordinate of each block: the mean of the coordinates it contains
+	if factor == 1:
+		return coord
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		return np.nanmean(_pad_to_blocks(coord.astype(float), factor, 0).reshape(-1, factor), axis=1)
+
+def _pair_positions(coord:np.ndarray, factor:int)->np.ndarray:
+	## Coordinates of the two halves of each block, interpolated at their centres and
+	## extrapolated linearly past the last coordinate for a padded final block
+	n_blocks = -(-coord.size//factor)
+	positions = (np.arange(2*n_blocks) + 0.5)*factor/2 - 0.5
+	coord = coord.astype(float)
+	if coord.size == 1:
+		return np.full(positions.size, coord[0])
+	index = np.arange(coord.size)
+	pairs = np.interp(positions, index, coord)
+	before, after = positions < 0, positions > index[-1]
+	pairs[before] = coord[0] + positions[before]*(coord[1] - coord[0])
+	pairs[after] = coord[-1] + (positions[after] - index[-1])*(coord[-1] - coord[-2])
+	return pairs
+
+def decimate_map(values:np.ndarray, y:np.ndarray, x:np.ndarray, shape:Tuple[int,int])->Tuple[np.ndarray,np.ndarray,np.ndarray]:
+	"""
+		Reduce a 2D map to at most the given shape, preserving its extremes
+		The map is split in blocks, and every block is replaced by its minimum and maximum,
+		placed side by side along x in the order they occur in the block. Narrow peaks and
+		dips stay visible and the minimum and maximum of the map, and so its colour range,
+		are unchanged.
+		Args:
+			values (np.ndarray): the 2D data, indexed as (y, x)
+			y (np.ndarray): coordinates along the first axis
+			x (np.ndarray): coordinates along the second axis
+			shape (tuple): maximum number of points along (y, x), e.g. the size of the axis in pixels
+		Returns:
+			tuple: the decimated values, y and x coordinates
+	"""
+	if all(size <= target for size,target in zip(values.shape, shape)):
+		return values, y, x
+	## Every block gives two values along x
+	fy = max(1, int(np.ceil(values.shape[0]/max(1, shape[0]))))
+	fx = max(1, int(np.ceil(values.shape[1]/max(1, shape[1]//2))))
+	blocks = _pad_to_blocks(_pad_to_blocks(values, fy, 0), fx, 1)
+	ny, nx = blocks.shape[0]//fy, blocks.shape[1]//fx
+	blocks = blocks.reshape(ny, fy, nx, fx).transpose(0, 2, 1, 3).reshape(ny, nx, fy*fx)
+
+	## NaN never wins, blocks without any data give NaN
+	missing = np.isnan(blocks)
+	index_min = np.argmin(np.where(missing, np.inf, blocks), axis=-1)
+	index_max = np.argmax(np.where(missing, -np.inf, blocks), axis=-1)
+	minima = np.take_along_axis(blocks, index_min[..., None], axis=-1)[..., 0]
+	maxima = np.take_along_axis(blocks, index_max[..., None], axis=-1)[..., 0]
+	## The extreme in the left column of the block comes first
+	min_first = index_min % fx <= index_max % fx
+	pairs = np.stack([np.where(min_first, minima, maxima), np.where(min_first, maxima, minima)], axis=-1)
+	return pairs.reshape(ny, 2*nx), _block_centres(y, fy), _pair_positions(x, fx)
+
+def minmax_decimate(x:np.ndarray, y:np.ndarray, n_bins:int)->Tuple[np.ndarray,np.ndarray]:
+	"""
+		Reduce a line to the envelope of its data: the smallest and largest
+		value of each of n_bins bins, kept in their original order
+		Returns:
+			tuple: x and y of at most 2*n_bins points
+	"""
+	n_points = y.size
+	if n_points <= 2*n_bins:
+		return x, y
+	factor = int(np.ceil(n_points/n_bins))
+	blocks = _pad_to_blocks(y, factor, 0).reshape(-1, factor)
+	## NaN never wins, bins without data pick a NaN and leave a gap in the line
+	index_min = np.argmin(np.where(np.isnan(blocks), np.inf, blocks), axis=1)
+	index_max = np.argmax(np.where(np.isnan(blocks), -np.inf, blocks), axis=1)
+	offsets = np.arange(blocks.shape[0])*factor
+	indices = np.sort(np.stack([index_min, index_max], axis=1), axis=1) + offsets[:,None]
+	indices = np.minimum(indices.ravel(), n_points - 1)
+	return x[indices], y[indices]
+
+def lttb_decimate(x:np.ndarray, y:np.ndarray, n_out:int)->Tuple[np.ndarray,np.ndarray]:
+	"""
+		Reduce a line to n_out points with the Largest-Triangle-Three-Buckets algorithm,
+		which keeps the points that contribute most to the visual shape of the line
+		Returns:
+			tuple: x and y of at most n_out points
+	"""
+	n_points = y.size
+	if n_out >= n_points or n_out < 3:
+		return x, y
+	x_float = x.astype(float)
+	## The first and last point are always kept, the others are divided in n_out-2 buckets
+	edges = np.linspace(1, n_points - 1, n_out - 1).astype(int)
+	indices = np.empty(n_out, dtype=int)
+	indices[0], indices[-1] = 0, n_points - 1
+	selected = 0
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning)
+		for bucket in range(n_out - 2):
+			start, end = edges[bucket], edges[bucket + 1]
+			next_end = edges[bucket + 2] if bucket + 2 < edges.size else n_points
+			next_x, next_y = x_float[end:next_end].mean(), np.nanmean(y[end:next_end])
+			area = np.abs((x_float[selected] - next_x)*(y[start:end] - y[selected])
+				- (x_float[selected] - x_float[start:end])*(next_y - y[selected]))
+			area[np.isnan(area)] = -1
+			selected = start + int(np.argmax(area))
+			indices[bucket + 1] = selected
+	return x[indices], y[indices]
+
+def decimate_line(x:np.ndarray, y:np.ndarray, n_points:int, method:str='minmax')->Tuple[np.ndarray,np.ndarray]:
+	"""
+		Reduce a line to about n_points points
+		Args:
+			method (str): 'minmax' for the envelope of the data, 'lttb' for the Largest-Triangle-Three-Buckets
+				selection, or 'none' to keep all points
+	"""
+	if method == 'minmax':
+		return minmax_decimate(x, y, max(1, n_points//2))
+	if method == 'lttb':
+		return lttb_decimate(x, y, n_points)
+	if method == 'none':
+		return x, y
+	raise ValueError(f"Unknown decimation method '{method}', use 'minmax', 'lttb' or 'none'")
+
+## The DecimatedLine of every decimated Line2D, removed together with the line
+_decimated_lines = weakref.WeakKeyDictionary()
+
+class DecimatedLine():
+	"""
+		Keeps the full data of a line, while the line itself only draws a few points
+		per pixel of its axis. When the limits of the x axis change, e.g. on zooming
+		or panning in an interactive backend, the visible range is decimated again.
+	"""
+	def __init__(self, line, x:np.ndarray, y:np.ndarray, method:str='minmax', points_per_pixel:float=2):
+		self.line = line
+		self.method = method
+		self.points_per_pixel = points_per_pixel
+		self.set_data(x, y)
+		## Plain functions are held strongly by the callback registry, keeping this object alive with the axis
+		line.axes.callbacks.connect('xlim_changed', lambda ax: self.redraw())
+		_decimated_lines[line] = self
+
+	@staticmethod
+	def of(line)->Optional['DecimatedLine']:
+		"""The DecimatedLine drawing a Line2D, None if the line is not decimated"""
+		return _decimated_lines.get(line)
+
+	def set_data(self, x:np.ndarray, y:np.ndarray, relim:bool=True)->None:
+		"""
+			Replace the full data of the line
+			Args:
+				relim (bool): rescale the axis to the new data
+		"""
+		x, y = np.asarray(x), np.asarray(y)
+		## Sorted x allows selecting the visible range by bisection
+		self.sorted = bool(np.all(np.diff(x) >= 0)) or bool(np.all(np.diff(x) <= 0))
+		if self.sorted and x.size > 1 and x[0] > x[-1]:
+			x, y = x[::-1], y[::-1]
+		self.x, self.y = x, y
+		## Sticky edges, as set by ultraplot to plot lines without margins, follow the full data
+		if self.line.sticky_edges.x and x.size:
+			self.line.sticky_edges.x[:] = [np.nanmin(x), np.nanmax(x)]
+		## The full range is drawn first, so the data limits of the axis cover all data
+		self.redraw(visible_only=False)
+		if relim:
+			self.line.axes.relim()
+			self.line.axes.autoscale_view()
+
+	def n_points(self)->int:
+		"""Number of points drawn for the width of the axis"""
+		return max(3, int(self.line.axes.get_window_extent().width*self.points_per_pixel))
+
+	def redraw(self, visible_only:bool=True)->None:
+		"""Decimate the data in the visible x range again"""
+		x, y = self.x, self.y
+		if visible_only and self.sorted:
+			x_min, x_max = sorted(self.line.axes.get_xlim())
+			## Keep one point beyond both edges, so the line runs up to the border of the axis
+			start = max(int(np.searchsorted(x, x_min, side='left')) - 1, 0)
+			end = min(int(np.searchsorted(x, x_max, side='right')) + 1, x.size)
+			x, y = x[start:end], y[start:end]
+		self.line.set_data(*decimate_line(x, y, self.n_points(), self.method))
+
+## The DecimatedMap of every decimated image, removed together with the image
+_decimated_maps = weakref.WeakKeyDictionary()
+
+class DecimatedMap():
+	"""
+		Keeps the full data of a map drawn as an image, while the image itself only holds
+		about one value per pixel of its axis (see decimate_map). The data is decimated when
+		the image is drawn, to the size of the axis in the final layout of the figure and at
+		the resolution it is drawn with, e.g. the dpi passed to savefig.
+		Args:
+			image: an AxesImage drawn with an extent, or a NonUniformImage
+			values (np.ndarray): the 2D data, indexed as (y, x) with ascending coordinates
+			y (np.ndarray): coordinates along the first axis
+			x (np.ndarray): coordinates along the second axis
+	"""
+	def __init__(self, image, values:np.ndarray, y:np.ndarray, x:np.ndarray):
+		self.image = image
+		self.set_data(values, y, x, decimate=False)
+		draw = image.draw
+		def draw_decimated(renderer, *args, **kwargs):
+			self.decimate(renderer)
+			return draw(renderer, *args, **kwargs)
+		image.draw = draw_decimated
+		_decimated_maps[image] = self
+
+	@staticmethod
+	def of(image)->Optional['DecimatedMap']:
+		"""The DecimatedMap drawing an image, None if the image is not decimated"""
+		return _decimated_maps.get(image)
+
+	def set_data(self, values:np.ndarray, y:np.ndarray, x:np.ndarray, decimate:bool=True)->None:
+		"""
+			Replace the full data of the map
+			Args:
+				decimate (bool): decimate for the current size of the axis at once, otherwise on the next draw
+		"""
+		self.values, self.y, self.x = np.asarray(values), np.asarray(y), np.asarray(x)
+		self.shape = None
+		if decimate:
+			self.decimate()
+
+	def axis_shape(self, renderer=None)->Tuple[int,int]:
+		"""Size of the axis in pixels, at the resolution of the renderer"""
+		bbox = self.image.axes.get_window_extent(renderer)
+		return int(np.ceil(bbox.height)), int(np.ceil(bbox.width))
+
+	def decimate(self, renderer=None)->None:
+		"""Decimate the data for the size of the axis, if it changed since the previous time"""
+		shape = self.axis_shape(renderer)
+		if shape == self.shape:
+			return
+		self.shape = shape
+		values, y, x = decimate_map(self.values, self.y, self.x, shape)
+		if isinstance(self.image, NonUniformImage):
+			self.image.set_data(x, y, values)
+		else:
+			self.image.set_data(values)
@@ -0,0 +1,116 @@
+import os, time, tempfile, warnings, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Optional
+
+import xarray as xr
+
+from ._autoplot import autoplot, configs, Parameter, _figures
+from ._parameter_handler import JSONParameterStore
+
+default_export_workers = max(1, min(8, (os.cpu_count() or 2) - 1)) ## Number of processes rendering figures at once
+
+def _figure_jobs(datasets:List[xr.Dataset])->List[List[xr.Dataset]]:
+	## Split the datasets the way autoplot does: a figure per dataset when
+	## any of them holds multiple variables, otherwise a single figure for all
+	if len(datasets) > 1 and any(len(dataset.data_vars) > 1 for dataset in datasets):
+		return [[dataset] for dataset in datasets]
+	return [datasets]
+
+def _file_names(jobs:List[List[xr.Dataset]], fmt:str)->List[str]:
+	## Figures of a single run are named after it, others by their position
+	names = []
+	for idx,job in enumerate(jobs):
+		run_id = job[0].attrs.get('run_id') if len(job) == 1 else None
+		name = f'run_{run_id}' if run_id is not None else f'figure_{idx}'
+		if name in names:
+			name = f'{name}_{idx}'
+		names.append(name)
+	return [f'{name}.{fmt}' for name in names]
+
+_worker_store = None
+
+def _init_export_worker(plot_configs:dict, parameters:Dict[str,dict])->None:
+	## Render without a display, with the configs and parameter settings of the parent process
+	global _worker_store
+	import matplotlib
+	matplotlib.use('Agg')
+	configs.update(plot_configs)
+	## A private copy of the parameters, so the workers never write to the parameter file
+	_worker_store = tempfile.TemporaryDirectory()
+	store = JSONParameterStore(os.path.join(_worker_store.name, 'verbose_params.json'))
+	store.save(parameters)
+	Parameter.use_store(store)
+
+def _render_figure(datasets:List[xr.Dataset], file_path:str, dpi:Optional[float]=None)->float:
+	## Autoplot one figure and write it, returns the time it took
+	import matplotlib.pyplot as plt
+	start = time.perf_counter()
+	plot_output = autoplot(datasets)
+	for figure in _figures(plot_output):
+		## Maps drawn as image are decimated while saving, for the resolution of the file
+		figure.savefig(file_path, dpi=dpi)
+		plt.close(figure)
+	return time.perf_counter() - start
+
+def export_autoplot(datasets:List[xr.Dataset], path:str, fmt:str='png', workers:Optional[int]=None,
+		dpi:Optional[float]=None, progress:bool=True)->Dict[str,float]:
+	"""
+		Autoplot datasets and write the figures to files, rendering them in parallel processes
+		Every figure autoplot would create is rendered in a separate process with the
+		non-interactive Agg backend, using the current configs and Parameter settings.
+		Args:
+			datasets (list[xr.Dataset]): the datasets to plot
+			path (str): directory to write the figures to, created if needed
+			fmt (str): file format, e.g. 'png', 'pdf' or 'svg'
+			workers (int): optional, number of processes, 1 renders in the current process
+			dpi (float): optional, resolution of raster formats
+			progress (bool): print every written figure with its rendering time
+		Returns:
+			dict: rendering time in seconds by written file path
+	"""
+	os.makedirs(path, exist_ok=True)
+	jobs = _figure_jobs(datasets)
+	file_paths = [os.path.join(path, name) for name in _file_names(jobs, fmt)]
+	workers = min(workers if workers is not None else default_export_workers, len(jobs))
+
+	timings = {}
+	errors = {}
+	start = time.perf_counter()
+	def report(file_path:str)->None:
+		if not progress:
+			return
+		count = f'[{len(timings) + len(errors)}/{len(jobs)}]'
+		if file_path in errors:
+			print(f'{count} {file_path} failed: {errors[file_path]}')
+		else:
+			print(f'{count} {file_path} {timings[file_path]:.2f} s')
+
+	if workers <= 1:
+		for job,file_path in zip(jobs,file_paths):
+			try:
+				timings[file_path] = _render_figure(job, file_path, dpi)
+			except Exception as e:
+				errors[file_path] = e
+			report(file_path)
+	else:
+		## Resolve all labels here, so the workers find every parameter
+		Parameter.resolve([key for dataset in datasets for key in dataset.variables])
+		parameters = {name: parameter._as_dict() for name,parameter in Parameter._instances.items()}
+		## Spawned workers start clean, without the state of an interactive backend or notebook
+		context = multiprocessing.get_context('spawn')
+		with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_export_worker,
+				initargs=(dict(configs), parameters)) as executor:
+			futures = {executor.submit(_render_figure, job, file_path, dpi): file_path for job,file_path in zip(jobs,file_paths)}
+			for future in as_completed(futures):
+				file_path = futures[future]
+				try:
+					timings[file_path] = future.result()
+				except Exception as e:
+					errors[file_path] = e
+				report(file_path)
+
+	if progress:
+		print(f'Exported {len(timings)} figure(s) in {time.perf_counter() - start:.2f} s')
+	if errors:
+		warnings.warn(f"Could not export {len(errors)} figure(s): " + ', '.join(f'{file_path} ({error})' for file_path,error in errors.items()))
+	return {file_path: timings[file_path] for file_path in file_paths if file_path in timings}
@@ -0,0 +1,137 @@
+import os, inspect, warnings, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import xarray as xr
+from scipy.optimize import curve_fit, OptimizeWarning
+
+default_fit_workers = max(1, min(8, (os.cpu_count() or 2) - 1)) ## Number of processes fitting slices at once
+min_slices_per_worker = 16 ## Fewer slices per worker are fitted in the current process
+
+## The model fitted by the worker processes. Forked workers inherit it,
+## so lambdas and functions defined in a notebook can be fitted too
+_fit_func = None
+
+def _init_fit_worker(func:Callable)->None:
+	global _fit_func
+	_fit_func = func
+
+def _parameter_names(func:Callable, n_params:Optional[int]=None)->List[str]:
+	## The arguments of the model after the independent variable
+	try:
+		parameters = list(inspect.signature(func).parameters.values())[1:]
+	except (TypeError, ValueError):
+		parameters = []
+	if parameters and not any(p.kind == p.VAR_POSITIONAL for p in parameters):
+		return [p.name for p in parameters]
+	if n_params is None:
+		raise ValueError("Could not determine the parameters of the fit function, please provide p0")
+	return [f'p{idx}' for idx in range(n_params)]
+
+def _fit_block(x:np.ndarray, block:np.ndarray, p0:np.ndarray, warm_start:bool, kwargs:dict,
+		func:Optional[Callable]=None)->Tuple[np.ndarray,np.ndarray,np.ndarray]:
+	"""
+		Fit consecutive slices, each starting from the result of the previous one
+		Args:
+			x (np.ndarray): the independent variable
+			block (np.ndarray): the slices to fit, shape (n_slices, n_points)
+			p0 (np.ndarray): the initial guess for the first slice, and after a failed fit
+			warm_start (bool): start every fit from the result of the previous slice
+		Returns:
+			tuple: the parameters (n_slices, n_params), covariances (n_slices, n_params, n_params)
+			and whether each fit succeeded (n_slices,)
+	"""
+	func = func if func is not None else _fit_func
+	n_params = p0.size
+	popt = np.full((block.shape[0], n_params), np.nan)
+	pcov = np.full((block.shape[0], n_params, n_params), np.nan)
+	success = np.zeros(block.shape[0], dtype=bool)
+	guess = p0
+	for idx,y in enumerate(block):
+		valid = np.isfinite(y) & np.isfinite(x)
+		if valid.sum() < n_params:
+			guess = p0
+			continue
+		try:
+			with warnings.catch_warnings():
+				## Covariances that can not be estimated are returned as inf
+				warnings.simplefilter('ignore', OptimizeWarning)
+				popt[idx], pcov[idx] = curve_fit(func, x[valid], y[valid], p0=guess, **kwargs)
+			success[idx] = True
+			## The finite difference steps of curve_fit scale with the parameters, so a parameter
+			## that came out (almost) zero would not move in the next fit, it starts from p0 instead
+			guess = np.where(np.abs(popt[idx]) > 1e-6*np.abs(p0), popt[idx], p0) if warm_start else p0
+		except (RuntimeError, ValueError):
+			guess = p0
+	return popt, pcov, success
+
+def fit_along(data_array:xr.DataArray, func:Callable, dim:str, p0=None, workers:Optional[int]=None,
+		warm_start:bool=True, **kwargs)->xr.Dataset:
+	"""
+		Fit a model to every 1D slice of a DataArray along one dimension
+		The slices are divided in contiguous blocks, one per worker process. Within a block
+		every fit starts from the result of the neighbouring slice, which suits parameters
+		that change slowly from slice to slice, e.g. a resonance followed over a gate voltage.
+		Args:
+			data_array (xr.DataArray): the data to fit
+			func (Callable): the model func(x, *params), as for scipy.optimize.curve_fit
+			dim (str): the dimension to fit along, its coordinate is the independent variable
+			p0: optional, initial guess of the parameters, by default all ones
+			workers (int): optional, number of processes, 1 fits in the current process
+			warm_start (bool): start every fit from the result of the previous slice
+			kwargs: passed on to scipy.optimize.curve_fit, e.g. bounds or maxfev
+		Returns:
+			xr.Dataset: indexed by the remaining coordinates of the data, holding
+			popt (the parameters), perr (their standard errors), pcov (the covariances)
+			and success (whether the fit converged)
+	"""
+	if dim not in data_array.dims:
+		raise KeyError(f"Can not fit along '{dim}', the data has dimensions {data_array.dims}")
+	names = _parameter_names(func, None if p0 is None else np.size(p0))
+	p0 = np.ones(len(names)) if p0 is None else np.atleast_1d(np.asarray(p0, dtype=float))
+	if p0.size != len(names):
+		raise ValueError(f"p0 has {p0.size} values, the fit function has {len(names)} parameters: {names}")
+
+	## All slices as rows of a 2D array, the fitted dimension last
+	data_array = data_array.transpose(..., dim)
+	other_dims = data_array.dims[:-1]
+	x = np.asarray(data_array[dim].values, dtype=float)
+	slices = np.asarray(data_array.values, dtype=float).reshape(-1, x.size)
+
+	workers = default_fit_workers if workers is None else workers
+	workers = max(1, min(workers, slices.shape[0]//min_slices_per_worker))
+	if workers == 1:
+		popt, pcov, success = _fit_block(x, slices, p0, warm_start, kwargs, func=func)
+	else:
+		blocks = np.array_split(slices, workers)
+		if 'fork' in multiprocessing.get_all_start_methods():
+			## Forked workers inherit the model, it does not need to be picklable
+			_init_fit_worker(func)
+			executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+		else:
+			executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_fit_worker, initargs=(func,))
+		try:
+			with executor:
+				results = list(executor.map(_fit_block, [x]*workers, blocks, [p0]*workers, [warm_start]*workers, [kwargs]*workers))
+		finally:
+			_init_fit_worker(None)
+		popt, pcov, success = (np.concatenate(result) for result in zip(*results))
+
+	shape = data_array.shape[:-1]
+	coords = {key: coord for key,coord in data_array.coords.items() if dim not in coord.dims}
+	coords['parameter'] = names
+	with np.errstate(invalid='ignore'):
+		perr = np.sqrt(np.diagonal(pcov, axis1=1, axis2=2))
+	fit_result = xr.Dataset(
+		{
+			'popt': ((*other_dims, 'parameter'), popt.reshape(*shape, len(names))),
+			'perr': ((*other_dims, 'parameter'), perr.reshape(*shape, len(names))),
+			'pcov': ((*other_dims, 'parameter', 'parameter_2'), pcov.reshape(*shape, len(names), len(names))),
+			'success': (other_dims, success.reshape(shape)),
+		},
+		coords = {**coords, 'parameter_2': names},
+	)
+	fit_result.attrs['fit_function'] = getattr(func, '__name__', str(func))
+	fit_result.attrs['fit_dim'] = dim
+	return fit_result
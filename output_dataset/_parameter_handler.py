@@ -1,9 +1,17 @@
 import json
 import os
-from typing import List, Tuple, Dict
+import sqlite3
+import stat
+import tempfile
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import List, Tuple, Dict, NamedTuple
 from typing import Optional, Union,Callable
 from importlib import reload
 
+import numpy as np
+
 from IPython.core.display import Markdown
 from IPython.display import display
 
@@ -42,16 +50,144 @@ def load_dictionary(filename:str)->dict:
 			json.dump(default, f)
 			return default
 			
+def _file_mode(file_path:str)->int:
+	## The permissions of an existing file, or those open() gives a new file under the current umask.
+	## Files written through tempfile.mkstemp get these, mkstemp creates them readable by the owner only
+	try:
+		return stat.S_IMODE(os.stat(file_path).st_mode)
+	except OSError:
+		umask = os.umask(0)
+		os.umask(umask)
+		return 0o666 & ~umask
+
 def save_dictionary(dictionary:dict, filename:str)->None:
 	"""
 		Save a dictionary to a json file
+		The file is replaced atomically, so readers never see a partially written file
 		Args:
 			dictionary: the dict with values to save
 			file_path: str containing path to json file to store data
 	"""
 	file_path = get_file_path(filename)
-	with open(file_path, 'w') as f:
-		json.dump(dictionary, f,indent=4)
+	file_handle, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(file_path))
+	try:
+		with os.fdopen(file_handle, 'w') as f:
+			json.dump(dictionary, f,indent=4)
+		os.chmod(tmp_path, _file_mode(file_path))
+		os.replace(tmp_path, file_path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+
+class JSONParameterStore():
+	"""
+		Parameter settings stored in a json file
+		Keeps track of the state of the file when it was last read or written,
+		so the settings are only read again when another process changed the file
+	"""
+	def __init__(self, filename:str):
+		self.filename = filename
+		self._signature = None
+		self._params = {}
+
+	def _file_signature(self)->Optional[tuple]:
+		## Every save replaces the file, changing the inode as well as the modification time
+		try:
+			stat = os.stat(get_file_path(self.filename))
+		except OSError:
+			return None
+		return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+	def changed(self)->bool:
+		"""Check if the file changed since it was last read or written"""
+		return self._signature is None or self._file_signature() != self._signature
+
+	def load(self)->dict:
+		"""Read the settings of all parameters"""
+		self._params = load_dictionary(self.filename)
+		self._signature = self._file_signature()
+		return dict(self._params)
+
+	def save(self, params_as_dict:dict)->None:
+		"""
+			Write the settings of the given parameters
+			The whole file is rewritten, including parameters that were not passed
+		"""
+		## Keep parameters added by other processes since the last read
+		if self._signature is not None and self.changed():
+			self._params.update(load_dictionary(self.filename))
+		self._params.update(params_as_dict)
+		save_dictionary(self._params, self.filename)
+		self._signature = self._file_signature()
+
+class SQLiteParameterStore():
+	"""
+		Parameter settings stored in a SQLite database
+		Every parameter is a row that is updated on its own, so multiple processes
+		can add and update parameters at the same time without losing each others changes.
+		The database is used in WAL mode, readers do not block the writers.
+	"""
+	def __init__(self, filename:str="verbose_params.sqlite"):
+		self.filename = filename
+		self._lock = threading.Lock()
+		self._data_version = None
+		self._conn = sqlite3.connect(get_file_path(filename), timeout=30, check_same_thread=False, isolation_level=None)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute("""CREATE TABLE IF NOT EXISTS parameters (
+			param_name TEXT PRIMARY KEY,
+			verbose_name TEXT,
+			unit TEXT,
+			scale REAL,
+			offset REAL)""")
+
+	def _current_data_version(self)->int:
+		## Increases whenever another connection commits a change to the database
+		return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+	def changed(self)->bool:
+		"""Check if another connection changed the parameters since they were last read"""
+		with self._lock:
+			return self._data_version is None or self._current_data_version() != self._data_version
+
+	def load(self)->dict:
+		"""Read the settings of all parameters"""
+		with self._lock:
+			rows = self._conn.execute("SELECT param_name, verbose_name, unit, scale, offset FROM parameters").fetchall()
+			self._data_version = self._current_data_version()
+		return {row[0]: {'verbose_name': row[1], 'unit': row[2], 'scale': row[3], 'offset': row[4]} for row in rows}
+
+	def save(self, params_as_dict:dict)->None:
+		"""Insert or update the rows of the given parameters, other rows are left untouched"""
+		rows = [(param_name, item.get('verbose_name'), item.get('unit'), item.get('scale'), item.get('offset'))
+			for param_name,item in params_as_dict.items()]
+		with self._lock:
+			with self._conn:
+				self._conn.executemany("""INSERT INTO parameters (param_name, verbose_name, unit, scale, offset)
+					VALUES (?, ?, ?, ?, ?)
+					ON CONFLICT(param_name) DO UPDATE SET
+					verbose_name=excluded.verbose_name, unit=excluded.unit, scale=excluded.scale, offset=excluded.offset""", rows)
+
+	def close(self)->None:
+		self._conn.close()
+
+class ResolvedParameters(NamedTuple):
+	"""Settings of multiple parameters as arrays, in the order of the requested keys"""
+	verbose_names: np.ndarray
+	units: np.ndarray
+	scales: np.ndarray
+	offsets: np.ndarray
+
+	def labels(self, with_unit: bool=True)->List[str]:
+		"""Axis labels of the parameters, see Parameter.as_label"""
+		if with_unit:
+			return [f"{verbose_name} ({unit})" for verbose_name,unit in zip(self.verbose_names,self.units)]
+		return [f"{verbose_name}" for verbose_name in self.verbose_names]
+
+	@property
+	def identity(self)->np.ndarray:
+		"""Mask of the parameters that leave the data unchanged (scale 1, offset 0)"""
+		return (self.scales == 1) & (self.offsets == 0)
 
 class ParameterMeta(type):
     """Metaclass to allow Parameter['name'] lookup at the class level."""
@@ -61,6 +197,10 @@ class ParameterMeta(type):
 class Parameter(metaclass=ParameterMeta):
 	_instances = {}  # Store instances by name
 	filename_params = "verbose_params.json" ## Hardcoded parameter filename
+	_store = None
+	_batch_depth = 0 ## Saves are postponed while inside Parameter.batch()
+	_unsaved = set()
+	__slots__ = ('param_name','verbose_name','unit','scale','offset')
 
 	def __init__(self, param_name, verbose_name = None, unit = '-', scale = 1, offset = 0):
 		if param_name in Parameter._instances:
@@ -98,11 +238,11 @@ class Parameter(metaclass=ParameterMeta):
 			self.update_widget()
 		else:
 			for key,item in kwargs.items():
-				if hasattr(self,key):
+				if key in Parameter.__slots__:
 					setattr(self,key,item)
 				else:
 					raise KeyError(f"{self.__class__.__name__} has not attribute {key}")
-			Parameter.save() ## Dump all data into the parameter file
+			Parameter.save(self.param_name) ## Dump the data into the parameter file
 
 	def update_widget(self):
 		# Define four interactive widgets
@@ -120,34 +260,122 @@ class Parameter(metaclass=ParameterMeta):
 			self.unit = unit.value
 			self.scale = float(scale.value)
 			self.offset = float(offset.value)
-			Parameter.save()
+			Parameter.save(self.param_name)
 
 		button.on_click(on_submit)
 		# Display widgets
 		display(name, unit, scale, offset, button)	
 
+	def _as_dict(self)->dict:
+		return {attr: getattr(self, attr) for attr in ['verbose_name','unit','scale','offset']}
+
 	@classmethod
-	def reload(cls):
+	def resolve(cls, keys:List[str], defaults:Optional[Dict[str,tuple]]=None, create:bool=True)->ResolvedParameters:
+		"""
+			Look up the settings of many parameters at once
+			Parameters that do not exist yet are created and saved in a single batch
+			Args:
+				keys (list of str): the names of the parameters
+				defaults (dict): optional, (verbose_name, unit) by name, used for new parameters
+				create (bool): create and save the missing parameters, otherwise the default
+					settings are returned for them without changing the Parameters or the store
+			Returns:
+				ResolvedParameters: verbose names, units, scales and offsets as arrays
+		"""
+		missing = [key for key in dict.fromkeys(keys) if key not in cls._instances]
+		defaults = defaults if defaults is not None else {}
+		if missing and create:
+			with cls.batch():
+				for key in missing:
+					verbose_name,unit = defaults.get(key, (None,None))
+					Parameter(key, verbose_name = verbose_name, unit = unit)
+				cls.save(*missing)
+		parameters = [cls._instances[key] if key in cls._instances else cls._default_settings(key, *defaults.get(key, (None,None)))
+			for key in keys]
+		return ResolvedParameters(
+			np.array([parameter.verbose_name for parameter in parameters], dtype=object),
+			np.array([parameter.unit for parameter in parameters], dtype=object),
+			np.array([parameter.scale for parameter in parameters], dtype=float),
+			np.array([parameter.offset for parameter in parameters], dtype=float),
+		)
+
+	@staticmethod
+	def _default_settings(key:str, verbose_name:Optional[str]=None, unit:Optional[str]=None)->SimpleNamespace:
+		## The settings a new Parameter would get, without creating it
+		return SimpleNamespace(verbose_name = str(verbose_name) if verbose_name is not None else str(key),
+			unit = str(unit) if unit is not None else '-', scale = 1., offset = 0.)
+
+	@classmethod
+	def store(cls)->Union[JSONParameterStore,SQLiteParameterStore]:
+		"""The store holding the parameter settings, by default the json parameter file"""
+		if cls._store is None or (isinstance(cls._store, JSONParameterStore) and cls._store.filename != cls.filename_params):
+			cls._store = JSONParameterStore(cls.filename_params)
+		return cls._store
+
+	@classmethod
+	def use_store(cls, store:Union[JSONParameterStore,SQLiteParameterStore])->None:
+		"""
+			Switch to another store for the parameter settings and load its parameters,
+			e.g. Parameter.use_store(SQLiteParameterStore()) for safe use from multiple processes
+			The current parameters are copied to the new store if it is empty
+		"""
+		cls._store = store
+		cls.filename_params = store.filename
+		if not store.load():
+			cls.save()
+		cls.reload(force=True)
+
+	@classmethod
+	def reload(cls, force:bool=False):
+		"""
+			Reload all parameters from the parameter file,
+			only if the file changed since it was last read or written
+			Args:
+				force (bool): reload even if the file did not change
+		"""
+		if not force and not cls.store().changed():
+			return
 		cls._instances = {}
-		verbose_param_dict = load_dictionary(cls.filename_params)
-		for key,item in verbose_param_dict.items():
-			Parameter(key, verbose_name = item.get('verbose_name'),unit=item.get('unit'), scale=item.get('scale'), offset=item.get('offset'))				
+		cls.load()
 
 	@classmethod
 	def load(cls):
-		verbose_param_dict = load_dictionary(cls.filename_params)
+		verbose_param_dict = cls.store().load()
 		for key,item in verbose_param_dict.items():
 			Parameter(key, verbose_name = item.get('verbose_name'),unit=item.get('unit'), scale=item.get('scale'), offset=item.get('offset'))
 
 	@classmethod
-	def save(cls):
-		params_as_dict = {}
-		for param_name,parameter in cls._instances.items():
-			params_as_dict[parameter.param_name] = {}
-			for attr in ['verbose_name','unit','scale','offset']:
-				value = getattr(parameter, attr)
-				params_as_dict[parameter.param_name][attr]=value
-		save_dictionary(params_as_dict,cls.filename_params)
+	def save(cls, *param_names:str):
+		"""
+			Save parameters to the store
+			Args:
+				param_names (str): the parameters to save, all parameters if none are given
+		"""
+		if not param_names:
+			param_names = tuple(cls._instances)
+		## Inside Parameter.batch() the store is written once, when leaving the batch
+		if cls._batch_depth > 0:
+			cls._unsaved.update(param_names)
+			return
+		params_as_dict = {param_name: cls._instances[param_name]._as_dict() for param_name in param_names if param_name in cls._instances}
+		cls.store().save(params_as_dict)
+
+	@classmethod
+	@contextmanager
+	def batch(cls):
+		"""
+			Context manager collecting all saves made inside it into a single write,
+			e.g. when creating many new parameters at once
+		"""
+		cls._batch_depth += 1
+		try:
+			yield
+		finally:
+			cls._batch_depth -= 1
+			if cls._batch_depth == 0 and cls._unsaved:
+				param_names = tuple(cls._unsaved)
+				cls._unsaved.clear()
+				cls.save(*param_names)
 
 	@classmethod
 	def all(cls):
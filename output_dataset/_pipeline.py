@@ -0,0 +1,219 @@
+import os, sys, copy, inspect, warnings
+from typing import List, Optional, Iterator
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import _processing
+
+## Processing steps that transform every value on its own, up to the range of the data,
+## consecutive ones are fused into a single pass over each data variable
+_elementwise_steps = ('multiply', 'normalize')
+## Steps a select can be moved in front of: they neither change the coordinates nor depend on
+## values outside the selection. normalize (range of all data) and adjust_axis (coordinates) do not commute
+_select_commutes_with = ('multiply', 'transpose')
+
+_fused_block_size = 2**16 ## Elements per block of a fused pass, small enough to stay in the CPU cache
+
+def _recorded_argument(value):
+	## Containers are copied, so changing e.g. a selection dict afterwards does not change the plan.
+	## Their contents and all other arguments are kept by reference, arrays (e.g. weights) are never copied
+	if isinstance(value, dict):
+		recorded = copy.copy(value)
+		for key,item in value.items():
+			recorded[key] = _recorded_argument(item)
+		return recorded
+	if isinstance(value, list):
+		recorded = copy.copy(value)
+		recorded[:] = [_recorded_argument(item) for item in value]
+		return recorded
+	if isinstance(value, set):
+		return copy.copy(value)
+	if type(value) is tuple:
+		return tuple(_recorded_argument(item) for item in value)
+	return value
+
+class Step():
+	"""
+		A recorded call of a processing function, e.g. Step('multiply', 1e3)
+		Args:
+			name (str): the function in _processing
+			args, kwargs: the arguments following the DataOutput
+	"""
+	def __init__(self, name:str, *args, **kwargs):
+		self.name = name
+		self.args = _recorded_argument(args)
+		self.kwargs = _recorded_argument(kwargs)
+
+	def __repr__(self):
+		arguments = [repr(arg) for arg in self.args] + [f'{key}={value!r}' for key,value in self.kwargs.items()]
+		return f"{self.name}({', '.join(arguments)})"
+
+	def arguments(self)->dict:
+		"""All arguments of the call by name, including defaults"""
+		bound = inspect.signature(getattr(_processing, self.name)).bind(None, *self.args, **self.kwargs)
+		bound.apply_defaults()
+		return dict(list(bound.arguments.items())[1:])
+
+	def run(self, data_output)->None:
+		getattr(_processing, self.name)(data_output, *self.args, **self.kwargs)
+
+def _is_fusable(step:Step)->bool:
+	if step.name not in _elementwise_steps:
+		return False
+	if step.name == 'multiply':
+		multiplier = step.arguments()['multiplier']
+		return np.isscalar(multiplier) and np.isrealobj(multiplier)
+	return True
+
+def _scale_and_shift(values:np.ndarray, scale, shift)->None:
+	## values*scale + shift in place, in blocks so both operations are done in one pass over memory
+	if values.size <= _fused_block_size or not values.flags.c_contiguous:
+		blocks = [values]
+	else:
+		flat_values = values.reshape(-1)
+		blocks = (flat_values[start:start+_fused_block_size] for start in range(0, flat_values.size, _fused_block_size))
+	for block in blocks:
+		if scale != 1:
+			np.multiply(block, scale, out=block)
+		if shift != 0:
+			np.add(block, shift, out=block)
+
+class FusedStep(Step):
+	"""
+		Consecutive multiply and normalize steps, computed as a single affine transform
+		Every normalize only depends on the minimum and maximum of the data, which follow from
+		those of the input, so all steps together reduce to values*scale + shift
+	"""
+	def __init__(self, steps:List[Step]):
+		super().__init__('fused')
+		self.steps = steps
+		self._arguments = [(step.name, step.arguments()) for step in steps]
+
+	def __repr__(self):
+		return f"fused[{' > '.join(repr(step) for step in self.steps)}]"
+
+	def _transform(self, values:np.ndarray)->tuple:
+		## The scale and shift of the whole chain for the given input values
+		scale, shift = 1, 0
+		if any(name == 'normalize' for name,arguments in self._arguments):
+			with warnings.catch_warnings():
+				## All-NaN data gives NaN, as for the separate steps
+				warnings.simplefilter('ignore', RuntimeWarning)
+				data_min, data_max = np.nanmin(values), np.nanmax(values)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			for name,arguments in self._arguments:
+				if name == 'multiply':
+					scale, shift = scale*arguments['multiplier'], shift*arguments['multiplier']
+					continue
+				low, high = sorted([scale*data_min + shift, scale*data_max + shift])
+				data_range = np.float64(high - low)
+				if not arguments['inverse']:
+					scale, shift = scale/data_range, (shift - low)/data_range
+				else:
+					scale, shift = -scale/data_range, (high - shift)/data_range
+		return scale, shift
+
+	def _dtype(self, dtype:np.dtype)->np.dtype:
+		## The type the separate steps would produce
+		for name,arguments in self._arguments:
+			dtype = np.result_type(dtype, arguments['multiplier'] if name == 'multiply' else float)
+		return dtype
+
+	def run(self, data_output)->None:
+		if any(_processing._is_lazy(dataset[key]) for dataset in data_output.datasets for key in dataset.data_vars):
+			## Dask-backed data only builds a task graph, the steps are added to it one by one
+			for step in self.steps:
+				step.run(data_output)
+			return
+		inplace = all(_processing._use_inplace(arguments['inplace']) for name,arguments in self._arguments)
+		new_datasets = []
+		for dataset in data_output.datasets:
+			new_dataset = _processing._target(dataset, inplace)
+			for data_var in dataset.data_vars:
+				values = dataset.variables[data_var].values
+				scale, shift = self._transform(values)
+				values = _processing._output_values(new_dataset, data_var, inplace, dtype=self._dtype(values.dtype))
+				_scale_and_shift(values, scale, shift)
+			new_datasets.append(new_dataset)
+		data_output.datasets = new_datasets
+
+class Pipeline():
+	"""
+		Processing calls recorded on a DataOutput, in the order they were made
+		A pipeline can be inspected by printing it, and replayed on other data
+		with DataOutput.replay. Before running, the plan is optimized (see optimized)
+		Args:
+			steps (list of Step): optional, the initial steps
+	"""
+	def __init__(self, steps:Optional[List[Step]]=None):
+		self.steps = list(steps) if steps else []
+
+	def record(self, name:str, *args, **kwargs)->Step:
+		"""Append a call of the processing function name"""
+		step = Step(name, *args, **kwargs)
+		self.steps.append(step)
+		return step
+
+	def __len__(self)->int:
+		return len(self.steps)
+
+	def __iter__(self)->Iterator[Step]:
+		return iter(self.steps)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return Pipeline(self.steps[index])
+		return self.steps[index]
+
+	def __repr__(self):
+		if not self.steps:
+			return 'Pipeline()'
+		lines = [f'  {idx}: {step!r}' for idx,step in enumerate(self.steps)]
+		return 'Pipeline(\n' + '\n'.join(lines) + '\n)'
+
+	def unfused(self)->List[Step]:
+		"""The steps as recorded, with fused steps split up again"""
+		return [inner for step in self.steps for inner in (step.steps if isinstance(step, FusedStep) else [step])]
+
+	def optimized(self)->'Pipeline':
+		"""
+			An equivalent plan that processes less data
+			Every select is moved in front of the steps it commutes with (multiply and transpose),
+			so these only process the selected cut, and consecutive multiply and normalize steps
+			are fused into a single pass over each data variable
+			Returns:
+				Pipeline: the optimized plan
+		"""
+		steps = self.unfused()
+		for idx,step in enumerate(steps):
+			if step.name != 'select':
+				continue
+			position = idx
+			while position > 0 and steps[position-1].name in _select_commutes_with:
+				steps[position-1], steps[position] = steps[position], steps[position-1]
+				position -= 1
+
+		optimized_steps = []
+		fusable = []
+		for step in steps + [None]:
+			if step is not None and _is_fusable(step):
+				fusable.append(step)
+				continue
+			if len(fusable) > 1:
+				optimized_steps.append(FusedStep(fusable))
+			else:
+				optimized_steps.extend(fusable)
+			fusable = []
+			if step is not None:
+				optimized_steps.append(step)
+		return Pipeline(optimized_steps)
+
+	def run(self, data_output, optimize:bool=True)->None:
+		"""
+			Process the datasets of a DataOutput with all steps
+			Args:
+				optimize (bool): run the optimized plan, otherwise every step as recorded
+		"""
+		for step in (self.optimized() if optimize else self):
+			step.run(data_output)
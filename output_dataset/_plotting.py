@@ -10,7 +10,7 @@ import os,sys
 current_file_path = os.path.abspath(__file__)
 current_directory = os.path.dirname(current_file_path)
 sys.path.append(current_directory)
-from _autoplot import _construct_auto_fig
+from _autoplot import _construct_auto_fig, plot_line
 
 def reverse_coords(coords):
     return list(reversed(list(coords)))
@@ -178,13 +178,14 @@ def plot(data_output,fig,axs,**kwargs):
     idx = 0
     for ds in datasets:
         for data_var in ds.data_vars:
+            ## Long traces are decimated to the resolution of the axis, ds keeps the full data
             if count == len(axs):
-                l, = axs[idx].plot(ds[data_var],**kwargs)
+                l = plot_line(ds[data_var],axs[idx],**kwargs)
             else:
                 try:
-                    l, = axs[0].plot(ds[data_var],**kwargs)
+                    l = plot_line(ds[data_var],axs[0],**kwargs)
                 except TypeError:
-                    l, = axs.plot(ds[data_var],**kwargs)
+                    l = plot_line(ds[data_var],axs,**kwargs)
         
             lines.append(l)
             idx+=1
@@ -24,13 +24,80 @@ from typing import Optional, Union,Callable
 # merge datasets
 # 
 
+## In-place policy of the processing functions, overridden per call with inplace=...
+## In place, results are written into the existing buffers of the datasets, buffers that are
+## read-only (e.g. shared with the memo of loaded runs, or between a DataOutput and its subsets)
+## or can not hold the result are copied first.
+## Out of place, every dataset is replaced by a shallow copy in which only the changed variables
+## get new buffers. Unchanged variables and coordinates are shared in both cases.
+default_inplace = True
+
+## The processing functions below that copy read-only buffers before writing to them, other functions,
+## e.g. added with save_process, are handed datasets with private writable buffers
+_copy_on_write_functions = {'transpose', 'normalize', 'select', 'reduce', 'average_outerdim', 'adjust_axis',
+    'multiply', 'fused'}
+
+## The processing functions that transform every value on its own, the new values
+## of a live run are then processed without processing the others again
+_pointwise_functions = {'multiply'}
+
+def _use_inplace(inplace):
+    return default_inplace if inplace is None else inplace
+
+def _target(dataset, inplace):
+    """The dataset a processing step writes to: the dataset itself, or a copy sharing all buffers"""
+    return dataset if inplace else dataset.copy(deep=False)
+
+def _output_values(dataset, key, inplace, dtype=None):
+    """
+        Obtain the buffer a processing step writes the new values of a variable to
+        Args:
+            dataset (xr.Dataset): the dataset returned by _target
+            key (str): name of the variable
+            inplace (bool): reuse the existing buffer where possible
+            dtype: optional, type or scalar operand the buffer must be able to hold,
+                e.g. float for a normalization of integer data
+        Returns:
+            np.ndarray: a writable buffer holding the current values, that is part of dataset
+    """
+    variable = dataset.variables[key]
+    values = variable.values
+    dtype = np.result_type(values.dtype, dtype) if dtype is not None else values.dtype
+    if inplace and values.flags.writeable and dtype == values.dtype:
+        return values
+    values = values.astype(dtype, copy=True)
+    variable.values = values
+    return values
+
+def _writable_values(dataset, key):
+    """
+        Obtain the values of a data variable for writing in place
+        Read-only buffers, e.g. shared with the memo of loaded runs,
+        are first replaced by a private copy (copy-on-write)
+        Args:
+            dataset (xr.Dataset): the dataset containing the variable
+            key (str): name of the data variable
+        Returns:
+            np.ndarray: the writable values of the variable
+    """
+    variable = dataset[key].variable
+    values = variable.values
+    if not values.flags.writeable:
+        values = values.copy()
+        variable.values = values
+    return values
+
+def _is_lazy(data_array):
+    """Check if a DataArray is backed by a (lazy) dask array"""
+    return data_array.chunks is not None
+
 def reverse_coords(coords):
     return list(reversed(list(coords)))
     
 def transpose(data_output):
     """
         Transpose the data variables using xarrays
-        build-in transpose funciton
+        build-in transpose funciton, the transposed data are views sharing the buffers
         Args:
             datasets: list of xarray Datasets 
         Returns:
@@ -41,18 +108,41 @@ def transpose(data_output):
         processed_data.append(dataset.transpose())
     data_output.datasets = processed_data
      
-def normalize(data_output,inverse=False):
+def normalize(data_output,inverse=False,inplace=None):
+    """
+        Scale every data variable to the range 0 to 1
+        NaN values, e.g. points of a run that were not measured, are left out of the range and stay NaN,
+        as for dask-backed data
+        Args:
+            inverse (bool): map the maximum to 0 and the minimum to 1
+            inplace (bool): optional, overrides default_inplace
+    """
+    inplace = _use_inplace(inplace)
     new_datasets = []
     for dataset in data_output.datasets:
-        new_dataset = dataset
+        new_dataset = _target(dataset, inplace)
         for data_var in dataset.data_vars:
+            if _is_lazy(new_dataset[data_var]):
+                ## Compose the normalization into the task graph of dask-backed data
+                data_array = new_dataset[data_var]
+                data_min = data_array.min()
+                data_max = data_array.max()
+                if not inverse:
+                    normalized = (data_array - data_min)/(data_max - data_min)
+                else:
+                    normalized = (data_max - data_array)/(data_max - data_min)
+                normalized.attrs = data_array.attrs
+                new_dataset[data_var] = normalized
+                continue
+
+            values = _output_values(new_dataset, data_var, inplace, dtype=float)
             if not inverse:
-                new_dataset[data_var] -= np.min(dataset[data_var])
-                new_dataset[data_var] /= np.max(dataset[data_var])
+                values -= np.nanmin(values)
+                values /= np.nanmax(values)
             else:
-                new_dataset[data_var] -= np.max(dataset[data_var])
-                new_dataset[data_var] *= -1                                
-                new_dataset[data_var] /= np.max(dataset[data_var])
+                values -= np.nanmax(values)
+                values *= -1                                
+                values /= np.nanmax(values)
 
         new_datasets.append(new_dataset)
     data_output.datasets=new_datasets
@@ -64,7 +154,7 @@ def select(data_output, sel_dict):
             datasets (list of Datasets): the data to which the sel operation is applied
             sel_dict: dictionary to pass to the .sel() function that specifies the coordinate and value
         Returns:
-            list of xarray datasets with reduced dimensionality
+            list of xarray datasets with reduced dimensionality, as views sharing the buffers
     """
     method = 'nearest'
     for key in sel_dict:
@@ -74,19 +164,129 @@ def select(data_output, sel_dict):
     for idx,dataset in enumerate(data_output.datasets):
         data_output.datasets[idx] = dataset.sel(sel_dict, method = method)
 
-def average_outerdim(datasets):
-    for dataset in datasets:
+_supported_reductions = ['mean', 'median', 'sum', 'std']
+
+def _reduction_weights(dataset, dim, weights):
+    ## Weights can be given as the name of a variable, a DataArray or values along dim
+    if weights is None or isinstance(weights, xr.DataArray):
+        return weights
+    if isinstance(weights, str):
+        return dataset[weights]
+    return xr.DataArray(np.asarray(weights), dims=[dim])
+
+def _streaming_reduce(data_array, dim, method, weights=None, skipna=True, chunk_size=1, ddof=0):
+    """
+        Reduce a numpy-backed DataArray over dim, reading chunk_size slices at a time
+        The (weighted) count, mean and sum of squared deviations are accumulated per chunk
+        and combined with the parallel algorithm of Chan et al., so the full
+        dimension never needs to be held in a temporary array
+    """
+    if method == 'median':
+        raise ValueError("The median can not be accumulated in chunks, reduce without chunk_size instead")
+    axis = data_array.get_axis_num(dim)
+    n_values = data_array.sizes[dim]
+    if weights is not None:
+        weights = weights.broadcast_like(data_array).transpose(*data_array.dims)
+
+    total_weight = 0
+    mean = 0
+    sum_squares = 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for start in range(0, n_values, chunk_size):
+            chunk = {dim: slice(start, start+chunk_size)}
+            values = data_array.isel(chunk).values
+            chunk_weights = np.ones_like(values) if weights is None else weights.isel(chunk).values
+            if skipna:
+                valid = ~np.isnan(values)
+                chunk_weights = np.where(valid, chunk_weights, 0)
+                values = np.where(valid, values, 0)
+            chunk_weight = chunk_weights.sum(axis=axis)
+            chunk_mean = (chunk_weights*values).sum(axis=axis)/chunk_weight
+            chunk_mean = np.where(chunk_weight > 0, chunk_mean, 0)
+            deviations = values - np.expand_dims(chunk_mean, axis)
+            chunk_sum_squares = (chunk_weights*deviations**2).sum(axis=axis)
+
+            new_weight = total_weight + chunk_weight
+            delta = chunk_mean - mean
+            fraction = np.where(new_weight > 0, chunk_weight/new_weight, 0)
+            mean = mean + delta*fraction
+            sum_squares = sum_squares + chunk_sum_squares + delta**2*total_weight*fraction
+            total_weight = new_weight
+
+        if method == 'sum':
+            result = mean*total_weight
+        elif method == 'mean':
+            result = np.where(total_weight > 0, mean, np.nan)
+        else:
+            result = np.sqrt(sum_squares/(total_weight - (ddof if weights is None else 0)))
+
+    template = data_array.isel({dim: 0}, drop=True)
+    return template.copy(data=np.asarray(result, dtype=float))
+
+def _reduce_data_array(data_array, dim, method='mean', weights=None, skipna=True, chunk_size=None, ddof=0):
+    ## Reduce a single variable, keeping its name and attributes
+    if method not in _supported_reductions:
+        raise ValueError(f"Reduction '{method}' not supported, use one of {_supported_reductions}")
+    if chunk_size is not None and not _is_lazy(data_array):
+        reduced = _streaming_reduce(data_array, dim, method, weights=weights, skipna=skipna, chunk_size=chunk_size, ddof=ddof)
+    elif weights is not None:
+        weighted = data_array.weighted(weights)
+        if method == 'median':
+            reduced = weighted.quantile(0.5, dim=dim, skipna=skipna, keep_attrs=True).drop_vars('quantile')
+        else:
+            reduced = getattr(weighted, method)(dim=dim, skipna=skipna, keep_attrs=True)
+    else:
+        kwargs = {'ddof': ddof} if method == 'std' else {}
+        reduced = getattr(data_array, method)(dim=dim, skipna=skipna, keep_attrs=True, **kwargs)
+    reduced.attrs = data_array.attrs
+    reduced.name = data_array.name
+    return reduced
+
+def reduce(data_output, dim:int|str, method:str='mean', weights=None, skipna:bool=True, chunk_size:Optional[int]=None, ddof:int=0):
+    """
+        Reduce the data variables over a dimension in a single vectorized call
+        Args:
+            data_output (DataOutput): the data to reduce
+            dim (int|str): the dimension to reduce, either its name or the index of the coordinate
+            method (str): one of 'mean', 'median', 'sum' or 'std'
+            weights: optional, weights along dim for a weighted reduction. Either the name
+                of a variable or coordinate, a DataArray or an array with the length of dim
+            skipna (bool): ignore NaN values
+            chunk_size (int): optional, reduce numpy-backed data by accumulating chunk_size
+                slices of dim at a time, limiting the temporary memory for large dimensions
+            ddof (int): delta degrees of freedom of the unweighted standard deviation
+        Returns:
+            the datasets are replaced by datasets without dim, variables that do not
+            depend on dim are kept unchanged
+    """
+    for idx,dataset in enumerate(data_output.datasets):
+        reduce_dim = list(dataset.coords)[dim] if isinstance(dim, int) else dim
+        dim_weights = _reduction_weights(dataset, reduce_dim, weights)
+        new_dataset = dataset.drop_dims(reduce_dim)
+        for data_var in dataset.data_vars:
+            if reduce_dim in dataset[data_var].dims:
+                new_dataset[data_var] = _reduce_data_array(dataset[data_var], reduce_dim, method, weights=dim_weights,
+                    skipna=skipna, chunk_size=chunk_size, ddof=ddof)
+        new_dataset.attrs = dataset.attrs
+        data_output.datasets[idx] = new_dataset[list(dataset.data_vars)]
+
+def average_outerdim(data_output, inplace=None):
+    """
+        Average the data variables over the outer coordinate of each dataset,
+        and add the result to the dataset as 'average_<data variable>'
+        Dask-backed data is averaged lazily
+        Args:
+            data_output (DataOutput): the data to average
+            inplace (bool): optional, add the average to the existing dataset objects, overrides default_inplace
+    """
+    inplace = _use_inplace(inplace)
+    for idx,dataset in enumerate(data_output.datasets):
+        new_dataset = _target(dataset, inplace)
         outer_coord = list(dataset.coords)[0]
         data_coord = list(dataset.data_vars)[0]
-    
-        output_values = np.zeros(dataset[data_coord].shape[1:])  
-    
-        for outer_val in dataset[outer_coord].values:
-            subset = dataset.sel({f'{outer_coord}':outer_val}, method = 'nearest')
-            output_values += subset[data_coord].values
-        output_values = output_values/len(dataset[outer_coord].values)
-        dataset[f'average_{data_coord}'] = xr.DataArray(output_values, coords = subset.coords, attrs = dataset[data_coord].attrs)
-    return datasets
+        average = _reduce_data_array(dataset[data_coord], outer_coord, 'mean', skipna=False)
+        new_dataset[f'average_{data_coord}'] = average.rename(f'average_{data_coord}')
+        data_output.datasets[idx] = new_dataset
 
 
 _supported_adjustments = {
@@ -116,18 +316,21 @@ def _handle_get_default(values:list, **kwargs):
     """
     raise(AttributeError('No adjustment function specified. Please specify a function or a string that is supported.'))
 
-def adjust_axis(data_output, mapping:Callable|str, adjust:Optional[int|str] = 'all',**kwargs)->list[xr.Dataset]:
+def adjust_axis(data_output, mapping:Callable|str, adjust:Optional[int|str] = 'all', inplace:Optional[bool] = None, **kwargs)->list[xr.Dataset]:
     """
         Map one or more axis of datasets to new values
+        Only the adjusted coordinates are replaced, the data variables keep their buffers
         Args:
             datasets (list of Datasets): the data to which the sel operation is applied
             mapping (Callable): function to which to pass the coordinate that should be adjused
             adjust (int|str): optional, the axis to pass to mapping. By default
                 all axis are processed. Can be either the axis index or the axis name.
+            inplace (bool): optional, replace the coordinates in the existing dataset objects,
+                overrides default_inplace
         Returns:
             list of xarray datasets with new axis
     """
-    
+    inplace = _use_inplace(inplace)
     if isinstance(mapping,str):
         adjust_func_name = _supported_adjustments.get(mapping, '_handle_get_default')
         adjust_func = getattr(sys.modules[__name__],adjust_func_name)
@@ -147,38 +350,64 @@ def adjust_axis(data_output, mapping:Callable|str, adjust:Optional[int|str] = 'a
             old_coord_attrs = dataset[coord_key].attrs
             coord_values = old_coord_da.values
             new_values = mapping(coord_values,**kwargs)
+            ## Unchanged coordinates keep their index
+            if np.array_equal(new_values, coord_values):
+                continue
             new_coord_dict[coord_key] = (f'{coord_key}',new_values,old_coord_attrs)
 
-        old_attrs = dataset.attrs
-        new_dataset = dataset.assign_coords(new_coord_dict)
-        new_dataset.attrs = old_attrs
-        data_output.datasets[idx] = new_dataset
+        data_output.datasets[idx] = _assign_coords(dataset, new_coord_dict, inplace)
 
-def adjust_coordinate_offset(dataset, coord_key, offset):
+def _assign_coords(dataset, new_coord_dict, inplace):
+    ## Replace coordinates, keeping the attributes of the dataset and sharing the data buffers
+    if not new_coord_dict:
+        return dataset
+    if inplace:
+        dataset.coords.update(new_coord_dict)
+        return dataset
+    old_attrs = dataset.attrs
+    new_dataset = dataset.assign_coords(new_coord_dict)
+    new_dataset.attrs = old_attrs
+    return new_dataset
+
+def adjust_coordinate_offset(dataset, coord_key, offset, inplace=None):
     new_coord_dict = {}
     old_coord_da= dataset[coord_key]
     old_coord_attrs = dataset[coord_key].attrs
     coord_values = old_coord_da.values
     new_values = coord_values - offset
     new_coord_dict[coord_key] = (f'{coord_key}',new_values,old_coord_attrs)
-    old_attrs = dataset.attrs
-    new_dataset = dataset.assign_coords(new_coord_dict)
-    new_dataset.attrs = old_attrs
-    return new_dataset
-
-def adjust_data_offset(dataset,data_key,offset):
-    data_array = dataset[data_key]
-    old_attrs = dataset[data_key].attrs
-    data_array = data_array - offset
-    dataset[data_key] = data_array
-    dataset[data_key].attrs = old_attrs
-    return dataset
+    return _assign_coords(dataset, new_coord_dict, _use_inplace(inplace))
 
-def multiply(data_output: 'DataOutput' , multiplier: int):
+def adjust_data_offset(dataset,data_key,offset,inplace=None):
+    inplace = _use_inplace(inplace)
+    new_dataset = _target(dataset, inplace)
+    if _is_lazy(dataset[data_key]):
+        old_attrs = dataset[data_key].attrs
+        new_dataset[data_key] = dataset[data_key] - offset
+        new_dataset[data_key].attrs = old_attrs
+        return new_dataset
+    values = _output_values(new_dataset, data_key, inplace, dtype=offset)
+    np.subtract(values, offset, out=values)
+    return new_dataset
 
+def multiply(data_output: 'DataOutput' , multiplier: int, inplace: Optional[bool] = None):
+    """
+        Multiply all data variables, the coordinates are left unchanged
+        Args:
+            multiplier: the factor to multiply with
+            inplace (bool): optional, overrides default_inplace
+    """
+    inplace = _use_inplace(inplace)
     ## Loop over all datasets
     for idx,dataset in enumerate(data_output.datasets):
-        new_dataset = dataset*multiplier
+        new_dataset = _target(dataset, inplace)
+        for data_var in dataset.data_vars:
+            if _is_lazy(dataset[data_var]):
+                new_dataset[data_var] = dataset[data_var]*multiplier
+                new_dataset[data_var].attrs = dataset[data_var].attrs
+                continue
+            values = _output_values(new_dataset, data_var, inplace, dtype=multiplier)
+            np.multiply(values, multiplier, out=values)
 
         ## Override the old dataset with the new dataset
         data_output.datasets[idx] = new_dataset
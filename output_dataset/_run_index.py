@@ -0,0 +1,275 @@
+import os, json, time, sqlite3, datetime
+from typing import List, Dict, Optional, Union, Callable, Any
+
+import pandas as pd
+
+from ._cache import RunCache, get_cache_path
+from ._snapshot import SnapshotIndex
+
+_schema = """
+	CREATE TABLE IF NOT EXISTS runs (
+		run_id INTEGER PRIMARY KEY,
+		guid TEXT,
+		name TEXT,
+		exp_name TEXT,
+		sample_name TEXT,
+		run_timestamp REAL,
+		completed_timestamp REAL,
+		is_completed INTEGER,
+		ndim INTEGER,
+		shapes TEXT,
+		snapshot_values TEXT
+	);
+	CREATE TABLE IF NOT EXISTS parameters (
+		run_id INTEGER,
+		name TEXT,
+		role TEXT
+	);
+	CREATE INDEX IF NOT EXISTS parameters_name ON parameters (name, role, run_id);
+	CREATE INDEX IF NOT EXISTS parameters_run ON parameters (run_id);
+	CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (run_timestamp);
+	CREATE TABLE IF NOT EXISTS info (
+		key TEXT PRIMARY KEY,
+		value TEXT
+	);
+"""
+
+def _parse_description(run_description:Optional[str])->dict:
+	## The dependent and independent parameters, dimensionality and shapes of a run
+	try:
+		description = json.loads(run_description)
+		paramspecs = description['interdependencies']['paramspecs']
+	except (TypeError, ValueError, KeyError):
+		return {'dependent': [], 'independent': [], 'ndim': None, 'shapes': None}
+	independent = list(dict.fromkeys(setpoint for spec in paramspecs for setpoint in spec.get('depends_on', [])))
+	inferred = {name for spec in paramspecs for name in spec.get('inferred_from', [])}
+	dependent = [spec['name'] for spec in paramspecs if spec['name'] not in independent and spec['name'] not in inferred]
+	ndim = max([len(spec.get('depends_on', [])) for spec in paramspecs if spec['name'] in dependent], default=0)
+	return {'dependent': dependent, 'independent': independent, 'ndim': ndim, 'shapes': description.get('shapes')}
+
+def _timestamp(value:Union[None,float,str,datetime.datetime,datetime.timedelta])->Optional[float]:
+	## Unix time of a time given as timestamp, ISO string, datetime, or as a timedelta before now
+	if value is None or isinstance(value, (int, float)):
+		return value
+	if isinstance(value, datetime.timedelta):
+		return time.time() - value.total_seconds()
+	if isinstance(value, str):
+		value = datetime.datetime.fromisoformat(value)
+	return value.timestamp()
+
+def _as_list(value:Union[None,str,List[str]])->List[str]:
+	if value is None:
+		return []
+	return [value] if isinstance(value, str) else list(value)
+
+class RunIndex():
+	"""
+		Local index of the metadata of all runs in a QCoDeS database, for finding runs without loading them
+		The index is stored in its own SQLite file and updated incrementally: every update only reads
+		the runs added since the previous update, and the runs that were not completed then
+		Args:
+			db_path (str): path to the QCoDeS database
+			snapshot_paths (list of str): optional, dotted snapshot paths whose values are indexed,
+				e.g. ['station.instruments.dac.parameters.ch01.value']. Changing them re-reads all snapshots
+			directory (str): optional, directory holding the index files, by default
+				run_index in the cache directory of the user (see get_cache_path)
+	"""
+	def __init__(self, db_path:str, snapshot_paths:Optional[List[str]]=None, directory:Optional[str]=None):
+		self.db_path = os.path.abspath(os.path.expanduser(db_path))
+		self.snapshot_paths = list(snapshot_paths) if snapshot_paths else []
+		self.directory = _index_directory(directory)
+		os.makedirs(self.directory, exist_ok=True)
+		self.index_path = os.path.join(self.directory, f"{RunCache._db_key(self.db_path)}.sqlite")
+		self._conn = sqlite3.connect(self.index_path)
+		self._conn.executescript(_schema)
+		if self._info('snapshot_paths') != json.dumps(self.snapshot_paths):
+			## Indexed with other snapshot paths, all runs are read again
+			self.clear()
+
+	def __repr__(self):
+		return f"RunIndex(db_path={self.db_path}, runs={len(self)})"
+
+	def __len__(self)->int:
+		return self._conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+	def _info(self, key:str)->Optional[str]:
+		row = self._conn.execute("SELECT value FROM info WHERE key = ?", (key,)).fetchone()
+		return row[0] if row else None
+
+	def clear(self)->None:
+		"""Remove all runs from the index"""
+		with self._conn:
+			self._conn.execute("DELETE FROM runs")
+			self._conn.execute("DELETE FROM parameters")
+			self._conn.execute("INSERT OR REPLACE INTO info VALUES ('snapshot_paths', ?)", (json.dumps(self.snapshot_paths),))
+
+	def _snapshot_values(self, snapshot:Optional[str])->Optional[str]:
+		if not self.snapshot_paths or not snapshot:
+			return None
+		index = SnapshotIndex(json.loads(snapshot))
+		return json.dumps({path: index.get(path) for path in self.snapshot_paths})
+
+	def update(self)->int:
+		"""
+			Index the runs added to the database since the previous update
+			Returns:
+				int: the number of (re)indexed runs
+		"""
+		source = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+		try:
+			## A replaced database, e.g. a new file at the same path, is indexed from scratch
+			last = self._conn.execute("SELECT run_id, guid FROM runs ORDER BY run_id DESC LIMIT 1").fetchone()
+			if last is not None:
+				row = source.execute("SELECT guid FROM runs WHERE run_id = ?", (last[0],)).fetchone()
+				if row is None or row[0] != last[1]:
+					self.clear()
+					last = None
+			last_run_id = last[0] if last is not None else 0
+			pending = [row[0] for row in self._conn.execute("SELECT run_id FROM runs WHERE is_completed = 0")]
+
+			snapshot_column = 'runs.snapshot' if self.snapshot_paths else 'NULL'
+			rows = source.execute(f"""
+				SELECT runs.run_id, runs.guid, runs.name, experiments.name, experiments.sample_name, runs.run_timestamp,
+					runs.completed_timestamp, runs.is_completed, runs.run_description, {snapshot_column}
+				FROM runs LEFT JOIN experiments ON runs.exp_id = experiments.exp_id
+				WHERE runs.run_id > ? OR runs.run_id IN ({','.join('?'*len(pending))})
+			""", (last_run_id, *pending)).fetchall()
+		finally:
+			source.close()
+
+		run_rows = []
+		parameter_rows = []
+		for run_id,guid,name,exp_name,sample_name,run_timestamp,completed_timestamp,is_completed,run_description,snapshot in rows:
+			description = _parse_description(run_description)
+			run_rows.append((run_id, guid, name, exp_name, sample_name, run_timestamp, completed_timestamp, int(bool(is_completed)),
+				description['ndim'], json.dumps(description['shapes']), self._snapshot_values(snapshot)))
+			parameter_rows += [(run_id, parameter, 'dependent') for parameter in description['dependent']]
+			parameter_rows += [(run_id, parameter, 'independent') for parameter in description['independent']]
+		with self._conn:
+			self._conn.executemany("DELETE FROM parameters WHERE run_id = ?", [(row[0],) for row in run_rows])
+			self._conn.executemany("INSERT OR REPLACE INTO runs VALUES (?,?,?,?,?,?,?,?,?,?,?)", run_rows)
+			self._conn.executemany("INSERT INTO parameters VALUES (?,?,?)", parameter_rows)
+		return len(run_rows)
+
+	def query(self, dependent:Union[None,str,List[str]]=None, independent:Union[None,str,List[str]]=None,
+			exp_name:Optional[str]=None, sample_name:Optional[str]=None, name:Optional[str]=None,
+			since=None, until=None, ndim:Optional[int]=None, completed:Optional[bool]=None,
+			snapshot:Optional[Dict[str,Union[Any,Callable]]]=None, update:bool=True)->List[int]:
+		"""
+			Find the runs matching all given conditions, e.g. all 2D runs of I_lockin against V_gate
+			of the last week: query(dependent='I_lockin', independent='V_gate', ndim=2, since=timedelta(days=7))
+			Args:
+				dependent (str or list of str): optional, parameters that are all measured
+				independent (str or list of str): optional, parameters that are all swept
+				exp_name, sample_name, name (str): optional, names to match, with shell-style wildcards
+				since, until: optional, range of the start time of the runs, as unix timestamp,
+					ISO string, datetime, or a timedelta before now
+				ndim (int): optional, number of independent parameters of the measured data
+				completed (bool): optional, only completed or only running runs
+				snapshot (dict): optional, values of indexed snapshot paths, or functions
+					that take the value and return True for matching runs
+				update (bool): index new runs first
+			Returns:
+				list of int: the ids of the matching runs, in increasing order
+		"""
+		if update:
+			self.update()
+		conditions = []
+		values = []
+		for role,names in (('dependent', _as_list(dependent)), ('independent', _as_list(independent))):
+			for parameter in names:
+				conditions.append("run_id IN (SELECT run_id FROM parameters WHERE name = ? AND role = ?)")
+				values += [parameter, role]
+		for column,pattern in (('exp_name', exp_name), ('sample_name', sample_name), ('name', name)):
+			if pattern is not None:
+				conditions.append(f"{column} GLOB ?")
+				values.append(pattern)
+		if since is not None:
+			conditions.append("run_timestamp >= ?")
+			values.append(_timestamp(since))
+		if until is not None:
+			conditions.append("run_timestamp <= ?")
+			values.append(_timestamp(until))
+		if ndim is not None:
+			conditions.append("ndim = ?")
+			values.append(ndim)
+		if completed is not None:
+			conditions.append("is_completed = ?")
+			values.append(int(completed))
+		where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+		rows = self._conn.execute(f"SELECT run_id, snapshot_values FROM runs {where} ORDER BY run_id", values).fetchall()
+		if not snapshot:
+			return [row[0] for row in rows]
+
+		missing = [path for path in snapshot if path not in self.snapshot_paths]
+		if missing:
+			raise KeyError(f"Snapshot paths {missing} are not indexed, add them to the snapshot_paths of the index")
+		run_ids = []
+		for run_id,snapshot_values in rows:
+			indexed = json.loads(snapshot_values) if snapshot_values else {}
+			if all(condition(indexed.get(path)) if callable(condition) else indexed.get(path) == condition
+					for path,condition in snapshot.items()):
+				run_ids.append(run_id)
+		return run_ids
+
+	def to_dataframe(self, run_ids:Optional[List[int]]=None, update:bool=True)->pd.DataFrame:
+		"""
+			The indexed metadata as a table, one row per run
+			Args:
+				run_ids (list of int): optional, only these runs
+		"""
+		if update:
+			self.update()
+		table = pd.read_sql_query("SELECT * FROM runs ORDER BY run_id", self._conn, index_col='run_id')
+		parameters = pd.read_sql_query("SELECT * FROM parameters", self._conn)
+		for role in ('dependent', 'independent'):
+			names = parameters[parameters['role'] == role].groupby('run_id')['name'].agg(list)
+			table[role] = [names.get(run_id, []) for run_id in table.index]
+		for column in ('shapes', 'snapshot_values'):
+			table[column] = [json.loads(value) if value else None for value in table[column]]
+		table['is_completed'] = table['is_completed'].astype(bool)
+		if run_ids is not None:
+			table = table.loc[[run_id for run_id in run_ids if run_id in table.index]]
+		return table
+
+	def close(self)->None:
+		self._conn.close()
+
+## The index of every database, shared by all DataOutput objects
+_run_indices = {}
+
+def run_index(db_path:str, snapshot_paths:Optional[List[str]]=None)->RunIndex:
+	"""
+		Obtain the shared index of a database
+		Args:
+			db_path (str): path to the QCoDeS database
+			snapshot_paths (list of str): optional, snapshot paths to index, by default those already indexed
+	"""
+	db_path = os.path.abspath(os.path.expanduser(db_path))
+	index = _run_indices.get(db_path)
+	if index is None or (snapshot_paths is not None and list(snapshot_paths) != index.snapshot_paths):
+		if snapshot_paths is None and index is None:
+			## Keep the snapshot paths of an existing index file
+			snapshot_paths = _stored_snapshot_paths(db_path)
+		if index is not None:
+			index.close()
+		index = RunIndex(db_path, snapshot_paths=snapshot_paths)
+		_run_indices[db_path] = index
+	return index
+
+def _index_directory(directory:Optional[str]=None)->str:
+	## The directory holding the index files, shared by all processes of the user
+	return directory if directory is not None else get_cache_path('run_index')
+
+def _stored_snapshot_paths(db_path:str)->List[str]:
+	index_path = os.path.join(_index_directory(), f"{RunCache._db_key(db_path)}.sqlite")
+	if not os.path.exists(index_path):
+		return []
+	conn = sqlite3.connect(index_path)
+	try:
+		row = conn.execute("SELECT value FROM info WHERE key = 'snapshot_paths'").fetchone()
+	except sqlite3.OperationalError:
+		row = None
+	finally:
+		conn.close()
+	return json.loads(row[0]) if row else []
@@ -0,0 +1,142 @@
+import json, fnmatch
+from collections import OrderedDict
+from typing import List, Optional, Any
+
+import numpy as np
+import xarray as xr
+
+def _flatten(tree:dict)->dict:
+	## All leaves of a nested dict by their dotted path, e.g. 'station.instruments.dac.parameters.ch01.value'
+	flat = {}
+	stack = [('', tree)]
+	while stack:
+		prefix, node = stack.pop()
+		for key,value in node.items():
+			path = f'{prefix}{key}'
+			if isinstance(value, dict) and value:
+				stack.append((f'{path}.', value))
+			else:
+				flat[path] = value
+	return flat
+
+class SnapshotIndex():
+	"""
+		The parsed QCoDeS snapshot of a run, with values indexed by their dotted path
+		Every path is resolved in the tree once, later lookups are a single dict lookup.
+		The index of all values is only built when listing paths, since flattening
+		a large snapshot takes as long as parsing it
+		Args:
+			tree (dict): the parsed snapshot
+	"""
+	_missing = object()
+
+	def __init__(self, tree:dict):
+		self.tree = tree
+		self._resolved = {}
+		self._flat = None
+
+	def __repr__(self):
+		return f"SnapshotIndex({len(self._resolved)} resolved paths)"
+
+	@property
+	def flat(self)->dict:
+		"""All leaves of the snapshot by their dotted path"""
+		if self._flat is None:
+			self._flat = _flatten(self.tree)
+		return self._flat
+
+	def __contains__(self, path:str)->bool:
+		return self.get(path, self._missing) is not self._missing
+
+	def get(self, path:str, default:Any=None)->Any:
+		"""
+			Look up a value, e.g. 'station.instruments.dac.parameters.ch01.value'
+			Paths ending at a branch of the snapshot return the branch as dict
+		"""
+		if path in self._resolved:
+			value = self._resolved[path]
+		else:
+			value = self.tree
+			for key in path.split('.'):
+				if not isinstance(value, dict) or key not in value:
+					value = self._missing
+					break
+				value = value[key]
+			self._resolved[path] = value
+		return default if value is self._missing else value
+
+	def paths(self, pattern:str='*')->List[str]:
+		"""
+			The paths of all values matching a shell-style pattern,
+			e.g. 'station.instruments.dac.parameters.*.value'
+		"""
+		return sorted(fnmatch.filter(self.flat, pattern))
+
+class SnapshotCache():
+	"""
+		In-memory LRU cache of parsed snapshots, so the JSON of a run is only parsed once
+		Snapshots are keyed by the GUID of their run, or by the snapshot itself for datasets without one.
+		The cached snapshots are shared, they should not be modified
+	"""
+	def __init__(self, max_entries:int=1024, enabled:bool=True):
+		self.max_entries = max_entries
+		self.enabled = enabled
+		self._indices = OrderedDict()
+
+	def __repr__(self):
+		return f"SnapshotCache(entries={len(self._indices)}, max={self.max_entries})"
+
+	@staticmethod
+	def _key(dataset:xr.Dataset)->Optional[str]:
+		snapshot = dataset.attrs.get('snapshot')
+		if snapshot is None:
+			return None
+		return dataset.attrs.get('guid') or snapshot
+
+	def index(self, dataset:xr.Dataset)->Optional[SnapshotIndex]:
+		"""
+			Obtain the parsed snapshot of a dataset
+			Returns:
+				SnapshotIndex: the indexed snapshot, None if the dataset has no snapshot
+		"""
+		key = self._key(dataset)
+		if key is None:
+			return None
+		index = self._indices.get(key) if self.enabled else None
+		if index is not None:
+			self._indices.move_to_end(key)
+			return index
+		snapshot = dataset.attrs['snapshot']
+		index = SnapshotIndex(json.loads(snapshot) if isinstance(snapshot, str) else snapshot)
+		if self.enabled:
+			self._indices[key] = index
+			while len(self._indices) > self.max_entries:
+				self._indices.popitem(last=False)
+		return index
+
+	def clear(self)->None:
+		"""Remove all parsed snapshots"""
+		self._indices.clear()
+
+snapshot_cache = SnapshotCache() ## Parsed snapshots of the datasets of all DataOutput objects
+
+def snapshot_values(datasets:List[xr.Dataset], path:str, default:Any=np.nan)->np.ndarray:
+	"""
+		Look up a snapshot value in every dataset
+		Args:
+			datasets (list of xr.Dataset): the datasets to read
+			path (str): dotted path of the value, e.g. 'station.instruments.dac.parameters.ch01.value'
+			default: value for datasets without a snapshot or without the path
+		Returns:
+			np.ndarray: one value per dataset, as float if all values are numeric (None becomes NaN),
+				otherwise as objects
+	"""
+	values = []
+	for dataset in datasets:
+		index = snapshot_cache.index(dataset)
+		values.append(index.get(path, default) if index is not None else default)
+	if all(value is None or isinstance(value, (int, float, np.number)) for value in values):
+		return np.array(values, dtype=float)
+	array = np.empty(len(values), dtype=object)
+	array[:] = values
+	return array
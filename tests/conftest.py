@@ -0,0 +1,73 @@
+import os, sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import matplotlib
+matplotlib.use('Agg')
+
+root_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_directory)
+
+import qcodes as qc
+from qcodes.parameters import ManualParameter
+from qcodes.dataset import Measurement, load_or_create_experiment, initialise_or_create_database_at
+
+from output_dataset import DataOutput as qp
+
+def write_run(experiment, setpoints:dict, values:dict)->int:
+	"""
+		Write a completed run with the given setpoints and data variables to the current database
+		Args:
+			setpoints (dict): 1D arrays by name, the grid of the run
+			values (dict): arrays with the shape of the grid, by name
+		Returns:
+			int: the run_id
+	"""
+	independent = [ManualParameter(name) for name in setpoints]
+	dependent = [ManualParameter(name) for name in values]
+	measurement = Measurement(exp=experiment)
+	for parameter in independent:
+		measurement.register_parameter(parameter)
+	for parameter in dependent:
+		measurement.register_parameter(parameter, setpoints=independent)
+	grid = [axis.ravel() for axis in np.meshgrid(*setpoints.values(), indexing='ij')]
+	flat_values = [np.asarray(value).ravel() for value in values.values()]
+	with measurement.run(write_in_background=False) as datasaver:
+		for idx in range(grid[0].size):
+			datasaver.add_result(*[(parameter, axis[idx]) for parameter,axis in zip(independent,grid)],
+				*[(parameter, value[idx]) for parameter,value in zip(dependent,flat_values)])
+	return datasaver.run_id
+
+@pytest.fixture(scope='session')
+def database(tmp_path_factory):
+	"""
+		A QCoDeS database with three 1D runs (I_lockin vs V_gate) followed by two 2D runs
+		(I_lockin and G vs V_gate and V_bias), made the current database
+	"""
+	db_path = str(tmp_path_factory.mktemp('database') / 'test.db')
+	initialise_or_create_database_at(db_path)
+	experiment = load_or_create_experiment('test', sample_name='sample')
+	gate = np.linspace(-1, 1, 21)
+	bias = np.linspace(-0.5, 0.5, 11)
+	runs_1d = [write_run(experiment, {'V_gate': gate}, {'I_lockin': np.sin(gate*(idx+1))}) for idx in range(3)]
+	grid_gate, grid_bias = np.meshgrid(gate, bias, indexing='ij')
+	runs_2d = [write_run(experiment, {'V_gate': gate, 'V_bias': bias},
+		{'I_lockin': grid_gate*grid_bias + idx, 'G': grid_gate - grid_bias}) for idx in range(2)]
+	return SimpleNamespace(path=db_path, experiment=experiment, runs_1d=runs_1d, runs_2d=runs_2d)
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, database):
+	"""
+		Every test uses the test database, and a parameter file and run cache of its own,
+		so the files of the package are never written
+	"""
+	initialise_or_create_database_at(database.path)
+	qp.Parameter._instances = {}
+	qp.Parameter.use_store(qp.JSONParameterStore(str(tmp_path / 'verbose_params.json')))
+	run_cache_settings = (qp.run_cache.directory, qp.run_cache.min_bytes, qp.run_cache.enabled)
+	qp.run_cache.directory = str(tmp_path / 'run_cache')
+	qp.DataOutput.memo.clear()
+	yield
+	qp.run_cache.directory, qp.run_cache.min_bytes, qp.run_cache.enabled = run_cache_settings
+	qp.DataOutput.memo.clear()
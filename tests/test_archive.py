@@ -0,0 +1,103 @@
+import numpy as np
+import xarray as xr
+import pytest
+
+from conftest import qp
+
+def mixed_dataset()->xr.Dataset:
+	## Variables along different dimensions, written to separate Parquet tables
+	rng = np.random.default_rng(5)
+	return xr.Dataset({'map': (('x', 'y'), rng.normal(size=(4, 3)), {'units': 'A'}), 'trace': (('x',), rng.normal(size=4))},
+		coords={'x': np.linspace(0, 1, 4), 'y': np.arange(3)}, attrs={'name': 'mixed'})
+
+@pytest.fixture
+def scaled_output(database):
+	qp.Parameter('I_lockin', verbose_name='Current', unit='nA', scale=1e9)
+	return qp.DataOutput(database.runs_1d + database.runs_2d)
+
+def assert_round_trip(opened:list, written:list)->None:
+	assert len(opened) == len(written)
+	for dataset,expected in zip(opened, written):
+		dataset = dataset.load()
+		xr.testing.assert_allclose(dataset, expected[list(dataset.data_vars)])
+		assert dataset.attrs['run_id'] == expected.attrs['run_id']
+		for key in dataset.variables:
+			assert dataset[key].attrs['long_name'] == expected[key].attrs['long_name']
+
+def test_parquet_round_trip(scaled_output, tmp_path):
+	path = str(tmp_path / 'archive')
+	names = scaled_output.to_parquet(path, workers=2)
+	assert names == [f'run_{dataset.attrs["run_id"]}' for dataset in scaled_output.datasets]
+	opened = qp.DataOutput.open(path)
+	assert_round_trip(opened.datasets, scaled_output.datasets)
+	## The applied Parameter settings are kept with the data
+	attrs = opened.datasets[0]['I_lockin'].attrs
+	assert (attrs['units'], attrs['parameter_scale'], attrs['parameter_offset']) == ('nA', 1e9, 0)
+
+def test_parquet_selection(scaled_output, database, tmp_path):
+	path = str(tmp_path / 'archive')
+	scaled_output.to_parquet(path)
+	## In the requested order, only the requested variables are read
+	run_ids = [database.runs_2d[1], database.runs_2d[0]]
+	opened = qp.DataOutput.open(path, runs=run_ids, data_keys=['G'])
+	assert [dataset.attrs['run_id'] for dataset in opened.datasets] == run_ids
+	assert all(list(dataset.data_vars) == ['G'] for dataset in opened.datasets)
+	with pytest.raises(KeyError):
+		qp.DataOutput.open(path, runs=[9999])
+
+def test_parquet_variables_along_different_dimensions(tmp_path):
+	path = str(tmp_path / 'archive')
+	dataset = mixed_dataset()
+	assert qp.DataOutput(dataset, reformat=False).to_parquet(path) == ['dataset_0']
+	opened = qp.DataOutput.open(path).datasets[0]
+	xr.testing.assert_allclose(opened, dataset)
+	assert list(opened.data_vars) == ['map', 'trace']
+	assert opened.attrs == dataset.attrs and opened['map'].attrs == dataset['map'].attrs
+	xr.testing.assert_allclose(qp.DataOutput.open(path, data_keys=['trace']).datasets[0], dataset[['trace']])
+
+def test_zarr_round_trip(scaled_output, tmp_path):
+	pytest.importorskip('zarr')
+	store = str(tmp_path / 'archive.zarr')
+	scaled_output.to_zarr(store, workers=2)
+	opened = qp.DataOutput.open(store)
+	## The store is read lazily
+	assert all(dataset[key].chunks is not None for dataset in opened.datasets for key in dataset.data_vars)
+	assert_round_trip(opened.datasets, scaled_output.datasets)
+	subset = qp.DataOutput.open(store, runs=[scaled_output.datasets[-1].attrs['run_id']], data_keys=['G'])
+	assert list(subset.datasets[0].data_vars) == ['G']
+
+@pytest.mark.parametrize('reformat,deferred_scaling', [(False, False), (True, True)])
+def test_parameter_attrs_only_for_applied_scaling(database, tmp_path, reformat, deferred_scaling):
+	qp.Parameter('I_lockin', unit='nA', scale=1e9)
+	data_output = qp.DataOutput(database.runs_1d[0], reformat=reformat, deferred_scaling=deferred_scaling)
+	path = str(tmp_path / 'archive')
+	data_output.to_parquet(path)
+	opened = qp.DataOutput.open(path).datasets[0]
+	## Deferred scaling is applied when writing, data that was never reformatted is written as it is
+	scale = 1e9 if reformat else 1
+	np.testing.assert_allclose(opened['I_lockin'].values, qp.DataOutput(database.runs_1d[0], reformat=False).datasets[0]['I_lockin'].values*scale)
+	assert ('parameter_scale' in opened['I_lockin'].attrs) == reformat
+	if reformat:
+		assert (opened['I_lockin'].attrs['parameter_scale'], opened['I_lockin'].attrs['parameter_offset']) == (1e9, 0)
+
+def test_zarr_groups_written_in_parallel(tmp_path):
+	pytest.importorskip('zarr')
+	datasets = [mixed_dataset().assign_attrs(run_id=run_id) for run_id in range(12)]
+	store = str(tmp_path / 'archive.zarr')
+	names = qp.DataOutput(datasets, reformat=False).to_zarr(store, workers=4)
+	## All groups are listed in the consolidated metadata of the store
+	assert names == [f'run_{run_id}' for run_id in range(12)]
+	opened = qp.DataOutput.open(store)
+	for dataset,expected in zip(opened.datasets, datasets):
+		xr.testing.assert_allclose(dataset.load(), expected)
+
+def test_missing_optional_dependency_is_reported(tmp_path, monkeypatch):
+	import importlib
+	import_module = importlib.import_module
+	def without_zarr(name, *args, **kwargs):
+		if name == 'zarr':
+			raise ImportError(name)
+		return import_module(name, *args, **kwargs)
+	monkeypatch.setattr(importlib, 'import_module', without_zarr)
+	with pytest.raises(ImportError, match='pip install zarr'):
+		qp.DataOutput(mixed_dataset(), reformat=False).to_zarr(str(tmp_path / 'archive.zarr'))
@@ -0,0 +1,79 @@
+import os, sys, stat
+
+import numpy as np
+import xarray as xr
+import pytest
+
+from conftest import qp
+
+def _cached_files():
+	return qp.run_cache._files()
+
+def test_small_runs_are_not_cached(database):
+	qp.DataOutput(database.runs_1d, reformat=False)
+	assert _cached_files() == []
+
+def test_round_trip(database):
+	qp.run_cache.min_bytes = 0
+	original = qp.DataOutput(database.runs_2d[0], reformat=False).datasets[0]
+	assert len(_cached_files()) == 1
+	cached = qp.load_qcodes_as_xarray(database.runs_2d[0])
+	xr.testing.assert_identical(cached, original)
+	assert cached.attrs['run_description'] == original.attrs['run_description']
+
+def test_large_runs_are_cached(tmp_path):
+	dataset = xr.Dataset({'I_lockin': (('V_gate',), np.random.rand(10**5))}, coords={'V_gate': np.arange(10**5)})
+	cache = qp.RunCache(directory=str(tmp_path))
+	cache.store('test.db', 'guid', 1, dataset)
+	xr.testing.assert_equal(cache.load('test.db', 'guid', 1), dataset)
+
+def test_cache_files_get_the_default_mode(tmp_path):
+	dataset = xr.Dataset({'I_lockin': (('V_gate',), np.random.rand(10**5))}, coords={'V_gate': np.arange(10**5)})
+	cache = qp.RunCache(directory=str(tmp_path))
+	umask = os.umask(0o022)
+	try:
+		cache.store('test.db', 'guid', 1, dataset)
+	finally:
+		os.umask(umask)
+	assert stat.S_IMODE(os.stat(cache.file_path('test.db', 'guid', 1)).st_mode) == 0o644
+
+@pytest.mark.parametrize('content', [b'', b'not a netcdf file'*100])
+def test_corrupt_file_is_removed(tmp_path, content):
+	cache = qp.RunCache(directory=str(tmp_path))
+	file_path = cache.file_path('test.db', 'guid', 1)
+	with open(file_path, 'wb') as file:
+		file.write(content)
+	with pytest.warns(UserWarning, match='Removing unreadable cache file'):
+		assert cache.load('test.db', 'guid', 1) is None
+	assert not os.path.exists(file_path)
+
+def test_other_errors_keep_the_file(tmp_path, monkeypatch):
+	## e.g. an import failing while reading says nothing about the file
+	dataset = xr.Dataset({'I_lockin': (('V_gate',), np.random.rand(10**5))})
+	cache = qp.RunCache(directory=str(tmp_path))
+	cache.store('test.db', 'guid', 1, dataset)
+	def failing_load(*args, **kwargs):
+		raise ImportError('partially initialized module')
+	monkeypatch.setattr(xr, 'load_dataset', failing_load)
+	with pytest.raises(ImportError):
+		cache.load('test.db', 'guid', 1)
+	assert os.path.exists(cache.file_path('test.db', 'guid', 1))
+
+def test_threaded_cached_load_keeps_warnings(database):
+	## Writing the cache in the loader threads must not change the warning filters of the caller
+	qp.run_cache.min_bytes = 0
+	with pytest.warns(UserWarning, match='run 9999'):
+		qp.DataOutput(database.runs_1d + [9999], workers=2, reformat=False)
+
+@pytest.mark.parametrize('with_platformdirs', [True, False])
+def test_default_directory_is_in_the_user_cache(tmp_path, monkeypatch, with_platformdirs):
+	monkeypatch.setenv('HOME', str(tmp_path))
+	monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / '.cache'))
+	if not with_platformdirs:
+		monkeypatch.setitem(sys.modules, 'platformdirs', None)
+	elif not sys.platform.startswith('linux'):
+		pytest.skip('platformdirs follows XDG_CACHE_HOME on Linux only')
+	cache = qp.RunCache()
+	assert cache.directory == str(tmp_path / '.cache' / 'output_dataset' / 'run_cache')
+	package_directory = os.path.dirname(os.path.abspath(qp.__file__))
+	assert not cache.directory.startswith(package_directory)
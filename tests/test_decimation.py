@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+import matplotlib.pyplot as plt
+
+from conftest import qp
+from _decimation import decimate_map, minmax_decimate, lttb_decimate, DecimatedLine
+
+def test_small_maps_are_unchanged():
+	values = np.arange(12.).reshape(3, 4)
+	y, x = np.arange(3.), np.arange(4.)
+	decimated = decimate_map(values, y, x, (10, 10))
+	assert all(result is original for result,original in zip(decimated, (values, y, x)))
+
+@pytest.mark.parametrize('size,shape', [((1000, 800), (100, 120)), ((997, 803), (101, 77)), ((50, 3000), (200, 150))])
+def test_decimated_map_fits_the_shape(size, shape):
+	values = np.random.default_rng(0).normal(size=size)
+	decimated, y, x = decimate_map(values, np.linspace(0, 1, size[0]), np.linspace(-1, 1, size[1]), shape)
+	assert decimated.shape[0] <= shape[0] and decimated.shape[1] <= shape[1]
+	assert decimated.shape == (y.size, x.size)
+	assert np.all(np.diff(y) > 0) and np.all(np.diff(x) > 0)
+
+def test_block_with_both_extremes_keeps_both():
+	values = np.random.default_rng(1).uniform(-1, 1, size=(200, 200))
+	## The minimum and maximum of the map in a single block, the maximum left of the minimum
+	values[42, 10] = 5
+	values[43, 11] = -7
+	decimated, y, x = decimate_map(values, np.arange(200.), np.arange(200.), (20, 20))
+	assert decimated.max() == 5 and decimated.min() == -7
+	row, column = np.unravel_index(np.argmax(decimated), decimated.shape)
+	assert decimated[row, column + 1] == -7
+	## The pair is drawn around the coordinates of the block
+	np.testing.assert_allclose(x[column:column+2], [4.5, 14.5])
+	assert y[row] == pytest.approx(44.5)
+
+def test_narrow_features_stay_visible():
+	values = np.zeros((300, 300))
+	values[100, :] = 1
+	values[:, 200] = -1
+	decimated, y, x = decimate_map(values, np.arange(300.), np.arange(300.), (30, 30))
+	assert np.any(decimated == 1, axis=1).sum() == 1
+	assert np.all(np.any(decimated == -1, axis=1))
+
+def test_blocks_without_data_are_nan():
+	values = np.random.default_rng(2).normal(size=(100, 100))
+	values[:10, :20] = np.nan
+	values[50, 50] = np.nan
+	decimated, y, x = decimate_map(values, np.arange(100.), np.arange(100.), (10, 10))
+	assert np.all(np.isnan(decimated[0, :2]))
+	assert np.isnan(decimated).sum() == 2
+	assert np.nanmax(decimated) == np.nanmax(values) and np.nanmin(decimated) == np.nanmin(values)
+
+def noisy_line(n_points:int=100_000, seed:int=3)->tuple:
+	rng = np.random.default_rng(seed)
+	x = np.linspace(0, 10, n_points)
+	return x, np.sin(x) + rng.normal(scale=0.1, size=n_points)
+
+def test_minmax_keeps_the_extremes_of_every_bin():
+	x, y = noisy_line()
+	y[12345], y[67890] = 10, -10
+	x_decimated, y_decimated = minmax_decimate(x, y, 500)
+	assert y_decimated.size <= 1000
+	assert y_decimated.max() == 10 and y_decimated.min() == -10
+	assert np.all(np.diff(x_decimated) >= 0)
+	factor = int(np.ceil(y.size/500))
+	for block,(low,high) in enumerate(zip(y_decimated[::2], y_decimated[1::2])):
+		values = y[block*factor:(block + 1)*factor]
+		assert sorted([low, high]) == [values.min(), values.max()]
+
+def test_minmax_leaves_gaps_for_bins_without_data():
+	x, y = noisy_line(10_000)
+	y[2000:3000] = np.nan
+	y[5000] = np.nan
+	x_decimated, y_decimated = minmax_decimate(x, y, 100)
+	gaps = np.isnan(y_decimated)
+	assert gaps.any()
+	assert np.all((x_decimated[gaps] >= x[2000]) & (x_decimated[gaps] <= x[2999]))
+	assert np.nanmax(y_decimated) == np.nanmax(y) and np.nanmin(y_decimated) == np.nanmin(y)
+
+def test_lttb_keeps_the_ends_and_peaks():
+	x, y = noisy_line()
+	y[54321] = 10
+	x_decimated, y_decimated = lttb_decimate(x, y, 1000)
+	assert y_decimated.size == 1000
+	assert (x_decimated[0], x_decimated[-1]) == (x[0], x[-1])
+	assert np.all(np.diff(x_decimated) > 0)
+	assert 10 in y_decimated
+
+def test_lttb_skips_nan():
+	x, y = noisy_line(10_000)
+	## The first and last point are always kept, and are measured here
+	y[2::7] = np.nan
+	x_decimated, y_decimated = lttb_decimate(x, y, 200)
+	assert not np.isnan(y_decimated).any()
+
+@pytest.fixture
+def axis():
+	figure, axis = plt.subplots()
+	yield axis
+	plt.close(figure)
+
+def test_decimated_line_with_descending_x(axis):
+	x, y = noisy_line()
+	line, = axis.plot([], [])
+	decimated = DecimatedLine(line, x[::-1], y[::-1])
+	assert decimated.sorted
+	drawn_x, drawn_y = line.get_data()
+	assert drawn_x.size <= decimated.n_points()
+	assert np.all(np.diff(drawn_x) >= 0)
+	assert drawn_y.max() == y.max() and drawn_y.min() == y.min()
+	## The bins at both ends are drawn
+	np.testing.assert_allclose(axis.dataLim.intervalx, [0, 10], atol=0.01)
+
+def test_decimated_line_follows_the_x_limits(axis):
+	x, y = noisy_line()
+	line, = axis.plot([], [])
+	DecimatedLine(line, x, y)
+	spacing = np.median(np.diff(line.get_xdata()))
+	axis.set_xlim(4, 5)
+	drawn_x = line.get_xdata()
+	## The visible range is decimated again, with one point beyond the edges of the axis
+	visible = (x >= 4) & (x <= 5)
+	outside = np.flatnonzero(visible)[[0, -1]] + [-1, 1]
+	assert x[outside[0]] <= drawn_x.min() < 4.01 and 4.99 < drawn_x.max() <= x[outside[1]]
+	assert np.median(np.diff(drawn_x)) < spacing/5
+	assert line.get_ydata().max() >= y[visible].max()
@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import xarray as xr
+import matplotlib.image
+import pytest
+
+from conftest import qp
+import _decimation
+
+def map_dataset(run_id:int, size:int=1000)->xr.Dataset:
+	values = np.random.default_rng(run_id).normal(size=(size, size))
+	return xr.Dataset({'signal': (('y', 'x'), values)},
+		coords={'y': np.arange(size, dtype=float), 'x': np.arange(size, dtype=float)}, attrs={'run_id': run_id})
+
+@pytest.fixture
+def decimated_shapes(monkeypatch):
+	## The shapes maps are decimated to while rendering
+	shapes = []
+	decimate = _decimation.DecimatedMap.decimate
+	def recording_decimate(self, renderer=None):
+		decimate(self, renderer)
+		shapes.append(self.shape)
+	monkeypatch.setattr(_decimation.DecimatedMap, 'decimate', recording_decimate)
+	return shapes
+
+def test_export_writes_a_file_per_figure(tmp_path):
+	data_output = qp.DataOutput([map_dataset(1, 50), map_dataset(2, 50)], reformat=False)
+	timings = data_output.export_figures(str(tmp_path), workers=1, progress=False)
+	## A single variable per dataset gives one figure for all datasets
+	assert list(timings) == [str(tmp_path / 'figure_0.png')]
+	data_output = qp.DataOutput(map_dataset(3, 50).assign(other=lambda ds: -ds.signal), reformat=False)
+	timings = data_output.export_figures(str(tmp_path), fmt='pdf', workers=1, progress=False)
+	assert list(timings) == [str(tmp_path / 'run_3.pdf')]
+	assert all(os.path.getsize(file_path) > 0 for file_path in timings)
+
+def test_export_dpi(tmp_path, decimated_shapes):
+	data_output = qp.DataOutput(map_dataset(1), reformat=False)
+	sizes = {}
+	shapes = {}
+	for dpi in (50, 150):
+		file_path, = data_output.export_figures(str(tmp_path / str(dpi)), workers=1, dpi=dpi, progress=False)
+		sizes[dpi] = matplotlib.image.imread(file_path).shape[:2]
+		shapes[dpi] = decimated_shapes[-1]
+	assert sizes[150][0] == pytest.approx(3*sizes[50][0], abs=3)
+	assert sizes[150][1] == pytest.approx(3*sizes[50][1], abs=3)
+	## The map is decimated for the resolution of the file, not the figure dpi
+	assert shapes[150][0] == pytest.approx(3*shapes[50][0], abs=3)
+	assert shapes[150][1] == pytest.approx(3*shapes[50][1], abs=3)
+
+def test_export_in_processes(tmp_path):
+	data_output = qp.DataOutput([map_dataset(1, 50).assign(other=lambda ds: -ds.signal),
+		map_dataset(2, 50).assign(other=lambda ds: -ds.signal)], reformat=False)
+	timings = data_output.export_figures(str(tmp_path), workers=2, dpi=50, progress=False)
+	assert sorted(timings) == [str(tmp_path / 'run_1.png'), str(tmp_path / 'run_2.png')]
+	assert all(matplotlib.image.imread(file_path).size for file_path in timings)
@@ -0,0 +1,72 @@
+import numpy as np
+import xarray as xr
+import pytest
+from scipy.optimize import curve_fit
+
+from conftest import qp
+from _fitting import fit_along
+
+def lorentzian(x, centre, width, height):
+	return height/(1 + ((x - centre)/width)**2)
+
+def resonance(n_gate:int=40, noise:float=0.01)->xr.DataArray:
+	## A resonance moving slowly with the gate voltage
+	rng = np.random.default_rng(0)
+	gate = np.linspace(0, 1, n_gate)
+	bias = np.linspace(-1, 1, 101)
+	centres = 0.5*gate - 0.25
+	values = lorentzian(bias[None,:], centres[:,None], 0.1, 2) + noise*rng.normal(size=(n_gate, bias.size))
+	return xr.DataArray(values, dims=('V_gate', 'V_bias'), coords={'V_gate': gate, 'V_bias': bias}, name='I_lockin')
+
+def test_fit_along_matches_curve_fit():
+	data_array = resonance()
+	result = fit_along(data_array, lorentzian, 'V_bias', p0=[-0.25, 0.1, 1], workers=1)
+	assert result['popt'].dims == ('V_gate', 'parameter')
+	assert list(result['parameter'].values) == ['centre', 'width', 'height']
+	assert bool(result['success'].all())
+	np.testing.assert_allclose(result['popt'].sel(parameter='centre'), 0.5*data_array['V_gate'] - 0.25, atol=2e-3)
+	for idx in (0, 17, 39):
+		popt, pcov = curve_fit(lorentzian, data_array['V_bias'].values, data_array[idx].values, p0=result['popt'][idx].values)
+		np.testing.assert_allclose(result['popt'][idx], popt, rtol=1e-5)
+		np.testing.assert_allclose(result['perr'][idx], np.sqrt(np.diag(pcov)), rtol=1e-3)
+
+def test_fit_along_other_dimension_order():
+	data_array = resonance()
+	result = fit_along(data_array.transpose(), lorentzian, 'V_bias', p0=[-0.25, 0.1, 1], workers=1)
+	xr.testing.assert_allclose(result, fit_along(data_array, lorentzian, 'V_bias', p0=[-0.25, 0.1, 1], workers=1))
+
+def test_parallel_fit_matches_serial_fit():
+	## Enough slices for two workers
+	data_array = resonance(n_gate=40)
+	serial = fit_along(data_array, lorentzian, 'V_bias', p0=[-0.25, 0.1, 1], workers=1)
+	parallel = fit_along(data_array, lambda x, centre, width, height: lorentzian(x, centre, width, height),
+		'V_bias', p0=[-0.25, 0.1, 1], workers=2)
+	np.testing.assert_allclose(parallel['popt'], serial['popt'], rtol=1e-4)
+	assert bool(parallel['success'].all())
+
+def test_slices_without_enough_data_fail():
+	data_array = resonance(n_gate=4)
+	data_array[1] = np.nan
+	data_array[2, 2:] = np.nan
+	result = fit_along(data_array, lorentzian, 'V_bias', p0=[-0.25, 0.1, 1], workers=1)
+	assert list(result['success'].values) == [True, False, False, True]
+	assert np.all(np.isnan(result['popt'][1:3]))
+	## The slice after a failed fit starts from p0 again
+	np.testing.assert_allclose(result['popt'][3, 0], 0.25, atol=5e-3)
+
+def test_fit_along_rejects_invalid_arguments():
+	data_array = resonance(n_gate=2)
+	with pytest.raises(KeyError):
+		fit_along(data_array, lorentzian, 'V_other')
+	with pytest.raises(ValueError):
+		fit_along(data_array, lorentzian, 'V_bias', p0=[1, 1])
+	with pytest.raises(ValueError):
+		fit_along(data_array, lambda x, *params: x, 'V_bias')
+
+def test_data_output_fit(database):
+	## The 2D runs hold V_gate*V_bias + idx, a line along V_bias
+	data_output = qp.DataOutput(database.runs_2d, reformat=False)
+	results = data_output.fit(lambda x, slope, intercept: slope*x + intercept, 'V_bias', data_var='I_lockin', workers=1)
+	for idx,result in enumerate(results):
+		np.testing.assert_allclose(result['popt'].sel(parameter='slope'), result['V_gate'], atol=1e-8)
+		np.testing.assert_allclose(result['popt'].sel(parameter='intercept'), idx, atol=1e-8)
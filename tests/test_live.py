@@ -0,0 +1,142 @@
+import sqlite3, functools
+
+import matplotlib.pyplot as plt
+
+import numpy as np
+import pytest
+from qcodes.parameters import ManualParameter
+from qcodes.dataset import Measurement
+
+from conftest import qp
+
+@pytest.fixture
+def running_measurement(database):
+	"""
+		A run of 9 points that is still being measured, a function adding rows to it, and one completing it
+		Runs with a predefined shape are cached by QCoDeS in arrays that the converted datasets share
+	"""
+	gate = ManualParameter('V_gate')
+	current = ManualParameter('I_lockin')
+	measurement = Measurement(exp=database.experiment)
+	measurement.register_parameter(gate)
+	measurement.register_parameter(current, setpoints=[gate])
+	measurement.set_shapes({'I_lockin': (9,)})
+	runner = measurement.run(write_in_background=False)
+	datasaver = runner.__enter__()
+	def add_rows(values):
+		for value in values:
+			datasaver.add_result((gate, value), (current, value))
+		datasaver.flush_data_to_database(block=True)
+	def complete():
+		if not datasaver.dataset.completed:
+			runner.__exit__(None, None, None)
+	add_rows(range(3))
+	yield datasaver.run_id, add_rows, complete
+	complete()
+
+def test_polls_keep_the_scaling(running_measurement, database):
+	run_id, add_rows, complete = running_measurement
+	qp.Parameter('I_lockin', scale=10)
+	with qp.LiveDataOutput(run_id, db_path=database.path) as live:
+		np.testing.assert_allclose(live.datasets[0]['I_lockin'].values[:3], np.arange(3)*10)
+		for n_rows in (6, 9):
+			add_rows(range(n_rows - 3, n_rows))
+			assert live.poll()
+			np.testing.assert_allclose(live.datasets[0]['I_lockin'].values[:n_rows], np.arange(n_rows)*10)
+		assert not live.poll()
+		np.testing.assert_allclose(live.datasets[0]['I_lockin'].values, np.arange(9)*10)
+
+def test_polls_repeat_processing_on_new_data(running_measurement, database):
+	run_id, add_rows, complete = running_measurement
+	with qp.LiveDataOutput(run_id, reformat=False, db_path=database.path) as live:
+		live.multiply(2)
+		add_rows(range(3, 6))
+		live.poll()
+		np.testing.assert_allclose(live.datasets[0]['I_lockin'].values[:6], np.arange(6)*2)
+
+def test_close_closes_the_connection(running_measurement, database):
+	run_id, add_rows, complete = running_measurement
+	live = qp.LiveDataOutput(run_id, db_path=database.path)
+	live.close()
+	with pytest.raises(sqlite3.ProgrammingError):
+		live.poll()
+	## The data read before closing is kept
+	np.testing.assert_allclose(live.datasets[0]['I_lockin'].values[:3], np.arange(3))
+
+def test_polls_read_only_new_rows(running_measurement, database, monkeypatch):
+	run_id, add_rows, complete = running_measurement
+	starts = []
+	read = qp.get_parameter_data
+	def get_parameter_data(conn, table_name, columns, start=None, end=None):
+		starts.append(start)
+		return read(conn, table_name, columns, start=start, end=end)
+	monkeypatch.setattr(qp, 'get_parameter_data', get_parameter_data)
+	with qp.LiveDataOutput(run_id, db_path=database.path) as live:
+		for rows in (range(3, 5), range(5, 9)):
+			add_rows(rows)
+			live.poll()
+		## Rows are counted from 1
+		assert starts == [4, 6]
+		np.testing.assert_allclose(live.datasets[0]['V_gate'].values, np.arange(9))
+		np.testing.assert_allclose(live.datasets[0]['I_lockin'].values, np.arange(9))
+
+def test_polls_process_only_new_values(running_measurement, database, monkeypatch):
+	run_id, add_rows, complete = running_measurement
+	parameter = qp.Parameter('I_lockin', scale=10)
+	with qp.LiveDataOutput(run_id, db_path=database.path) as live:
+		live.multiply(2)
+		sizes = []
+		multiply = qp._processing.multiply
+		@functools.wraps(multiply)
+		def counting_multiply(data_output, *args, **kwargs):
+			sizes.append(data_output.datasets[0]['I_lockin'].size)
+			return multiply(data_output, *args, **kwargs)
+		monkeypatch.setattr(qp._processing, 'multiply', counting_multiply)
+		add_rows(range(3, 6))
+		live.poll()
+		assert sizes == [3]
+		np.testing.assert_allclose(live.datasets[0]['I_lockin'].values[:6], np.arange(6)*20)
+		## Changed Parameter settings reformat and process all data again
+		parameter.update(scale=100)
+		add_rows(range(6, 9))
+		live.poll()
+		assert sizes == [3, 9]
+		np.testing.assert_allclose(live.datasets[0]['I_lockin'].values, np.arange(9)*200)
+
+def test_polls_update_the_plots_in_place(running_measurement, database):
+	run_id, add_rows, complete = running_measurement
+	with qp.LiveDataOutput(run_id, reformat=False, db_path=database.path) as live:
+		live.show()
+		figure, artist = live.plots['fig'], live.plots['artists'][0]['artist']
+		add_rows(range(3, 9))
+		live.poll()
+		assert live.plots['fig'] is figure and live.plots['artists'][0]['artist'] is artist
+		np.testing.assert_allclose(artist.get_ydata(), np.arange(9))
+	plt.close('all')
+
+def test_follow_stops_when_the_run_completes(running_measurement, database, monkeypatch):
+	run_id, add_rows, complete = running_measurement
+	batches = [range(3, 6), range(6, 9)]
+	def measure(interval):
+		add_rows(batches.pop(0))
+		if not batches:
+			complete()
+	monkeypatch.setattr(qp.plt, 'pause', measure)
+	with qp.LiveDataOutput(run_id, reformat=False, db_path=database.path) as live:
+		live.follow(interval=0)
+		assert live.completed
+		## The rows written before completion are read by the last poll
+		np.testing.assert_allclose(live.datasets[0]['I_lockin'].values, np.arange(9))
+	plt.close('all')
+
+def test_follow_stops_after_the_timeout(running_measurement, database, monkeypatch):
+	run_id, add_rows, complete = running_measurement
+	pauses = []
+	monkeypatch.setattr(qp.plt, 'pause', pauses.append)
+	times = iter(range(100))
+	monkeypatch.setattr(qp.time, 'monotonic', lambda: next(times))
+	with qp.LiveDataOutput(run_id, reformat=False, db_path=database.path) as live:
+		live.follow(interval=0, timeout=2.5)
+		assert not live.completed
+		assert len(pauses) == 2
+	plt.close('all')
@@ -0,0 +1,110 @@
+import os, sys, subprocess, textwrap
+
+import numpy as np
+import xarray as xr
+import pytest
+
+from conftest import qp, root_directory
+
+def test_parallel_load_keeps_run_order(database):
+	run_ids = database.runs_1d + database.runs_2d
+	datasets, errors = qp.load_qcodes_runs_as_xarray(run_ids, workers=4)
+	assert errors == {}
+	assert [dataset.attrs['run_id'] for dataset in datasets] == run_ids
+
+@pytest.mark.filterwarnings('ignore:Could not load')
+def test_failing_run_is_reported(database):
+	data_output = qp.DataOutput(database.runs_1d + [9999], workers=2, reformat=False)
+	assert len(data_output.datasets) == len(database.runs_1d)
+	assert list(data_output.load_errors) == [9999]
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_threaded_load_in_fresh_process(database, tmp_path, cached):
+	## The first threaded load of a process imports dask and h5netcdf,
+	## which failed for some runs when the imports raced between the threads
+	script = textwrap.dedent(f"""
+		import sys, warnings
+		sys.path.insert(0, {root_directory!r})
+		warnings.simplefilter('error', UserWarning)
+		import qcodes as qc
+		qc.config.core.db_location = {database.path!r}
+		from output_dataset import DataOutput as qp
+		qp.Parameter.use_store(qp.JSONParameterStore({str(tmp_path / 'verbose_params.json')!r}))
+		qp.run_cache.directory = {str(tmp_path / 'run_cache')!r}
+		qp.run_cache.min_bytes = 0
+		data_output = qp.DataOutput({database.runs_1d + database.runs_2d!r}, workers=4, reformat=False)
+		assert not data_output.load_errors, data_output.load_errors
+		print(len(data_output.datasets))
+	""")
+	if cached:
+		subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, cwd=root_directory)
+	result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, cwd=root_directory)
+	assert result.returncode == 0, result.stderr
+	assert result.stdout.split()[-1] == str(len(database.runs_1d + database.runs_2d))
+
+@pytest.fixture
+def loaded_runs(monkeypatch):
+	## The run_ids loaded from the database, in order
+	loaded = []
+	load = qp.load_qcodes_as_xarray
+	def counted_load(run_id, *args, **kwargs):
+		loaded.append(run_id)
+		return load(run_id, *args, **kwargs)
+	monkeypatch.setattr(qp, 'load_qcodes_as_xarray', counted_load)
+	return loaded
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_slicing_lazy_output_loads_only_the_selected_runs(database, loaded_runs, workers):
+	run_ids = database.runs_1d + database.runs_2d
+	data_output = qp.DataOutput(run_ids, reformat=False, lazy=True, workers=workers)
+	assert loaded_runs == []
+	subset = data_output[1:3]
+	assert loaded_runs == []
+	assert [dataset.attrs['run_id'] for dataset in subset.datasets] == run_ids[1:3]
+	assert sorted(loaded_runs) == run_ids[1:3]
+	assert [dataset.attrs['run_id'] for dataset in data_output[(0, 4)].datasets] == [run_ids[0], run_ids[4]]
+	assert sorted(loaded_runs[2:]) == [run_ids[0], run_ids[4]]
+	## Runs loaded by a subset are not loaded again by the parent, with the memo
+	data_output.datasets
+	assert sorted(loaded_runs) == sorted(run_ids)
+
+def netcdf_map()->xr.Dataset:
+	rng = np.random.default_rng(5)
+	return xr.Dataset({'I_lockin': (('V_gate', 'V_bias'), rng.normal(size=(40, 30))), 'G': (('V_gate', 'V_bias'), rng.normal(size=(40, 30)))},
+		coords={'V_gate': np.linspace(-1, 1, 40), 'V_bias': np.linspace(0, 1, 30)})
+
+def test_netcdf4_variables_are_memory_mapped(tmp_path):
+	pytest.importorskip('h5netcdf')
+	dataset = netcdf_map()
+	path = str(tmp_path / 'map.nc')
+	dataset.to_netcdf(path, engine='h5netcdf', encoding={'G': {'zlib': True}})
+	opened = qp.load_netcdf_memmapped(path)
+	values = opened['I_lockin'].variable.data
+	assert isinstance(values, np.memmap) and not values.flags.writeable
+	## Compressed variables can not be mapped, and are read by xarray
+	assert not isinstance(opened['G'].variable.data, np.memmap)
+	xr.testing.assert_identical(opened.load(), dataset)
+	assert list(qp.load_netcdf_memmapped(path, data_keys=['G']).data_vars) == ['G']
+
+def test_netcdf3_files_are_opened_by_xarray(tmp_path):
+	dataset = netcdf_map()
+	path = str(tmp_path / 'map.nc')
+	dataset.to_netcdf(path, engine='scipy')
+	opened = qp.load_netcdf_memmapped(path, data_keys=['I_lockin'])
+	xr.testing.assert_identical(opened.load(), dataset[['I_lockin']])
+
+def test_processing_a_subset_of_files_keeps_the_parent(tmp_path):
+	pytest.importorskip('h5netcdf')
+	dataset = netcdf_map()
+	paths = [str(tmp_path / f'map_{idx}.nc') for idx in range(2)]
+	for path in paths:
+		dataset.to_netcdf(path, engine='h5netcdf')
+	data_output = qp.DataOutput.from_files(paths, reformat=False)
+	subset = data_output[0]
+	subset.multiply(2)
+	subset.normalize()
+	np.testing.assert_allclose(subset.datasets[0]['I_lockin'].max(), 1)
+	for opened in data_output.datasets:
+		xr.testing.assert_identical(opened.load(), dataset)
+	## The files are never written
+	xr.testing.assert_identical(xr.load_dataset(paths[0], engine='h5netcdf'), dataset)
@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+import xarray as xr
+import pytest
+from qcodes.parameters import ManualParameter
+from qcodes.dataset import Measurement, load_or_create_experiment, initialise_or_create_database_at
+
+from conftest import qp, write_run
+import _processing
+
+def test_memo_hands_out_copies(database):
+	run_id = database.runs_1d[0]
+	first = qp.DataOutput(run_id, reformat=False)
+	second = qp.DataOutput(run_id, reformat=False)
+	assert qp.DataOutput.memo.hits == 1
+	assert first.datasets[0] is not second.datasets[0]
+	## Every DataOutput gets private buffers that can be written to
+	values = second.datasets[0]['I_lockin'].values
+	assert not np.shares_memory(first.datasets[0]['I_lockin'].values, values)
+	assert values.flags.writeable
+
+def test_memoized_runs_can_be_written(database):
+	run_id = database.runs_1d[0]
+	original = qp.DataOutput(run_id, reformat=False).datasets[0].copy(deep=True)
+	data_output = qp.DataOutput(run_id)
+	data_output.reformat()
+	dataset = data_output.datasets[0]
+	dataset['I_lockin'].values -= 1
+	dataset['I_lockin'] -= 1
+	np.testing.assert_allclose(data_output.datasets[0]['I_lockin'].values, original['I_lockin'].values - 2)
+	xr.testing.assert_identical(qp.DataOutput(run_id, reformat=False).datasets[0], original)
+
+def test_custom_processing_on_memoized_run(database, monkeypatch):
+	def shift_values(data_output, shift):
+		for dataset in data_output.datasets:
+			for key in dataset.data_vars:
+				dataset[key].values -= shift
+	monkeypatch.setattr(_processing, 'shift_values', shift_values, raising=False)
+	run_id = database.runs_2d[0]
+	original = qp.DataOutput(run_id, reformat=False).datasets[0].copy(deep=True)
+	data_output = qp.DataOutput(run_id, reformat=False)
+	data_output.shift_values(0.5)
+	np.testing.assert_allclose(data_output.datasets[0]['G'].values, original['G'].values - 0.5)
+	xr.testing.assert_identical(qp.DataOutput(run_id, reformat=False).datasets[0], original)
+
+def test_parent_can_be_written_after_subsetting(database):
+	data_output = qp.DataOutput(database.runs_2d, reformat=False)
+	part = data_output[0]
+	original = part.datasets[0].copy(deep=True)
+	data_output.datasets[0]['G'].values *= 2
+	np.testing.assert_allclose(data_output.datasets[0]['G'].values, original['G'].values*2)
+	xr.testing.assert_identical(part.datasets[0], original)
+
+def test_builtin_processing_shares_the_memo(database):
+	run_id = database.runs_2d[0]
+	guid = qp.DataOutput(run_id, reformat=False).datasets[0].attrs['guid']
+	data_output = qp.DataOutput(run_id, reformat=False)
+	data_output.select({'V_bias': 0})
+	## The built-in functions copy shared buffers themselves, and only when writing to them
+	memoized = qp.DataOutput.memo.get((database.path, run_id, guid))
+	assert np.shares_memory(data_output._materialize()[0]['G'].values, memoized['G'].values)
+
+def test_replaced_database_is_not_served_from_the_memo(database, tmp_path):
+	db_path = str(tmp_path / 'replaced.db')
+	values = []
+	for value in (1., 2.):
+		if os.path.exists(db_path):
+			os.remove(db_path)
+		initialise_or_create_database_at(db_path)
+		experiment = load_or_create_experiment('replaced', sample_name='sample')
+		run_id = write_run(experiment, {'V_gate': np.arange(3.)}, {'I_lockin': np.full(3, value)})
+		values.append(qp.DataOutput(run_id, reformat=False).datasets[0]['I_lockin'].values[0])
+	assert values == [1., 2.]
+
+@pytest.mark.parametrize('inplace', [True, False])
+def test_processing_does_not_change_the_memo(database, inplace):
+	run_id = database.runs_2d[0]
+	original = qp.DataOutput(run_id, reformat=False).datasets[0].copy(deep=True)
+	processed = qp.DataOutput(run_id, reformat=False)
+	processed.multiply(3, inplace=inplace)
+	processed.normalize(inplace=inplace)
+	processed.adjust_axis('shift', shift_by=1, inplace=inplace)
+	xr.testing.assert_identical(qp.DataOutput(run_id, reformat=False).datasets[0], original)
+
+def test_reformat_does_not_change_the_memo(database):
+	run_id = database.runs_1d[1]
+	original = qp.DataOutput(run_id, reformat=False).datasets[0].copy(deep=True)
+	qp.Parameter('I_lockin', scale=1e9)
+	reformatted = qp.DataOutput(run_id).datasets[0]
+	np.testing.assert_allclose(reformatted['I_lockin'].values, original['I_lockin'].values*1e9)
+	xr.testing.assert_identical(qp.DataOutput(run_id, reformat=False).datasets[0], original)
+
+def test_running_measurement_is_not_memoized(database):
+	gate = ManualParameter('V_gate')
+	current = ManualParameter('I_lockin')
+	measurement = Measurement(exp=database.experiment)
+	measurement.register_parameter(gate)
+	measurement.register_parameter(current, setpoints=[gate])
+	runner = measurement.run(write_in_background=False)
+	datasaver = runner.__enter__()
+	try:
+		for value in range(3):
+			datasaver.add_result((gate, value), (current, value))
+		datasaver.flush_data_to_database(block=True)
+		assert qp.DataOutput(datasaver.run_id, reformat=False).datasets[0].sizes['V_gate'] == 3
+		for value in range(3, 6):
+			datasaver.add_result((gate, value), (current, value))
+	finally:
+		runner.__exit__(None, None, None)
+	assert qp.DataOutput.memo.stats()['entries'] == 0
+	assert qp.DataOutput(datasaver.run_id, reformat=False).datasets[0].sizes['V_gate'] == 6
@@ -0,0 +1,172 @@
+import os, stat, multiprocessing
+
+import numpy as np
+import pytest
+
+from conftest import qp
+
+def file_mode(file_path:str)->int:
+	return stat.S_IMODE(os.stat(file_path).st_mode)
+
+@pytest.fixture
+def store(tmp_path):
+	store = qp.JSONParameterStore(str(tmp_path / 'params.json'))
+	qp.Parameter.use_store(store)
+	return store
+
+@pytest.fixture
+def calls(store, monkeypatch):
+	## The number of times the store is read and written
+	calls = {'load': 0, 'save': 0}
+	for name in calls:
+		method = getattr(store, name)
+		def counted(*args, method=method, name=name, **kwargs):
+			calls[name] += 1
+			return method(*args, **kwargs)
+		monkeypatch.setattr(store, name, counted)
+	return calls
+
+def test_save_keeps_the_file_mode(store):
+	umask = os.umask(0o022)
+	try:
+		qp.Parameter('V_gate', unit='mV').save()
+		## A new file is created as open() would, not readable by the owner only as by mkstemp
+		assert file_mode(store.filename) == 0o644
+		os.chmod(store.filename, 0o664)
+		qp.Parameter('V_bias', unit='mV').save()
+		assert file_mode(store.filename) == 0o664
+	finally:
+		os.umask(umask)
+
+def test_reload_only_when_the_file_changed(store, calls):
+	qp.Parameter('V_gate', unit='mV').save()
+	qp.Parameter.reload()
+	qp.Parameter.reload()
+	assert calls['load'] == 0
+	## Another process writing the file
+	qp.JSONParameterStore(store.filename).save({'V_bias': {'verbose_name': 'Bias', 'unit': 'V', 'scale': 1., 'offset': 0.}})
+	qp.Parameter.reload()
+	assert calls['load'] == 1
+	assert qp.Parameter._instances['V_bias'].verbose_name == 'Bias'
+	qp.Parameter.reload()
+	assert calls['load'] == 1
+	qp.Parameter.reload(force=True)
+	assert calls['load'] == 2
+
+def test_batch_writes_once(store, calls):
+	with qp.Parameter.batch():
+		for idx in range(5):
+			qp.Parameter(f'gate_{idx}', unit='mV').save()
+		with qp.Parameter.batch():
+			qp.Parameter('V_bias', unit='mV').save()
+		assert calls['save'] == 0
+	assert calls['save'] == 1
+	assert set(qp.JSONParameterStore(store.filename).load()) == {*(f'gate_{idx}' for idx in range(5)), 'V_bias'}
+
+def test_reformat_writes_new_parameters_once(database, store, calls):
+	qp.DataOutput(database.runs_2d)
+	assert calls['save'] == 1
+	assert set(qp.JSONParameterStore(store.filename).load()) == {'V_gate', 'V_bias', 'I_lockin', 'G'}
+
+def save_parameters(filename:str, worker:int, n_params:int)->None:
+	## Run in a spawned process, every parameter is saved in a transaction of its own
+	from output_dataset._parameter_handler import SQLiteParameterStore
+	store = SQLiteParameterStore(filename)
+	try:
+		for idx in range(n_params):
+			store.save({f'gate_{worker}_{idx}': {'verbose_name': f'Gate {idx}', 'unit': 'mV', 'scale': float(worker), 'offset': 0.}})
+			store.save({'V_bias': {'verbose_name': 'Bias', 'unit': 'V', 'scale': float(worker), 'offset': 0.}})
+	finally:
+		store.close()
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+	store = qp.SQLiteParameterStore(str(tmp_path / 'params.sqlite'))
+	yield store
+	store.close()
+
+def test_sqlite_writers_in_parallel_lose_no_rows(sqlite_store):
+	assert sqlite_store._conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+	n_workers, n_params = 4, 25
+	context = multiprocessing.get_context('spawn')
+	processes = [context.Process(target=save_parameters, args=(sqlite_store.filename, worker, n_params)) for worker in range(n_workers)]
+	for process in processes:
+		process.start()
+	for process in processes:
+		process.join(timeout=120)
+		assert process.exitcode == 0
+	params = sqlite_store.load()
+	assert set(params) == {f'gate_{worker}_{idx}' for worker in range(n_workers) for idx in range(n_params)} | {'V_bias'}
+	assert all(params[f'gate_{worker}_0']['scale'] == worker for worker in range(n_workers))
+
+def test_sqlite_reload_only_when_another_connection_wrote(sqlite_store, monkeypatch):
+	qp.Parameter.use_store(sqlite_store)
+	loads = []
+	load = sqlite_store.load
+	monkeypatch.setattr(sqlite_store, 'load', lambda: loads.append(1) or load())
+	## Writes of this connection do not change the data version
+	qp.Parameter('V_gate', unit='mV').save()
+	qp.Parameter.reload()
+	assert loads == []
+	other = qp.SQLiteParameterStore(sqlite_store.filename)
+	try:
+		other.save({'V_bias': {'verbose_name': 'Bias', 'unit': 'V', 'scale': 2., 'offset': 0.}})
+	finally:
+		other.close()
+	qp.Parameter.reload()
+	assert len(loads) == 1
+	assert qp.Parameter._instances['V_bias'].scale == 2
+	assert qp.Parameter._instances['V_gate'].unit == 'mV'
+	qp.Parameter.reload()
+	assert len(loads) == 1
+
+def test_use_store_switches_the_store(store, sqlite_store, tmp_path):
+	qp.Parameter('V_gate', unit='mV').save()
+	## An empty store gets the current parameters
+	qp.Parameter.use_store(sqlite_store)
+	assert qp.Parameter.store() is sqlite_store
+	assert set(sqlite_store.load()) == {'V_gate'}
+	qp.Parameter('V_bias', unit='V').save()
+	assert set(sqlite_store.load()) == {'V_gate', 'V_bias'}
+	assert set(qp.JSONParameterStore(store.filename).load()) == {'V_gate'}
+	## A store holding parameters replaces the current ones
+	other = qp.JSONParameterStore(str(tmp_path / 'other.json'))
+	other.save({'G': {'verbose_name': 'Conductance', 'unit': 'S', 'scale': 1., 'offset': 0.}})
+	qp.Parameter.use_store(qp.JSONParameterStore(other.filename))
+	assert set(qp.Parameter._instances) == {'G'}
+	assert qp.Parameter.filename_params == other.filename
+
+def test_resolve_returns_arrays(store, calls):
+	qp.Parameter('V_gate', verbose_name='Gate', unit='mV', scale=1e3)
+	resolved = qp.Parameter.resolve(['V_gate', 'V_bias', 'V_gate'], defaults={'V_bias': ('Bias', 'V')})
+	assert all(isinstance(values, np.ndarray) for values in resolved)
+	assert list(resolved.verbose_names) == ['Gate', 'Bias', 'Gate']
+	assert list(resolved.units) == ['mV', 'V', 'mV']
+	np.testing.assert_array_equal(resolved.scales, [1e3, 1, 1e3])
+	np.testing.assert_array_equal(resolved.offsets, [0, 0, 0])
+	np.testing.assert_array_equal(resolved.identity, [False, True, False])
+	assert resolved.labels() == ['Gate (mV)', 'Bias (V)', 'Gate (mV)']
+	## The missing parameters are created and saved in a single write
+	assert calls['save'] == 1
+	assert qp.Parameter['V_bias'].verbose_name == 'Bias'
+
+def test_resolve_without_create_changes_nothing(store, calls):
+	resolved = qp.Parameter.resolve(['V_gate', 'V_bias'], defaults={'V_bias': ('Bias', 'V')}, create=False)
+	assert list(resolved.verbose_names) == ['V_gate', 'Bias']
+	assert list(resolved.units) == ['-', 'V']
+	np.testing.assert_array_equal(resolved.scales, [1, 1])
+	assert qp.Parameter._instances == {}
+	assert calls['save'] == 0
+	assert qp.JSONParameterStore(store.filename).load() == {}
+
+def test_update_rejects_unknown_attributes(store):
+	parameter = qp.Parameter('V_gate')
+	parameter.update(unit='mV', scale=2)
+	assert (parameter.unit, parameter.scale) == ('mV', 2)
+	with pytest.raises(KeyError):
+		parameter.update(units='V')
+	## Parameters have no instance dictionary, attributes can not be added by mistake
+	assert not hasattr(parameter, '__dict__')
+	with pytest.raises(AttributeError):
+		parameter.units = 'V'
+	assert qp.JSONParameterStore(store.filename).load()['V_gate']['unit'] == 'mV'
@@ -0,0 +1,133 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import xarray as xr
+import pytest
+import matplotlib.pyplot as plt
+
+from conftest import qp
+from _pipeline import Pipeline, FusedStep
+
+def map_output(integer:bool=False)->'qp.DataOutput':
+	rng = np.random.default_rng(4)
+	values = rng.integers(-50, 50, size=(40, 30)) if integer else rng.normal(size=(40, 30))
+	dataset = xr.Dataset({'signal': (('x', 'y'), values), 'other': (('x', 'y'), values[::-1]*2)},
+		coords={'x': np.linspace(-1, 1, 40), 'y': np.linspace(0, 3, 30)})
+	return qp.DataOutput(dataset, reformat=False)
+
+def run_both(pipeline:Pipeline, integer:bool=False)->tuple:
+	optimized, plain = map_output(integer), map_output(integer)
+	pipeline.run(optimized)
+	pipeline.run(plain, optimize=False)
+	return optimized.datasets[0], plain.datasets[0]
+
+def record(*calls)->Pipeline:
+	pipeline = Pipeline()
+	for name,args,kwargs in calls:
+		pipeline.record(name, *args, **kwargs)
+	return pipeline
+
+fusable_chains = {
+	'multiply > multiply': [('multiply', (2,), {}), ('multiply', (-0.5,), {})],
+	'normalize > multiply': [('normalize', (), {}), ('multiply', (1e3,), {})],
+	'multiply > normalize': [('multiply', (-3,), {}), ('normalize', (), {})],
+	'inverse normalize': [('multiply', (2,), {}), ('normalize', (), {'inverse': True}), ('multiply', (5,), {})],
+	'out of place': [('multiply', (2,), {'inplace': False}), ('normalize', (), {'inplace': False})],
+}
+
+@pytest.mark.parametrize('integer', [False, True])
+@pytest.mark.parametrize('chain', list(fusable_chains))
+def test_fused_steps_match_separate_steps(chain, integer):
+	pipeline = record(*fusable_chains[chain])
+	optimized_steps = list(pipeline.optimized())
+	assert len(optimized_steps) == 1 and isinstance(optimized_steps[0], FusedStep)
+	optimized, plain = run_both(pipeline, integer)
+	xr.testing.assert_allclose(optimized, plain)
+	assert optimized['signal'].dtype == plain['signal'].dtype
+
+def test_select_moves_before_commuting_steps():
+	pipeline = record(('multiply', (2,), {}), ('transpose', (), {}), ('select', ({'x': slice(-0.5, 0.5)},), {}),
+		('normalize', (), {}), ('select', ({'y': 1.5},), {}))
+	assert [step.name for step in pipeline.optimized()] == ['select', 'multiply', 'transpose', 'normalize', 'select']
+	optimized, plain = run_both(pipeline)
+	xr.testing.assert_allclose(optimized, plain)
+
+def test_select_stays_after_normalize_and_adjust_axis():
+	pipeline = record(('normalize', (), {}), ('select', ({'x': slice(0, 1)},), {}),
+		('adjust_axis', ('shift',), {'shift_by': 1}), ('select', ({'x': slice(1, 1.5)},), {}))
+	assert [step.name for step in pipeline.optimized()] == [step.name for step in pipeline]
+	optimized, plain = run_both(pipeline)
+	xr.testing.assert_allclose(optimized, plain)
+
+def test_unfused_restores_the_recorded_steps():
+	pipeline = record(*fusable_chains['inverse normalize'], ('transpose', (), {}))
+	assert [repr(step) for step in pipeline.optimized().unfused()] == [repr(step) for step in pipeline]
+
+def test_deferred_processing_matches_direct_processing(database):
+	deferred = qp.DataOutput(database.runs_2d, reformat=False, deferred_processing=True)
+	direct = qp.DataOutput(database.runs_2d, reformat=False)
+	for data_output in (deferred, direct):
+		data_output.multiply(2)
+		data_output.normalize()
+		data_output.select({'V_bias': 0.1})
+	assert len(deferred.pending) == 3
+	deferred.compute()
+	assert len(deferred.pending) == 0
+	for result,expected in zip(deferred.datasets, direct.datasets):
+		xr.testing.assert_allclose(result, expected)
+
+def test_subset_of_deferred_output_does_not_run_steps_twice(database):
+	data_output = qp.DataOutput(database.runs_2d, reformat=False, deferred_processing=True)
+	raw = [dataset.copy(deep=True) for dataset in data_output.datasets]
+	data_output.multiply(2)
+	## Showing a subset runs the pending steps on the subset only
+	subset = data_output[0]
+	subset.show()
+	plt.close('all')
+	np.testing.assert_allclose(subset.datasets[0]['I_lockin'].values, raw[0]['I_lockin'].values*2)
+	data_output.compute()
+	for dataset,expected in zip(data_output.datasets, raw):
+		np.testing.assert_allclose(dataset['I_lockin'].values, expected['I_lockin'].values*2)
+
+def process(data_output:'qp.DataOutput', mapping='shift')->None:
+	data_output.multiply(2)
+	data_output.normalize()
+	data_output.adjust_axis(mapping, adjust='V_gate', shift_by=1)
+
+def spawn_executor(*args, mp_context=None, **kwargs)->ProcessPoolExecutor:
+	return ProcessPoolExecutor(*args, mp_context=multiprocessing.get_context('spawn'), **kwargs)
+
+@pytest.mark.parametrize('workers,start_method', [(1, None), (2, 'fork'), (2, 'spawn')])
+def test_replayed_pipeline_matches_direct_processing(database, monkeypatch, workers, start_method):
+	if start_method == 'spawn':
+		monkeypatch.setattr(qp, 'ProcessPoolExecutor', spawn_executor)
+	trial = qp.DataOutput(database.runs_2d[0])
+	process(trial)
+	replayed = trial.apply_to_runs(database.runs_2d, workers=workers, db_path=database.path, progress=False)
+	direct = qp.DataOutput(database.runs_2d)
+	process(direct)
+	assert replayed.load_errors == {}
+	for result,expected in zip(replayed.datasets, direct.datasets):
+		xr.testing.assert_allclose(result, expected)
+
+def test_replay_of_unpicklable_pipeline(database, monkeypatch):
+	trial = qp.DataOutput(database.runs_2d[0])
+	process(trial, mapping=lambda coord, shift_by: coord + shift_by)
+	## Forked workers inherit the pipeline
+	replayed = trial.apply_to_runs(database.runs_2d, workers=2, db_path=database.path, progress=False)
+	np.testing.assert_allclose(replayed.datasets[0]['V_gate'].values, trial.datasets[0]['V_gate'].values)
+	monkeypatch.setattr(qp.multiprocessing, 'get_all_start_methods', lambda: ['spawn', 'forkserver'])
+	with pytest.raises(ValueError, match='can not be pickled'):
+		trial.apply_to_runs(database.runs_2d, workers=2, db_path=database.path, progress=False)
+
+def test_steps_copy_containers_and_keep_arrays():
+	weights = np.linspace(0.5, 2, 1000)
+	selection = {'x': [0, 1], 'y': slice(0, 1)}
+	pipeline = record(('select', (selection,), {}), ('reduce', ('x', 'mean'), {'weights': weights}))
+	selection['x'].append(2)
+	selection['z'] = 0
+	## Changing a selection afterwards does not change the plan
+	assert pipeline[0].args[0] == {'x': [0, 1], 'y': slice(0, 1)}
+	## Arrays are recorded by reference
+	assert pipeline[1].kwargs['weights'] is weights
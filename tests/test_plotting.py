@@ -0,0 +1,75 @@
+import io, os
+
+import numpy as np
+import xarray as xr
+import matplotlib.pyplot as plt
+from matplotlib.collections import QuadMesh
+from matplotlib.image import AxesImage
+
+from conftest import qp
+import _autoplot
+
+def read_parameter_file()->str:
+	if not os.path.exists(qp.Parameter.filename_params):
+		return None
+	with open(qp.Parameter.filename_params) as file:
+		return file.read()
+
+def test_show_does_not_create_parameters(database):
+	before = read_parameter_file()
+	data_output = qp.DataOutput(database.runs_1d[:1] + database.runs_2d, reformat=False)
+	data_output.show()
+	plt.close('all')
+	assert qp.Parameter._instances == {}
+	assert read_parameter_file() == before
+
+def test_layout_labels_with_the_parameters(database):
+	qp.Parameter('I_lockin', verbose_name='Current', unit='nA')
+	datasets = qp.DataOutput(database.runs_2d[0], data_keys=['I_lockin'], reformat=False).datasets
+	var, plotted_dims, n_cuts, labels, attr_labels = _autoplot._layout_signature(datasets)[0]
+	## Keys without a Parameter are labelled by the attributes of the data
+	assert labels == ('V_gate ()', 'V_bias ()', 'Current (nA)')
+	assert list(qp.Parameter._instances) == ['I_lockin']
+
+def random_map(size:int, seed:int=0)->xr.Dataset:
+	values = np.random.default_rng(seed).normal(size=(size, size))
+	return xr.Dataset({'signal': (('y', 'x'), values)}, coords={'y': np.arange(size, dtype=float), 'x': np.arange(size, dtype=float)})
+
+def axis_pixels(artist, dpi:float)->tuple:
+	bbox = artist.axes.get_window_extent()
+	return int(np.ceil(bbox.height*dpi/artist.figure.dpi)), int(np.ceil(bbox.width*dpi/artist.figure.dpi))
+
+def test_small_maps_are_drawn_in_full():
+	plot_output = _autoplot.autoplot([random_map(201)])
+	artist = plot_output['artists'][0]['artist']
+	assert isinstance(artist, QuadMesh)
+	plot_output['fig'][0].savefig(io.BytesIO(), format='png')
+	assert artist.get_array().shape == (201, 201)
+	plt.close('all')
+
+def test_large_maps_are_decimated_when_drawn():
+	dataset = random_map(2000)
+	plot_output = _autoplot.autoplot([dataset])
+	artist = plot_output['artists'][0]['artist']
+	figure = plot_output['fig'][0]
+	assert isinstance(artist, AxesImage)
+	shapes = []
+	for dpi in (100, 300):
+		figure.savefig(io.BytesIO(), format='png', dpi=dpi)
+		## The decimated map fits the axis after the layout is done, at the resolution of the output
+		shape = artist.get_array().shape
+		assert all(size <= pixels for size,pixels in zip(shape, axis_pixels(artist, dpi)))
+		assert np.nanmax(artist.get_array()) == dataset['signal'].max()
+		shapes.append(shape)
+	assert shapes[1][0] > 2*shapes[0][0] and shapes[1][1] > 2*shapes[0][1]
+	plt.close('all')
+
+def test_decimated_maps_are_updated():
+	plot_output = _autoplot.autoplot([random_map(2000)])
+	artist = plot_output['artists'][0]['artist']
+	updated = random_map(2000, seed=1)
+	assert _autoplot.update_autoplot(plot_output, [updated])
+	plot_output['fig'][0].savefig(io.BytesIO(), format='png')
+	assert np.nanmax(artist.get_array()) == updated['signal'].max()
+	assert np.nanmin(artist.get_array()) == updated['signal'].min()
+	plt.close('all')
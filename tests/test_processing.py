@@ -0,0 +1,186 @@
+import tracemalloc, importlib.util
+
+import numpy as np
+import xarray as xr
+import pytest
+import matplotlib.pyplot as plt
+
+from conftest import qp
+from _pipeline import Pipeline
+
+def noisy_dataset(with_nan:bool=False)->xr.Dataset:
+	rng = np.random.default_rng(0)
+	values = rng.normal(size=(7, 5, 3))
+	if with_nan:
+		values[1, 2, 0] = np.nan
+		values[4, :, 1] = np.nan
+	return xr.Dataset({'signal': (('repeat', 'x', 'y'), values, {'units': 'A'}), 'offset': (('x',), rng.normal(size=5))},
+		coords={'repeat': np.arange(7.), 'x': np.linspace(0, 1, 5), 'y': np.linspace(-1, 1, 3)},
+		attrs={'run_id': 1})
+
+def reduced(dataset:xr.Dataset, *args, **kwargs)->xr.Dataset:
+	data_output = qp.DataOutput(dataset, reformat=False)
+	data_output.reduce(*args, **kwargs)
+	return data_output.datasets[0]
+
+@pytest.mark.parametrize('with_nan', [False, True])
+@pytest.mark.parametrize('method', ['mean', 'median', 'sum', 'std'])
+def test_reduce_matches_xarray(method, with_nan):
+	dataset = noisy_dataset(with_nan)
+	result = reduced(dataset, 'repeat', method)
+	expected = getattr(dataset['signal'], method)(dim='repeat')
+	np.testing.assert_allclose(result['signal'].values, expected.values)
+	assert 'repeat' not in result.dims
+	## Variables without the dimension are kept, with the attributes of the data and dataset
+	xr.testing.assert_identical(result['offset'], dataset['offset'])
+	assert result['signal'].attrs == dataset['signal'].attrs
+	assert result.attrs == dataset.attrs
+
+def test_reduce_by_coordinate_index():
+	dataset = noisy_dataset()
+	xr.testing.assert_identical(reduced(dataset, 1, 'mean'), reduced(dataset, 'x', 'mean'))
+
+@pytest.mark.parametrize('method', ['mean', 'median', 'sum', 'std'])
+def test_weighted_reduce_matches_xarray(method):
+	dataset = noisy_dataset()
+	weights = np.linspace(0.5, 2, 7)
+	result = reduced(dataset, 'repeat', method, weights=weights)
+	weighted = dataset['signal'].weighted(xr.DataArray(weights, dims=['repeat']))
+	if method == 'median':
+		expected = weighted.quantile(0.5, dim='repeat')
+	else:
+		expected = getattr(weighted, method)(dim='repeat')
+	np.testing.assert_allclose(result['signal'].values, expected.values)
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 100])
+@pytest.mark.parametrize('with_nan', [False, True])
+@pytest.mark.parametrize('method', ['mean', 'sum', 'std'])
+def test_streaming_reduce_matches_xarray(method, with_nan, chunk_size):
+	dataset = noisy_dataset(with_nan)
+	result = reduced(dataset, 'repeat', method, chunk_size=chunk_size)
+	expected = getattr(dataset['signal'], method)(dim='repeat')
+	np.testing.assert_allclose(result['signal'].values, expected.values)
+
+@pytest.mark.parametrize('method', ['mean', 'sum', 'std'])
+def test_weighted_streaming_reduce_matches_xarray(method):
+	dataset = noisy_dataset(with_nan=True)
+	weights = np.linspace(0.5, 2, 7)
+	result = reduced(dataset, 'repeat', method, weights=weights, chunk_size=2)
+	expected = getattr(dataset['signal'].weighted(xr.DataArray(weights, dims=['repeat'])), method)(dim='repeat')
+	np.testing.assert_allclose(result['signal'].values, expected.values)
+
+def test_streaming_std_uses_ddof():
+	dataset = noisy_dataset()
+	result = reduced(dataset, 'repeat', 'std', chunk_size=2, ddof=1)
+	np.testing.assert_allclose(result['signal'].values, dataset['signal'].std(dim='repeat', ddof=1).values)
+
+def test_lazy_reduce_matches_xarray():
+	pytest.importorskip('dask')
+	dataset = noisy_dataset(with_nan=True)
+	result = reduced(dataset.chunk({'repeat': 2}), 'repeat', 'mean', chunk_size=2)
+	np.testing.assert_allclose(result['signal'].values, dataset['signal'].mean(dim='repeat').values)
+
+def test_reduce_rejects_unsupported_methods():
+	with pytest.raises(ValueError):
+		reduced(noisy_dataset(), 'repeat', 'max')
+	with pytest.raises(ValueError):
+		reduced(noisy_dataset(), 'repeat', 'median', chunk_size=2)
+
+def owned_output(shape=(500, 500))->'qp.DataOutput':
+	rng = np.random.default_rng(3)
+	dataset = xr.Dataset({'signal': (('x', 'y'), rng.normal(size=shape)), 'noise': (('x', 'y'), rng.normal(size=shape))},
+		coords={'x': np.arange(shape[0], dtype=float), 'y': np.arange(shape[1], dtype=float)})
+	return qp.DataOutput(dataset, reformat=False)
+
+@pytest.mark.parametrize('subset', [lambda data_output: data_output[0], lambda data_output: data_output['I_lockin']])
+def test_processing_subset_keeps_parent(database, subset):
+	data_output = qp.DataOutput(database.runs_2d, reformat=False)
+	original = [dataset.copy(deep=True) for dataset in data_output.datasets]
+	part = subset(data_output)
+	part.multiply(2)
+	part.normalize()
+	part.adjust_axis('shift', shift_by=1)
+	assert not part.datasets[0].identical(original[0][list(part.datasets[0].data_vars)])
+	for dataset,expected in zip(data_output.datasets, original):
+		xr.testing.assert_identical(dataset, expected)
+
+def test_processing_parent_keeps_subset(database):
+	data_output = qp.DataOutput(database.runs_2d, reformat=False)
+	part = data_output[1]
+	original = part.datasets[0].copy(deep=True)
+	data_output.multiply(2)
+	data_output.adjust_axis('centre', adjust='V_gate')
+	xr.testing.assert_identical(part.datasets[0], original)
+	np.testing.assert_allclose(data_output.datasets[1]['G'].values, original['G'].values*2)
+
+@pytest.mark.parametrize('inplace', [True, False])
+def test_processing_memory(inplace):
+	data_output = owned_output()
+	values = data_output.datasets[0]['signal'].values
+	nbytes = data_output.datasets[0].nbytes
+	tracemalloc.start()
+	data_output.normalize(inplace=inplace)
+	data_output.multiply(3, inplace=inplace)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	## In place the owned buffers are reused, out of place every step copies the data variables,
+	## and the result of the previous step is only freed once the next one is done
+	assert np.shares_memory(data_output.datasets[0]['signal'].values, values) == inplace
+	if inplace:
+		assert peak < 0.05*nbytes
+	else:
+		assert 1.9*nbytes < peak < 2.1*nbytes
+
+@pytest.mark.parametrize('inverse', [False, True])
+def test_normalize_leaves_nan_out_of_the_range(inverse):
+	dataset = noisy_dataset(with_nan=True)
+	data_output = qp.DataOutput(dataset.copy(deep=True), reformat=False)
+	data_output.normalize(inverse=inverse)
+	result = data_output.datasets[0]['signal'].values
+	values = dataset['signal'].values
+	low, high = np.nanmin(values), np.nanmax(values)
+	expected = (values - low)/(high - low) if not inverse else (high - values)/(high - low)
+	np.testing.assert_allclose(result, expected)
+	assert np.array_equal(np.isnan(result), np.isnan(values))
+	## Dask-backed data and the fused pipeline give the same result
+	pipeline = Pipeline()
+	pipeline.record('normalize', inverse=inverse)
+	pipeline.record('multiply', 2)
+	fused = qp.DataOutput(dataset.copy(deep=True), reformat=False)
+	pipeline.run(fused)
+	np.testing.assert_allclose(fused.datasets[0]['signal'].values, 2*expected, atol=1e-12)
+	if importlib.util.find_spec('dask') is not None:
+		lazy = qp.DataOutput(dataset.chunk({'repeat': 2}), reformat=False)
+		lazy.normalize(inverse=inverse)
+		np.testing.assert_allclose(lazy.datasets[0]['signal'].values, expected, atol=1e-12)
+
+def test_helpers_are_not_processing_methods():
+	data_output = owned_output((3, 3))
+	assert callable(data_output.normalize)
+	for name in ('_target', '_writable_values', '_copy_on_write_functions'):
+		assert hasattr(qp._processing, name)
+		with pytest.raises(AttributeError):
+			getattr(data_output, name)
+
+@pytest.mark.parametrize('deferred_processing', [False, True])
+def test_chunked_output_stays_lazy_until_shown(database, deferred_processing):
+	pytest.importorskip('dask')
+	from dask.callbacks import Callback
+	computes = []
+	class CountComputes(Callback):
+		def _start(self, dsk):
+			computes.append(dsk)
+	with CountComputes():
+		data_output = qp.DataOutput(database.runs_2d, chunks={'V_gate': 2}, deferred_processing=deferred_processing)
+		data_output.normalize()
+		data_output.multiply(2)
+		data_output.select({'V_bias': slice(0, 0.5)})
+		data_output.average_outerdim()
+		data_output.compute()
+		assert computes == []
+		for dataset in data_output.datasets:
+			assert all(qp._processing._is_lazy(dataset[key]) for key in dataset.data_vars)
+		## Only plotting reads the values
+		data_output.show()
+		assert computes
+	plt.close('all')
@@ -0,0 +1,126 @@
+import os, sys, datetime
+
+import numpy as np
+import pytest
+import qcodes as qc
+from qcodes.parameters import ManualParameter
+from qcodes.dataset import Measurement, load_or_create_experiment, initialise_or_create_database_at
+
+from conftest import write_run
+from output_dataset import _run_index
+from output_dataset._run_index import RunIndex, run_index
+
+dac_path = 'station.parameters.dac.value'
+
+@pytest.fixture
+def runs(tmp_path):
+	"""
+		A database with 1D and 2D runs of I_lockin in experiment 'sweeps' and a 1D run of G in 'checks',
+		each with the value of a dac parameter in its station snapshot
+	"""
+	db_path = str(tmp_path / 'index_test.db')
+	initialise_or_create_database_at(db_path)
+	dac = ManualParameter('dac', initial_value=0)
+	station = qc.Station(dac)
+	sweeps = load_or_create_experiment('sweeps', sample_name='device_1')
+	checks = load_or_create_experiment('checks', sample_name='device_2')
+	gate, bias = np.linspace(-1, 1, 5), np.linspace(0, 1, 3)
+	run_ids = {}
+	dac(0.1)
+	run_ids['1d'] = write_run(sweeps, {'V_gate': gate}, {'I_lockin': gate})
+	dac(0.2)
+	run_ids['2d'] = write_run(sweeps, {'V_gate': gate, 'V_bias': bias}, {'I_lockin': np.zeros((5, 3))})
+	dac(0.3)
+	run_ids['check'] = write_run(checks, {'V_bias': bias}, {'G': bias})
+	yield db_path, run_ids, station
+	qc.Station.default = None
+
+@pytest.fixture
+def index(runs, tmp_path):
+	index = RunIndex(runs[0], snapshot_paths=[dac_path], directory=str(tmp_path / 'run_index'))
+	yield index
+	index.close()
+
+def test_query_by_parameters(runs, index):
+	db_path, run_ids, station = runs
+	assert index.query() == sorted(run_ids.values())
+	assert index.query(dependent='I_lockin') == [run_ids['1d'], run_ids['2d']]
+	assert index.query(dependent='I_lockin', independent=['V_gate', 'V_bias']) == [run_ids['2d']]
+	assert index.query(independent='V_bias', ndim=1) == [run_ids['check']]
+	assert index.query(dependent='I_lockin', independent='V_other') == []
+
+def test_query_by_names(runs, index):
+	db_path, run_ids, station = runs
+	assert index.query(exp_name='sweeps') == [run_ids['1d'], run_ids['2d']]
+	assert index.query(sample_name='device_*') == sorted(run_ids.values())
+	assert index.query(exp_name='check?', sample_name='device_2') == [run_ids['check']]
+
+def test_query_by_time(runs, index):
+	db_path, run_ids, station = runs
+	timestamps = index.to_dataframe()['run_timestamp']
+	start = timestamps[run_ids['2d']]
+	assert index.query(since=start) == [run_ids['2d'], run_ids['check']]
+	assert index.query(until=start) == [run_ids['1d'], run_ids['2d']]
+	## Times are also given as datetime, ISO string, or timedelta before now
+	hour_ago = datetime.datetime.now() - datetime.timedelta(hours=1)
+	assert index.query(since=hour_ago) == sorted(run_ids.values())
+	assert index.query(until=hour_ago.isoformat()) == []
+	assert index.query(since=datetime.timedelta(hours=1)) == sorted(run_ids.values())
+
+def test_query_by_snapshot(runs, index):
+	db_path, run_ids, station = runs
+	assert index.query(snapshot={dac_path: 0.2}) == [run_ids['2d']]
+	assert index.query(dependent='I_lockin', snapshot={dac_path: lambda value: value > 0.15}) == [run_ids['2d']]
+	with pytest.raises(KeyError):
+		index.query(snapshot={'station.parameters.other.value': 1})
+
+def test_update_only_reads_new_and_running_runs(runs, index):
+	db_path, run_ids, station = runs
+	assert index.update() == 3
+	assert index.update() == 0
+	gate = ManualParameter('V_gate')
+	current = ManualParameter('I_lockin')
+	measurement = Measurement(exp=load_or_create_experiment('sweeps', sample_name='device_1'), station=station)
+	measurement.register_parameter(gate)
+	measurement.register_parameter(current, setpoints=[gate])
+	runner = measurement.run(write_in_background=False)
+	datasaver = runner.__enter__()
+	try:
+		datasaver.add_result((gate, 0), (current, 0))
+		datasaver.flush_data_to_database(block=True)
+		assert index.query(completed=False) == [datasaver.run_id]
+		## The running run is read again at every update until it completes
+		assert index.update() == 1
+	finally:
+		runner.__exit__(None, None, None)
+	assert index.query(completed=False) == []
+	assert index.query(dependent='I_lockin', ndim=1) == [run_ids['1d'], datasaver.run_id]
+	assert index.update() == 0
+
+def test_changed_snapshot_paths_reindex(runs, index, tmp_path):
+	db_path, run_ids, station = runs
+	index.update()
+	other = RunIndex(db_path, directory=str(tmp_path / 'run_index'))
+	try:
+		assert len(other) == 0
+		assert other.query() == sorted(run_ids.values())
+	finally:
+		other.close()
+
+def test_default_directory_is_in_the_user_cache(runs, tmp_path, monkeypatch):
+	db_path, run_ids, station = runs
+	monkeypatch.setenv('HOME', str(tmp_path))
+	monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / '.cache'))
+	monkeypatch.setitem(sys.modules, 'platformdirs', None)
+	monkeypatch.setattr(_run_index, '_run_indices', {})
+	directory = str(tmp_path / '.cache' / 'output_dataset' / 'run_index')
+	RunIndex(db_path, snapshot_paths=[dac_path]).close()
+	assert os.listdir(directory)
+	## The shared index keeps the snapshot paths stored in the default directory
+	index = run_index(db_path)
+	try:
+		assert index.directory == directory
+		assert index.snapshot_paths == [dac_path]
+		assert index.query(snapshot={dac_path: 0.2}) == [run_ids['2d']]
+	finally:
+		index.close()
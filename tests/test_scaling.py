@@ -0,0 +1,94 @@
+import numpy as np
+import xarray as xr
+import pytest
+import matplotlib.pyplot as plt
+
+from conftest import qp
+
+def test_deferred_scaling_follows_parameter_changes(database):
+	run_id = database.runs_1d[0]
+	raw = qp.DataOutput(run_id, reformat=False).datasets[0]
+	parameter = qp.Parameter('I_lockin', scale=1e9)
+	data_output = qp.DataOutput(run_id, deferred_scaling=True)
+	## The datasets hold the raw values, the scaling is applied when reading the scaled datasets
+	with pytest.warns(UserWarning, match='raw values') as record:
+		np.testing.assert_array_equal(data_output.datasets[0]['I_lockin'].values, raw['I_lockin'].values)
+		data_output.datasets
+	assert len(record) == 1
+	np.testing.assert_allclose(data_output.scaled_datasets[0]['I_lockin'].values, raw['I_lockin'].values*1e9)
+	parameter.scale = 1e3
+	np.testing.assert_allclose(data_output.scaled_datasets[0]['I_lockin'].values, raw['I_lockin'].values*1e3)
+
+@pytest.mark.filterwarnings('ignore:The datasets hold the raw values')
+def test_processing_subset_keeps_parent_deferred(database):
+	qp.Parameter('I_lockin', scale=10)
+	qp.Parameter('V_gate', scale=1e3)
+	data_output = qp.DataOutput(database.runs_2d, deferred_scaling=True)
+	original = [dataset.copy(deep=True) for dataset in data_output.datasets]
+	subset = data_output[0]
+	subset.multiply(2)
+	subset.adjust_axis('shift', shift_by=1)
+	np.testing.assert_allclose(subset.datasets[0]['I_lockin'].values, original[0]['I_lockin'].values*20)
+	for dataset,expected in zip(data_output.datasets, original):
+		xr.testing.assert_identical(dataset, expected)
+		assert dataset.attrs['deferred_scaling']
+
+def two_pass_reformat(dataset:xr.Dataset)->xr.Dataset:
+	## Reformatting as done before the coordinates were rescaled at once and the data in a single pass:
+	## every coordinate assigned on its own, and the offset and scale applied to the data one after the other
+	for key in dataset.coords:
+		parameter = qp.Parameter[key]
+		attrs = dataset[key].attrs
+		dataset = dataset.assign_coords({key: (dataset[key].values - parameter.offset)*parameter.scale})
+		dataset[key].attrs = attrs
+	for key in dataset.variables:
+		parameter = qp.Parameter[key]
+		dataset[key].attrs.update({'long_name': parameter.verbose_name, 'unit': parameter.unit, 'units': parameter.unit})
+	for key in dataset.data_vars:
+		parameter = qp.Parameter[key]
+		values = dataset[key].values
+		values -= parameter.offset
+		values *= parameter.scale
+	return dataset
+
+def large_map()->xr.Dataset:
+	## More values than fit in a block of _apply_affine, and not a multiple of it
+	rng = np.random.default_rng(6)
+	return xr.Dataset({
+			'I_lockin': (('V_gate', 'V_bias'), rng.normal(size=(301, 299))),
+			'G': (('V_gate', 'V_bias'), rng.normal(size=(301, 299)).astype(np.float32)),
+			'T': (('V_gate',), rng.normal(size=301), {'long_name': 'Temperature', 'units': 'K'}),
+		},
+		coords={'V_gate': ('V_gate', np.linspace(-1, 1, 301), {'units': 'V'}), 'V_bias': np.linspace(0, 1, 299)})
+
+@pytest.mark.parametrize('inplace', [True, False])
+def test_reformat_matches_two_passes(inplace):
+	dataset = large_map()
+	assert dataset['I_lockin'].size > qp._affine_block_size
+	qp.Parameter('V_gate', verbose_name='Gate', unit='mV', scale=1e3, offset=0.1)
+	qp.Parameter('I_lockin', unit='nA', scale=1e9, offset=-2)
+	qp.Parameter('G', scale=3)
+	## Parameters of the other variables are created from their attributes
+	result = qp._reformat_dataset(dataset.copy(deep=True), inplace=inplace)
+	assert (qp.Parameter['T'].verbose_name, qp.Parameter['T'].unit) == ('Temperature', 'K')
+	expected = two_pass_reformat(dataset.copy(deep=True))
+	for key,variable in result.variables.items():
+		parameter = qp.Parameter[key]
+		assert variable.attrs.pop('parameter_scale') == parameter.scale
+		assert variable.attrs.pop('parameter_offset') == parameter.offset
+	xr.testing.assert_allclose(result, expected, rtol=1e-6)
+	xr.testing.assert_identical(result, expected.assign(G=result['G']).assign_coords(V_gate=result['V_gate']))
+	assert result['I_lockin'].attrs['units'] == 'nA' and result['T'].attrs['long_name'] == 'Temperature'
+	assert result['V_bias'].attrs['long_name'] == 'V_bias' and result['V_gate'].attrs['long_name'] == 'Gate'
+	assert result['G'].dtype == np.float32
+
+def test_processing_deferred_output_does_not_warn(database, recwarn):
+	qp.Parameter('I_lockin', scale=10)
+	data_output = qp.DataOutput(database.runs_2d, deferred_scaling=True)
+	data_output.select({'V_bias': slice(0, 0.5)})
+	data_output.transpose()
+	data_output.show()
+	plt.close('all')
+	np.testing.assert_allclose(data_output.scaled_datasets[0]['I_lockin'].values,
+		qp.DataOutput(database.runs_2d).datasets[0]['I_lockin'].sel(V_bias=slice(0, 0.5)).transpose().values)
+	assert not [warning for warning in recwarn if 'raw values' in str(warning.message)]
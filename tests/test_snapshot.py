@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+import xarray as xr
+import pytest
+
+from conftest import qp
+from _snapshot import SnapshotIndex, SnapshotCache, snapshot_cache
+
+def make_snapshot(voltage, label:str='gate')->dict:
+	return {'station': {'instruments': {'dac': {'name': 'dac', 'parameters': {
+		'ch01': {'value': voltage, 'unit': 'V', 'label': label},
+		'ch02': {'value': None, 'unit': 'V', 'label': 'bias'},
+	}}}, 'parameters': {}}}
+
+def make_dataset(snapshot:dict=None, guid:str=None)->xr.Dataset:
+	attrs = {} if snapshot is None else {'snapshot': json.dumps(snapshot)}
+	if guid is not None:
+		attrs['guid'] = guid
+	return xr.Dataset({'I_lockin': (('V_gate',), np.zeros(3))}, coords={'V_gate': np.arange(3.)}, attrs=attrs)
+
+@pytest.fixture(autouse=True)
+def clear_snapshot_cache():
+	snapshot_cache.clear()
+	yield
+	snapshot_cache.clear()
+
+def test_get_resolves_paths():
+	index = SnapshotIndex(make_snapshot(0.5))
+	assert index.get('station.instruments.dac.parameters.ch01.value') == 0.5
+	assert index.get('station.instruments.dac.parameters.ch01') == {'value': 0.5, 'unit': 'V', 'label': 'gate'}
+	## Values that are None are found, missing paths and paths through a leaf give the default
+	assert 'station.instruments.dac.parameters.ch02.value' in index
+	assert index.get('station.instruments.dac.parameters.ch02.value', 'missing') is None
+	assert index.get('station.instruments.dac.parameters.ch03.value', 'missing') == 'missing'
+	assert index.get('station.instruments.dac.name.value', 'missing') == 'missing'
+	assert 'station.instruments.other' not in index
+
+def test_get_matches_a_fresh_lookup_after_caching():
+	index = SnapshotIndex(make_snapshot(0.5))
+	paths = ['station.instruments.dac.parameters.ch01.unit', 'station.missing', 'station.parameters']
+	first = [index.get(path, 'missing') for path in paths]
+	assert [index.get(path, 'missing') for path in paths] == first == ['V', 'missing', {}]
+
+def test_paths_match_the_flattened_snapshot():
+	index = SnapshotIndex(make_snapshot(0.5))
+	assert index.paths('station.instruments.dac.parameters.*.value') == [
+		'station.instruments.dac.parameters.ch01.value', 'station.instruments.dac.parameters.ch02.value']
+	## Empty branches are leaves
+	assert 'station.parameters' in index.paths()
+	assert all(index.get(path) == value for path,value in index.flat.items())
+
+def test_cache_parses_every_run_once():
+	cache = SnapshotCache(max_entries=2)
+	first = make_dataset(make_snapshot(1), guid='a')
+	index = cache.index(first)
+	assert cache.index(first.copy()) is index
+	assert cache.index(make_dataset()) is None
+	## Least recently used snapshots are dropped
+	second = make_dataset(make_snapshot(2), guid='b')
+	second_index = cache.index(second)
+	cache.index(first)
+	cache.index(make_dataset(make_snapshot(3), guid='c'))
+	assert cache.index(first) is index
+	assert cache.index(second) is not second_index
+	assert len(cache._indices) == 2
+
+def test_disabled_cache_keeps_nothing():
+	cache = SnapshotCache(enabled=False)
+	dataset = make_dataset(make_snapshot(1), guid='a')
+	assert cache.index(dataset).get('station.instruments.dac.parameters.ch01.value') == 1
+	assert cache.index(dataset) is not cache.index(dataset)
+
+def test_snapshot_values_of_data_output():
+	datasets = [make_dataset(make_snapshot(value), guid=str(idx)) for idx,value in enumerate([0.1, 0.2, None])]
+	data_output = qp.DataOutput(datasets + [make_dataset()], reformat=False)
+	values = data_output.snapshot_values('station.instruments.dac.parameters.ch01.value')
+	assert values.dtype == float
+	np.testing.assert_array_equal(values, [0.1, 0.2, np.nan, np.nan])
+	labels = data_output.snapshot_values('station.instruments.dac.parameters.ch01.label', default='')
+	assert list(labels) == ['gate', 'gate', 'gate', '']
+	snapshots = data_output.snapshots()
+	assert snapshots[0] == make_snapshot(0.1) and snapshots[-1] is None